@@ -0,0 +1,145 @@
+"""JSON serialization for the /api/v1 routes.
+
+Serializers take the plain rows returned by `queries` and build compact
+payloads: authors are listed once in a `users` map and messages refer to
+them by id. `orjson` is used when installed, otherwise the stdlib encoder
+with compact separators.
+"""
+
+import json
+from datetime import date
+
+from flask import current_app
+
+from queries import timeline_next_cursor, connections_cursor
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(obj):
+    """Fallback for types the stdlib encoder can't handle."""
+
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(payload):
+    """Encode `payload` as compact JSON bytes."""
+
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+    return json.dumps(payload, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Build a JSON response from `payload`."""
+
+    return current_app.response_class(dumps(payload), status=status,
+                                      mimetype='application/json')
+
+
+def json_error(message, status):
+    """Build a JSON error response."""
+
+    return json_response({"error": message}, status=status)
+
+
+def parse_limit(value, default, maximum=None):
+    """A `limit` querystring value: `default` if missing, at most `maximum`.
+
+    Raises ValueError, with a message for the client, unless it's a
+    positive whole number.
+    """
+
+    if value is None:
+        return default
+
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("limit must be a positive whole number.") from None
+
+    if limit < 1:
+        raise ValueError("limit must be a positive whole number.")
+
+    return limit if maximum is None else min(limit, maximum)
+
+
+def serialize_timeline(rows, limit, liked_ids=None):
+    """Serialize timeline rows into messages, an author map and a cursor.
+
+    If `liked_ids` is given, each message gets a `liked` flag.
+    """
+
+    messages = []
+    users = {}
+
+    for row in rows:
+        message = {
+            "id": row.id,
+            "text": row.text,
+            "timestamp": row.timestamp,
+            "user_id": row.user_id,
+        }
+        if liked_ids is not None:
+            message["liked"] = row.id in liked_ids
+        messages.append(message)
+
+        if row.user_id not in users:
+            users[row.user_id] = {
+                "id": row.user_id,
+                "username": row.username,
+                "image_url": row.image_url,
+            }
+
+    next_cursor = timeline_next_cursor(rows, limit)
+
+    return {"messages": messages, "users": users, "next_cursor": next_cursor}
+
+
+def serialize_profile(row):
+    """Serialize a `queries.user_profile` row."""
+
+    return {
+        "id": row.id,
+        "username": row.username,
+        "image_url": row.image_url,
+        "header_image_url": row.header_image_url,
+        "bio": row.bio,
+        "location": row.location,
+        "viewer_follows": row.viewer_follows,
+        "counts": {
+            "messages": row.messages_count,
+            "following": row.following_count,
+            "followers": row.followers_count,
+            "likes": row.likes_count,
+        },
+    }
+
+
+def serialize_card(row):
+    """Serialize a user card row (`queries.CONNECTION_COLUMNS`)."""
+
+    return {
+        "id": row.id,
+        "username": row.username,
+        "image_url": row.image_url,
+        "header_image_url": row.header_image_url,
+        "bio": row.bio,
+    }
+
+
+def serialize_connections(rows, limit):
+    """Serialize following/followers rows with a cursor."""
+
+    users = [
+        dict(serialize_card(row), viewer_follows=row.viewer_follows)
+        for row in rows
+    ]
+
+    return {"users": users, "next_cursor": connections_cursor(rows, limit)}
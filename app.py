@@ -1,14 +1,32 @@
+import hmac
+import mimetypes
 import os
-import pdb
 
 from secrets import sneakybeaky
 
 from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import Response, abort, get_flashed_messages, send_from_directory, stream_with_context
 from sqlalchemy.exc import IntegrityError
 
+import api
+import assets
+import compress
+import dbpool
+import graph
+import images
+import likebuffer
+import popular
+import profiling
+import queries
+import replicas
+import sessions
+import slowlog
+import tags
+import templating
+import timelines
+import warmup
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, DEFAULT_DATABASE_URL, User, Message, Follows
 
 CURR_USER_KEY = "curr_user"
 
@@ -17,15 +35,101 @@ app = Flask(__name__)
 # Get DB_URI from environ variable (useful for production/testing) or,
 # if not set there, use development local db.
 app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+    os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL))
+
+# Connection pool and statement timeout settings (see dbpool.py); each
+# can be overridden with an environment variable of the same name.
+app.config.update(dbpool.pool_config_from_env())
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbpool.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+
+# Comma-separated replica URLs; GET requests read from one of these.
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+
+# After a client POSTs a change, read its requests from the primary for
+# this many seconds so it sees its own writes.
+app.config['REPLICA_STICKY_SECONDS'] = 5
+
+# bcrypt work factor for password hashes; the tests lower it (conftest.py).
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = sneakybeaky
-toolbar = DebugToolbarExtension(app)
+
+# Stream long list pages (users, following, followers, likes) instead of
+# rendering them fully in memory before sending.
+app.config['STREAM_LIST_PAGES'] = os.environ.get('STREAM_LIST_PAGES') == '1'
+
+# Rows fetched per round trip when iterating list page queries, and
+# template fragments buffered per chunk when streaming.
+app.config['LIST_PAGE_YIELD_PER'] = 100
+app.config['STREAM_BUFFER_SIZE'] = 20
+
+# Compiled templates are shared between worker processes through this
+# directory (see templating.py) and, unless WARM_TEMPLATES=0, all loaded
+# at startup. Templates are only checked for changes in development.
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+    'TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja-cache'))
+app.config['WARM_TEMPLATES'] = os.environ.get('WARM_TEMPLATES', '1') == '1'
+app.config['TEMPLATES_AUTO_RELOAD'] = app.env == 'development'
+
+# 'cookie' (Flask's signed cookie sessions), or 'memory' or 'sqlite' to
+# keep sessions server-side (see sessions.py).
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'cookie')
+
+# Sampling profiler (see profiling.py): profile this fraction of requests,
+# every request slower than PROFILE_SLOW_MS, and requests sending
+# PROFILE_TOKEN in an X-Profile header.
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_MS'] = (
+    float(os.environ['PROFILE_SLOW_MS']) if os.environ.get('PROFILE_SLOW_MS') else None)
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['PROFILE_FORMAT'] = os.environ.get('PROFILE_FORMAT', 'collapsed')
+
+# Cache home timelines in this file, shared by the workers on this host
+# (see timelines.py); not cached if unset.
+app.config['TIMELINE_CACHE_PATH'] = os.environ.get('TIMELINE_CACHE_PATH')
+
+# Like toggles are buffered per worker and written out in batches this
+# many seconds after the first (see likebuffer.py); 0 writes each one out
+# before responding. The tests set it to 0 (conftest.py).
+app.config['LIKE_FLUSH_SECONDS'] = float(os.environ.get('LIKE_FLUSH_SECONDS', 1))
+
+# Rank only the newest this many matches of a message search (0: rank them
+# all, which takes seconds for common words in a large table); the search
+# page says when results were left out.
+app.config['SEARCH_MAX_CANDIDATES'] = int(
+    os.environ.get('SEARCH_MAX_CANDIDATES', queries.SEARCH_MAX_CANDIDATES)) or None
+
+# Comma-separated hosts profile images may be fetched from to be resized
+# (see images.py); unset: any host with a public address.
+app.config['IMAGE_PROXY_HOSTS'] = (
+    [host.strip().lower() for host in os.environ['IMAGE_PROXY_HOSTS'].split(',') if host.strip()]
+    if os.environ.get('IMAGE_PROXY_HOSTS') else None)
+
+# Bearer token for the /admin routes; they're disabled without one.
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+
+# The debug toolbar is only shown in debug mode (FLASK_ENV=development),
+# and it's slow to import and set up, so only load it then.
+if app.debug:
+    from flask_debugtoolbar import DebugToolbarExtension
+    toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+profiling.init_app(app)
+replicas.init_app(app)
+images.init_app(app)
+assets.init_app(app)
+compress.init_app(app)
+sessions.init_app(app, CURR_USER_KEY)
+timelines.init_app(app)
+likebuffer.init_app(app)
+warmup.init_app(app)
+templating.init_app(app)
 
 
 ##############################################################################
@@ -46,6 +150,7 @@ def add_user_to_g():
 def do_login(user):
     """Log in user."""
 
+    sessions.regenerate()
     session[CURR_USER_KEY] = user.id
 
 
@@ -125,6 +230,49 @@ def logout():
     return redirect('/')
 
 
+@app.route('/logout/everywhere', methods=['POST'])
+def logout_everywhere():
+    """Log the current user out of all their sessions."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if not sessions.logout_everywhere(app, g.user.id):
+        flash("Sessions can't be ended elsewhere with cookie sessions.", "danger")
+        return redirect("/users/profile")
+
+    do_logout()
+    flash("Logged out everywhere.", "info")
+    return redirect('/')
+
+
+##############################################################################
+# Rendering helpers:
+
+
+def render_list_page(template_name, **context):
+    """Render a long list page, streaming it if STREAM_LIST_PAGES is set.
+
+    When streaming, the header and first cards are flushed while the rest
+    of the (yield_per) query is still being iterated.
+    """
+
+    if not app.config['STREAM_LIST_PAGES']:
+        return render_template(template_name, **context)
+
+    # Pop flashed messages now, while the session cookie can still be
+    # updated; base.html reads the cached copy during streaming.
+    get_flashed_messages(with_categories=True)
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+
+    return Response(stream_with_context(stream))
+
+
 ##############################################################################
 # General user routes:
 
@@ -137,53 +285,97 @@ def list_users():
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = User.query
+
+    if search:
+        users = users.filter(User.username.like(f"%{search}%"))
 
-    return render_template('users/index.html', users=users)
+    users = users.yield_per(app.config['LIST_PAGE_YIELD_PER'])
+
+    return render_list_page('users/index.html', users=users)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = likebuffer.user_profile(user_id, viewer_id=g.user and g.user.id)
+
+    if user is None:
+        abort(404)
+
+    messages = queries.user_timeline(user_id)
+    return render_template('users/show.html', user=user, messages=messages,
+                           social=social_context(user_id))
+
+
+def social_context(user_id):
+    """Follow-graph details for the profile sidebar, or None if logged out.
+
+    On your own profile: who to follow. On anyone else's: how many
+    followers you share and which people you follow also follow them.
+    """
+
+    if not g.user:
+        return None
+
+    follow_graph = graph.get_graph()
+
+    if user_id == g.user.id:
+        suggested_ids = [suggested_id for suggested_id, _
+                         in follow_graph.suggestions(g.user.id)]
+        return {"suggestions": queries.users_by_ids(suggested_ids)}
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    followed_by = sorted(follow_graph.followed_by_following(g.user.id, user_id))
+
+    return {
+        "mutual_followers": follow_graph.mutual_followers(g.user.id, user_id),
+        "followed_by": queries.users_by_ids(followed_by[:3]),
+        "followed_by_count": len(followed_by),
+    }
 
 
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
-
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    return render_connections('users/following.html', queries.following, user_id)
 
 
 @app.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
+    return render_connections('users/followers.html', queries.followers, user_id)
+
+
+def render_connections(template_name, lookup, user_id):
+    """Shared body of the following/followers pages.
+
+    Runs one projected, paginated query for the cards, including whether
+    the logged in user follows each one.
+    """
+
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    try:
+        after = queries.parse_id_cursor(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    user = likebuffer.user_profile(user_id, viewer_id=g.user.id)
+
+    if user is None:
+        abort(404)
+
+    limit = queries.CONNECTIONS_LIMIT
+    users = lookup(user_id, viewer_id=g.user.id, after=after, limit=limit)
+    next_cursor = queries.connections_cursor(users, limit)
+
+    return render_list_page(template_name, user=user, users=users,
+                            next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>/likes')
@@ -194,18 +386,14 @@ def users_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = likebuffer.user_profile(user_id, viewer_id=g.user.id)
 
-    user_liked_ids = [liked_message.id for liked_message in user.likes]
+    if user is None:
+        abort(404)
 
-    messages = (Message
-                .query
-                .filter(Message.id.in_(user_liked_ids))
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    messages = likebuffer.liked_timeline(user_id)
 
-    return render_template('users/likes.html', user=user, messages=messages)
+    return render_list_page('users/likes.html', user=user, messages=messages)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -216,11 +404,24 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    user_id = g.user.id
 
-    return redirect(f"/users/{g.user.id}/following")
+    if not queries.user_exists(follow_id):
+        abort(404)
+
+    try:
+        added = Follows.follow(user_id, follow_id)
+        db.session.commit()
+    except IntegrityError:
+        # The user was deleted after the existence check.
+        db.session.rollback()
+        abort(404)
+
+    if added:
+        graph.note_follow(user_id, follow_id)
+        timelines.note_follow_change(user_id)
+
+    return redirect(f"/users/{user_id}/following")
 
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
@@ -231,11 +432,16 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    user_id = g.user.id
+
+    removed = Follows.unfollow(user_id, follow_id)
     db.session.commit()
 
-    return redirect(f"/users/{g.user.id}/following")
+    if removed:
+        graph.note_unfollow(user_id, follow_id)
+        timelines.note_follow_change(user_id)
+
+    return redirect(f"/users/{user_id}/following")
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
@@ -281,6 +487,7 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    sessions.logout_everywhere(app, g.user.id)
     do_logout()
 
     db.session.delete(g.user)
@@ -308,13 +515,46 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        tags.index_message(msg)
+        author_id, message_id = msg.user_id, msg.id
         db.session.commit()
+        timelines.note_message(author_id, message_id)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search message text.
+
+    Takes the search in a 'q' param; results are ranked best match first
+    and paginated with a 'cursor' param. Only the newest
+    SEARCH_MAX_CANDIDATES matches are ranked; the page says when older
+    ones were left out.
+    """
+
+    q = request.args.get('q', '').strip()
+
+    try:
+        after = queries.parse_search_cursor(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    limit = queries.SEARCH_LIMIT
+    max_candidates = app.config['SEARCH_MAX_CANDIDATES']
+    messages = queries.search_messages(q, after=after, limit=limit,
+                                       max_candidates=max_candidates)
+    next_cursor = queries.search_next_cursor(messages, limit)
+    truncated = queries.search_truncated(q, max_candidates)
+
+    return render_template('messages/search.html', q=q, messages=messages,
+                           next_cursor=next_cursor, truncated=truncated,
+                           max_candidates=max_candidates)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
@@ -332,45 +572,179 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    tags.unindex_message(msg)
+    author_id = msg.user_id
     db.session.delete(msg)
     db.session.commit()
+    timelines.note_message_deleted(author_id)
 
     return redirect(f"/users/{g.user.id}")
 
 
+##############################################################################
+# Tag and mention routes:
+
+@app.route('/tags/<tag>')
+def tags_show(tag):
+    """Show messages tagged #tag, newest first, with the trending tags."""
+
+    tag = tag.lower()
+
+    try:
+        before = queries.parse_timeline_cursor(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    limit = queries.TIMELINE_LIMIT
+    messages = queries.tag_timeline(tag, before=before, limit=limit)
+
+    return render_template('tags/show.html', tag=tag, messages=messages,
+                           next_cursor=queries.timeline_next_cursor(messages, limit),
+                           trending=tags.trending_tags())
+
+
+@app.route('/users/<int:user_id>/mentions')
+def users_mentions(user_id):
+    """Show messages mentioning this user, newest first."""
+
+    try:
+        before = queries.parse_timeline_cursor(request.args.get('cursor'))
+    except ValueError:
+        abort(400)
+
+    user = likebuffer.user_profile(user_id, viewer_id=g.user and g.user.id)
+
+    if user is None:
+        abort(404)
+
+    limit = queries.TIMELINE_LIMIT
+    messages = queries.mentions_timeline(user_id, before=before, limit=limit)
+
+    return render_template('users/mentions.html', user=user, messages=messages,
+                           next_cursor=queries.timeline_next_cursor(messages, limit))
+
+
 ##############################################################################
 # Like routes:
 
 @app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def toggle_like(message_id):
-    """A user can toggle to like a message"""
+    """A user can toggle to like a message.
 
-    if not g.user:
-        flash("Access unauthorized.", "danger")
+    The change is buffered and written out with others (see likebuffer.py).
+    The like buttons' script asks for JSON, {"message_id": ..., "liked":
+    ...}; plain form posts are redirected to the homepage.
+    """
+
+    wants_json = (request.accept_mimetypes.best_match(['text/html', 'application/json'])
+                  == 'application/json')
+
+    def refuse(message, status):
+        if wants_json:
+            return api.json_error(message, status)
+        flash(message, "danger")
         return redirect("/")
-    
-    user = g.user
-    message = Message.query.get(message_id)
 
-    if message.user != user:
+    if not g.user:
+        return refuse("Access unauthorized.", 401)
 
-        if message not in user.likes:
-            like = Likes(
-                user_id = user.id,
-                message_id = message.id
-            )
-            db.session.add(like)
-            db.session.commit()
-            return redirect('/')
+    generation = likebuffer.generation()
+    target = queries.like_target(message_id, g.user.id)
 
-        liked_message = Likes.query.filter(Likes.user_id == user.id, Likes.message_id == message.id).one()
-        db.session.delete(liked_message)
-        db.session.commit()
+    if target is None:
+        if wants_json:
+            return api.json_error("Message not found.", 404)
+        abort(404)
 
-        return redirect('/')
+    if target.user_id == g.user.id:
+        return refuse("You cannnot like your own messages.", 403)
+
+    liked = likebuffer.toggle(g.user.id, message_id, target.timestamp, target.liked_at,
+                             generation)
+
+    if wants_json:
+        return api.json_response({"message_id": message_id, "liked": liked})
+
+    return redirect('/')
+
+
+@app.route('/popular')
+def popular_messages():
+    """Show recent messages ranked by their time-decayed likes."""
+
+    top = popular.get_top_messages().top(queries.TIMELINE_LIMIT)
+    like_counts = dict(top)
+    messages = queries.messages_by_ids(message_id for message_id, _ in top)
+
+    return render_template('messages/popular.html', messages=messages,
+                           like_counts=like_counts)
+
+
+##############################################################################
+# Static asset routes
+
+
+@app.route('/assets/<path:filename>')
+def assets_show(filename):
+    """Serve a fingerprinted asset (see assets.py), precompressed if accepted."""
+
+    sent, encoding = assets.encoded_file(filename, request.accept_encodings)
+
+    resp = send_from_directory(app.config['ASSETS_DIR'], sent,
+                               mimetype=mimetypes.guess_type(filename)[0])
+    resp.headers['Cache-Control'] = images.IMMUTABLE_CACHE_CONTROL
+    resp.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+
+##############################################################################
+# Image routes
+
+
+@app.route('/images/<size>')
+def images_resize(size):
+    """Resize the image signed into ?src= and redirect to the cached copy.
+
+    Remote images are fetched in the background (see images.py); until
+    they're resized, and if they can't be fetched or read, this redirects
+    to the original URL. One that failed isn't tried again for
+    IMAGE_RETRY_SECONDS.
+    """
+
+    url = images.source_url(request.args.get('src', ''))
+    if size not in images.IMAGE_SIZES or url is None:
+        abort(404)
 
-    flash("You cannnot like your own messages.", "danger")
-    return redirect("/")
+    name = images.cached_name(url, size)
+
+    if name is None:
+        if images.failed(url, size):
+            return redirect(url)
+
+        if not url.startswith('/static/'):
+            images.queue_thumbnail(url, size)
+            return redirect(url)
+
+        try:
+            name = images.make_thumbnail(url, size)
+        except images.ImageError:
+            return redirect(url)
+
+    return redirect(f"/images/{size}/{name}")
+
+
+@app.route('/images/<size>/<name>')
+def images_show(size, name):
+    """Serve a cached, resized image; its name is its content hash."""
+
+    if size not in images.IMAGE_SIZES:
+        abort(404)
+
+    resp = send_from_directory(os.path.join(app.config['IMAGE_CACHE_DIR'], size), name)
+    resp.headers['Cache-Control'] = images.IMMUTABLE_CACHE_CONTROL
+    return resp
 
 
 ##############################################################################
@@ -386,22 +760,221 @@ def homepage():
     """
 
     if g.user:
-        user_following_ids = [followed_user.id for followed_user in g.user.following] + [g.user.id]
-        user_likes_ids = [liked_message.id for liked_message in g.user.likes]
-
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(user_following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        messages = timelines.home_timeline(g.user.id)
+        user_likes_ids = likebuffer.liked_message_ids(g.user.id, [msg.id for msg in messages])
 
-        return render_template('home.html', messages=messages, likes=user_likes_ids)
+        return render_template('home.html', messages=messages, likes=user_likes_ids,
+                               profile=likebuffer.user_profile(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
+##############################################################################
+# JSON API routes:
+#
+# JSON equivalents of the timeline, profile and follow pages. Lists are
+# paginated with an opaque `cursor` returned as `next_cursor`.
+
+
+def api_page_args(parse_cursor, default_limit):
+    """Read `cursor` and `limit` from the querystring.
+
+    Raises ValueError for a malformed cursor or limit.
+    """
+
+    cursor = parse_cursor(request.args.get('cursor'))
+    limit = api.parse_limit(request.args.get('limit'), default_limit, maximum=default_limit)
+
+    return cursor, limit
+
+
+@app.route('/api/v1/timeline')
+def api_homepage():
+    """Timeline for the logged in user: their messages and those they follow."""
+
+    if not g.user:
+        return api.json_error("Access unauthorized.", 401)
+
+    try:
+        before, limit = api_page_args(queries.parse_timeline_cursor,
+                                      queries.TIMELINE_LIMIT)
+    except ValueError as err:
+        return api.json_error(str(err), 400)
+
+    rows = queries.home_timeline(g.user.id, before=before, limit=limit)
+    liked_ids = likebuffer.liked_message_ids(g.user.id, [row.id for row in rows])
+
+    return api.json_response(api.serialize_timeline(rows, limit, liked_ids))
+
+
+@app.route('/api/v1/users/<int:user_id>')
+def api_users_show(user_id):
+    """User profile with counts and their most recent messages."""
+
+    try:
+        before, limit = api_page_args(queries.parse_timeline_cursor,
+                                      queries.TIMELINE_LIMIT)
+    except ValueError as err:
+        return api.json_error(str(err), 400)
+
+    profile = likebuffer.user_profile(user_id, viewer_id=g.user and g.user.id)
+
+    if profile is None:
+        return api.json_error("User not found.", 404)
+
+    rows = queries.user_timeline(user_id, before=before, limit=limit)
+
+    payload = api.serialize_timeline(rows, limit)
+    payload["user"] = api.serialize_profile(profile)
+
+    return api.json_response(payload)
+
+
+@app.route('/api/v1/users/<int:user_id>/likes')
+def api_users_likes(user_id):
+    """Messages liked by this user."""
+
+    if not g.user:
+        return api.json_error("Access unauthorized.", 401)
+
+    try:
+        before, limit = api_page_args(queries.parse_timeline_cursor,
+                                      queries.TIMELINE_LIMIT)
+    except ValueError as err:
+        return api.json_error(str(err), 400)
+
+    if not queries.user_exists(user_id):
+        return api.json_error("User not found.", 404)
+
+    rows = queries.liked_timeline(user_id, before=before, limit=limit)
+
+    return api.json_response(api.serialize_timeline(rows, limit))
+
+
+@app.route('/api/v1/users/<int:user_id>/following')
+def api_show_following(user_id):
+    """Users this user is following."""
+
+    return api_connections(queries.following, user_id)
+
+
+@app.route('/api/v1/users/<int:user_id>/followers')
+def api_users_followers(user_id):
+    """Users following this user."""
+
+    return api_connections(queries.followers, user_id)
+
+
+@app.route('/api/v1/suggestions')
+def api_suggestions():
+    """Who to follow: friends-of-friends of the logged in user."""
+
+    if not g.user:
+        return api.json_error("Access unauthorized.", 401)
+
+    suggestions = graph.get_graph().suggestions(g.user.id)
+    rows = queries.users_by_ids([user_id for user_id, _ in suggestions])
+    scores = dict(suggestions)
+
+    return api.json_response({"users": [
+        dict(api.serialize_card(row), followed_by_following=scores[row.id])
+        for row in rows
+    ]})
+
+
+@app.route('/api/v1/users/<int:user_id>/mutuals')
+def api_mutuals(user_id):
+    """Followers shared with the logged in user, and who you follow that follows them."""
+
+    if not g.user:
+        return api.json_error("Access unauthorized.", 401)
+
+    if not queries.user_exists(user_id):
+        return api.json_error("User not found.", 404)
+
+    follow_graph = graph.get_graph()
+    followed_by = sorted(follow_graph.followed_by_following(g.user.id, user_id))
+
+    return api.json_response({
+        "mutual_followers": follow_graph.mutual_followers(g.user.id, user_id),
+        "followed_by_following": [api.serialize_card(row) for row
+                                  in queries.users_by_ids(followed_by)],
+    })
+
+
+def api_connections(lookup, user_id):
+    """Shared body of the following/followers API routes."""
+
+    if not g.user:
+        return api.json_error("Access unauthorized.", 401)
+
+    try:
+        after, limit = api_page_args(queries.parse_id_cursor,
+                                     queries.CONNECTIONS_LIMIT)
+    except ValueError as err:
+        return api.json_error(str(err), 400)
+
+    if not queries.user_exists(user_id):
+        return api.json_error("User not found.", 404)
+
+    rows = lookup(user_id, viewer_id=g.user.id, after=after, limit=limit)
+
+    return api.json_response(api.serialize_connections(rows, limit))
+
+
+##############################################################################
+# Admin routes:
+#
+# Operational views for whoever holds ADMIN_TOKEN, sent as
+# `Authorization: Bearer <token>`. Without an ADMIN_TOKEN they don't exist.
+
+def admin_authorized():
+    """Raise 404 if there's no ADMIN_TOKEN; is the request's token right?"""
+
+    token = app.config['ADMIN_TOKEN']
+    if not token:
+        abort(404)
+
+    sent = request.headers.get('Authorization', '')
+    return hmac.compare_digest(sent, f"Bearer {token}")
+
+
+@app.route('/admin/slow-queries', methods=["GET", "DELETE"])
+def admin_slow_queries():
+    """Slowest statements by fingerprint, per engine; DELETE clears them.
+
+    Takes `sort` (total_ms, max_ms or count) and `limit` in the querystring.
+    """
+
+    if not admin_authorized():
+        return api.json_error("Access unauthorized.", 403)
+
+    engines = {'primary': db.engine}
+    engines.update((f"replica{i}", engine)
+                   for i, engine in enumerate(replicas.replica_engines(app), 1))
+
+    logs = {name: getattr(engine, 'slow_queries', None) for name, engine in engines.items()}
+
+    if request.method == 'DELETE':
+        for log in logs.values():
+            if log is not None:
+                log.reset()
+        return ('', 204)
+
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in slowlog.SORT_KEYS:
+        return api.json_error(f"sort must be one of {', '.join(slowlog.SORT_KEYS)}", 400)
+
+    try:
+        limit = api.parse_limit(request.args.get('limit'), 20)
+    except ValueError as err:
+        return api.json_error(str(err), 400)
+
+    return api.json_response({name: log and log.as_dict(limit, sort)
+                              for name, log in logs.items()})
+
+
 ##############################################################################
 # Turn off all caching in Flask
 #   (useful for dev; in production, this kind of stuff is typically
@@ -411,7 +984,14 @@ def homepage():
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers on every request.
+
+    Content-addressed responses (resized images, fingerprinted assets)
+    keep their immutable Cache-Control.
+    """
+
+    if req.headers.get("Cache-Control") == images.IMMUTABLE_CACHE_CONTROL:
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
@@ -0,0 +1,383 @@
+"""ASGI serving mode for the read-only pages.
+
+Serves GET /, /users/<id>, /users/<id>/likes and /messages/<id> without
+holding a worker per slow database round trip. It runs side-by-side with
+the WSGI app (app:app), which keeps serving everything else:
+
+    uvicorn asgi:application --workers 2
+
+with the proxy sending those four routes here. Anything else gets a 404.
+
+Flask 1.1 has no async views and SQLAlchemy 1.3 has no asyncio support, so
+this module awaits queries itself: the statements from `queries` are
+compiled for PostgreSQL and run on psycopg2 connections in asynchronous
+mode, polled from the event loop. Flask is only used for the I/O-free
+parts -- reading the session cookie, rendering the same templates and
+running after_request handlers.
+"""
+
+import asyncio
+import os
+import sys
+from collections import namedtuple
+from functools import lru_cache, partial
+from io import BytesIO
+
+import psycopg2
+from psycopg2 import extensions
+from flask import flash, g, redirect, render_template
+from sqlalchemy.dialects.postgresql import psycopg2 as pg_dialect
+from sqlalchemy.engine.url import make_url
+from werkzeug.exceptions import HTTPException, NotFound
+
+import queries
+from app import app, CURR_USER_KEY
+
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+
+
+##############################################################################
+# Async database access
+
+
+@lru_cache(maxsize=None)
+def _row_class(names):
+    return namedtuple('Row', names)
+
+
+class AsyncPostgres:
+    """A small pool of psycopg2 connections in asynchronous mode.
+
+    `latency` adds a simulated delay to every query (for benchmarks).
+    """
+
+    def __init__(self, uri, size=ASYNC_DB_POOL_SIZE, connect_args=None, latency=0):
+        self.dialect = pg_dialect.dialect()
+        args, kwargs = self.dialect.create_connect_args(make_url(uri))
+        kwargs.update(connect_args or {})
+
+        self._connect_args = args, kwargs
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.latency = latency
+
+    async def _wait(self, connection):
+        """Poll `connection` until its current operation completes."""
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            state = connection.poll()
+
+            if state == extensions.POLL_OK:
+                return
+
+            if state == extensions.POLL_READ:
+                watch, unwatch = loop.add_reader, loop.remove_reader
+            elif state == extensions.POLL_WRITE:
+                watch, unwatch = loop.add_writer, loop.remove_writer
+            else:
+                raise psycopg2.OperationalError(f"Unexpected poll state: {state}")
+
+            ready = loop.create_future()
+            fd = connection.fileno()
+            watch(fd, lambda: ready.done() or ready.set_result(None))
+
+            try:
+                await ready
+            finally:
+                unwatch(fd)
+
+    async def _connect(self):
+        args, kwargs = self._connect_args
+        connection = psycopg2.connect(*args, async_=True, **kwargs)
+        await self._wait(connection)
+        return connection
+
+    async def fetch(self, statement):
+        """Run a Core select and return its rows as namedtuples."""
+
+        compiled = statement.compile(dialect=self.dialect)
+
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+
+            try:
+                cursor = connection.cursor()
+                cursor.execute(str(compiled), compiled.params)
+                await self._wait(connection)
+
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                names = tuple(column.name for column in cursor.description)
+                rows = cursor.fetchall()
+            except BaseException:
+                connection.close()
+                raise
+
+            self._idle.append(connection)
+
+        row_class = _row_class(names)
+        return [row_class._make(row) for row in rows]
+
+    async def fetch_one(self, statement):
+        rows = await self.fetch(statement)
+        return rows[0] if rows else None
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+_databases = {}
+
+
+def get_database():
+    """The AsyncPostgres pool for the running event loop."""
+
+    loop = asyncio.get_running_loop()
+
+    if loop not in _databases:
+        options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        _databases[loop] = AsyncPostgres(app.config['SQLALCHEMY_DATABASE_URI'],
+                                         connect_args=options.get('connect_args'))
+
+    return _databases[loop]
+
+
+def close_database():
+    """Close the running event loop's pool."""
+
+    database = _databases.pop(asyncio.get_running_loop(), None)
+    if database is not None:
+        database.close()
+
+
+##############################################################################
+# Template adapters
+
+
+Author = namedtuple('Author', 'id username image_url')
+TimelineMessage = namedtuple('TimelineMessage', 'id text timestamp user')
+
+
+def with_author(row):
+    """Shape a message row like a Message, with a `user`, for messages/show.html."""
+
+    return TimelineMessage(row.id, row.text, row.timestamp,
+                           Author(row.user_id, row.username, row.image_url))
+
+
+class Viewer:
+    """Stands in for the logged in User (g.user) in templates."""
+
+    def __init__(self, profile, following_ids=()):
+        self.id = profile.id
+        self.username = profile.username
+        self.image_url = profile.image_url
+        self.header_image_url = profile.header_image_url
+        self._following_ids = set(following_ids)
+
+    def is_following(self, other_user):
+        return other_user.id in self._following_ids
+
+
+def page(template_name, viewer=None, **context):
+    """Render a page; runs inside the request context."""
+
+    g.user = viewer
+    return render_template(template_name, **context)
+
+
+def unauthorized():
+    flash("Access unauthorized.", "danger")
+    return redirect("/")
+
+
+##############################################################################
+# Views
+#
+# Each view awaits its queries and returns a callable that builds the
+# response inside a Flask request context.
+
+
+async def viewer_profile(db, viewer_id, user_id=None):
+    """The viewer's profile row (or None), fetched alongside `user_id`'s."""
+
+    if viewer_id is None:
+        viewer = None
+    else:
+        viewer = db.fetch_one(queries.user_profile_query(viewer_id))
+
+    if user_id is None:
+        return await viewer if viewer else None
+
+    user = db.fetch_one(queries.user_profile_query(user_id, viewer_id))
+
+    if viewer is None:
+        return None, await user
+
+    return await asyncio.gather(viewer, user)
+
+
+async def homepage(db, viewer_id):
+    if viewer_id is None:
+        return partial(page, 'home-anon.html')
+
+    profile, rows = await asyncio.gather(
+        viewer_profile(db, viewer_id),
+        db.fetch(queries.home_timeline_query(viewer_id)))
+
+    if profile is None:
+        return partial(page, 'home-anon.html')
+
+    message_ids = [row.id for row in rows]
+    likes = (await db.fetch(queries.liked_ids_query(viewer_id, message_ids))
+             if message_ids else [])
+
+    return partial(page, 'home.html', Viewer(profile),
+                   messages=rows,
+                   likes={like.message_id for like in likes},
+                   profile=profile)
+
+
+async def users_show(db, viewer_id, user_id):
+    (viewer, user), rows = await asyncio.gather(
+        viewer_profile(db, viewer_id, user_id),
+        db.fetch(queries.user_timeline_query(user_id)))
+
+    if user is None:
+        raise NotFound()
+
+    return partial(page, 'users/show.html', viewer and Viewer(viewer),
+                   user=user, messages=rows, social=None)
+
+
+async def users_likes(db, viewer_id, user_id):
+    if viewer_id is None:
+        return unauthorized
+
+    (viewer, user), rows = await asyncio.gather(
+        viewer_profile(db, viewer_id, user_id),
+        db.fetch(queries.liked_timeline_query(user_id)))
+
+    if viewer is None:
+        return unauthorized
+
+    if user is None:
+        raise NotFound()
+
+    return partial(page, 'users/likes.html', Viewer(viewer),
+                   user=user, messages=rows)
+
+
+async def messages_show(db, viewer_id, message_id):
+    viewer, message = await asyncio.gather(
+        viewer_profile(db, viewer_id),
+        db.fetch_one(queries.message_query(message_id, viewer_id)))
+
+    if message is None:
+        raise NotFound()
+
+    following_ids = [message.user_id] if message.viewer_follows else []
+
+    return partial(page, 'messages/show.html',
+                   viewer and Viewer(viewer, following_ids),
+                   message=with_author(message))
+
+
+VIEWS = {
+    'homepage': homepage,
+    'users_show': users_show,
+    'users_likes': users_likes,
+    'messages_show': messages_show,
+}
+
+
+##############################################################################
+# ASGI application
+
+
+def wsgi_environ(scope):
+    """Build a WSGI environ for an ASGI HTTP scope (requests have no body)."""
+
+    server = scope.get('server') or ('localhost', 80)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f"HTTP_{key}"
+        value = value.decode('latin-1')
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+async def respond(environ):
+    """Dispatch one request to its async view and build the response."""
+
+    adapter = app.url_map.bind_to_environ(environ)
+
+    try:
+        endpoint, view_args = adapter.match()
+        view = VIEWS.get(endpoint)
+        if view is None:
+            raise NotFound()
+
+        session = app.session_interface.open_session(app, app.request_class(environ))
+        viewer_id = session.get(CURR_USER_KEY) if session else None
+
+        build = await view(get_database(), viewer_id, **view_args)
+
+    except HTTPException as err:
+        return err.get_response(environ)
+
+    # No awaits below: Flask's context locals aren't safe across them.
+    with app.request_context(environ):
+        response = app.make_response(build())
+        return app.process_response(response)
+
+
+async def application(scope, receive, send):
+    """The ASGI entry point."""
+
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                close_database()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    response = await respond(wsgi_environ(scope))
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
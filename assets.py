@@ -0,0 +1,165 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies everything under static/ into ASSETS_DIR with
+a content hash in each file name (stylesheets/style.css becomes
+stylesheets/style.<hash>.css), writes .gz and, when the optional `brotli`
+package is installed, .br copies of files that compress well, and records
+the names in manifest.json. /static/ URLs inside stylesheets are
+rewritten to the fingerprinted names too.
+
+Templates link assets with `asset_url('stylesheets/style.css')`. With a
+manifest that's /assets/<fingerprinted name>, served with a year-long
+immutable Cache-Control in the best encoding the client accepts; without
+one (in development and tests) it's the plain /static/ URL.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+import click
+from flask import current_app
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+# Image formats are already compressed; everything else is worth trying.
+PRECOMPRESSED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2'}
+
+# Only keep a compressed copy that saves at least this fraction.
+MIN_SAVING = 0.1
+
+CSS_STATIC_URL_RE = re.compile(r'''url\((["']?)/static/([^"')]+)\1\)''')
+
+
+def init_app(app):
+    """Set the default assets directory and add `asset_url` and the CLI command."""
+
+    app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+
+    app.add_template_global(asset_url)
+
+    @app.cli.command('build-assets')
+    def build_assets():
+        """Fingerprint and precompress static/ into ASSETS_DIR."""
+
+        manifest = build(app.static_folder, app.config['ASSETS_DIR'])
+        click.echo(f"Built {len(manifest)} assets in {app.config['ASSETS_DIR']}")
+
+
+def _fingerprinted(path, data):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_compressed(path, data):
+    """Write .gz and .br copies of `data` next to `path` if they're smaller."""
+
+    if os.path.splitext(path)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+        return
+
+    encoders = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+
+    for suffix, encode in encoders:
+        compressed = encode(data)
+        if len(compressed) <= len(data) * (1 - MIN_SAVING):
+            _write(path + suffix, compressed)
+
+
+def build(static_folder, out_dir):
+    """Build fingerprinted copies of `static_folder` into `out_dir`.
+
+    Returns the manifest: original paths (relative to `static_folder`,
+    with / separators) to fingerprinted ones.
+    """
+
+    out_dir = os.path.abspath(out_dir)
+    sources = {}
+
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        dirnames[:] = [name for name in dirnames
+                       if os.path.abspath(os.path.join(dirpath, name)) != out_dir]
+        for filename in filenames:
+            full = os.path.join(dirpath, filename)
+            sources[os.path.relpath(full, static_folder).replace(os.sep, '/')] = full
+
+    manifest = {}
+
+    # Stylesheets refer to other assets, so fingerprint those first.
+    for path in sorted(sources, key=lambda path: path.endswith('.css')):
+        with open(sources[path], 'rb') as f:
+            data = f.read()
+
+        if path.endswith('.css'):
+            data = CSS_STATIC_URL_RE.sub(
+                lambda m: f"url({m.group(1)}/assets/"
+                          f"{manifest.get(m.group(2), m.group(2))}{m.group(1)})",
+                data.decode()).encode()
+
+        manifest[path] = _fingerprinted(path, data)
+
+        target = os.path.join(out_dir, manifest[path])
+        _write(target, data)
+        _write_compressed(target, data)
+
+    _write(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=2).encode())
+
+    return manifest
+
+
+def _manifest():
+    """The current app's manifest, loaded once; empty if assets aren't built."""
+
+    manifest = current_app.extensions.get('assets_manifest')
+
+    if manifest is None:
+        try:
+            with open(os.path.join(current_app.config['ASSETS_DIR'], MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        current_app.extensions['assets_manifest'] = manifest
+
+    return manifest
+
+
+def asset_url(path):
+    """The URL to link the static file at `path` with."""
+
+    fingerprinted = _manifest().get(path)
+
+    if fingerprinted is None:
+        return f"/static/{path}"
+
+    return f"/assets/{fingerprinted}"
+
+
+def encoded_file(filename, accept_encodings):
+    """The file to send for `filename` and its Content-Encoding (or None).
+
+    Prefers brotli, then gzip, when the client accepts them (see
+    `request.accept_encodings`) and a compressed copy was built.
+    """
+
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accept_encodings[encoding]:
+            path = safe_join(current_app.config['ASSETS_DIR'], filename + suffix)
+            if path and os.path.exists(path):
+                return filename + suffix, encoding
+
+    return filename, None
@@ -0,0 +1,82 @@
+"""Compare the JSON API against the HTML pages it mirrors.
+
+For each page/API pair, reports the response size and the mean time per
+request through the Flask test client. Run against a seeded database:
+
+    python seed.py
+    python benchmarks/bench_api.py [iterations]
+"""
+
+import os
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func
+
+from app import app, CURR_USER_KEY
+from models import db, Follows
+
+ROUTES = [
+    ("homepage", "/", "/api/v1/timeline"),
+    ("users_show", "/users/{id}", "/api/v1/users/{id}"),
+    ("users_likes", "/users/{id}/likes", "/api/v1/users/{id}/likes"),
+    ("show_following", "/users/{id}/following", "/api/v1/users/{id}/following"),
+    ("users_followers", "/users/{id}/followers", "/api/v1/users/{id}/followers"),
+]
+
+
+def busiest_user_id():
+    """Id of the user following the most people (the heaviest timeline)."""
+
+    user_id = (db.session
+               .query(Follows.user_following_id)
+               .group_by(Follows.user_following_id)
+               .order_by(func.count().desc())
+               .limit(1)
+               .scalar())
+
+    if user_id is None:
+        sys.exit("No follows found -- run seed.py first.")
+
+    return user_id
+
+
+def time_route(client, url, iterations):
+    """Return (bytes, mean ms) for GETting `url`."""
+
+    resp = client.get(url)
+    assert resp.status_code == 200, (url, resp.status_code)
+    size = len(resp.get_data())
+
+    start = perf_counter()
+    for _ in range(iterations):
+        client.get(url)
+    elapsed = perf_counter() - start
+
+    return size, elapsed / iterations * 1000
+
+
+def main(iterations=20):
+    user_id = busiest_user_id()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    print(f"user #{user_id}, {iterations} iterations per route\n")
+    print(f"{'route':<16}{'html bytes':>12}{'json bytes':>12}{'size':>8}"
+          f"{'html ms':>10}{'json ms':>10}{'speedup':>9}")
+
+    for name, html_url, api_url in ROUTES:
+        html_size, html_ms = time_route(client, html_url.format(id=user_id), iterations)
+        json_size, json_ms = time_route(client, api_url.format(id=user_id), iterations)
+
+        print(f"{name:<16}{html_size:>12}{json_size:>12}"
+              f"{json_size / html_size:>8.0%}"
+              f"{html_ms:>10.2f}{json_ms:>10.2f}{html_ms / json_ms:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
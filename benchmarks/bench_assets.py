@@ -0,0 +1,133 @@
+"""Bytes transferred per page view, with and without built assets.
+
+Plays a browser with an HTTP cache against the app: each page's HTML is
+fetched, then the stylesheets, icons and images it links (including
+url()s inside stylesheets). Cached responses are reused while fresh and
+revalidated with If-None-Match otherwise. Without built assets everything
+comes from /static/ with `max-age=0`, so repeat views revalidate every
+file; with them, assets come from /assets/ precompressed and immutable.
+
+    python benchmarks/bench_assets.py --uri postgresql:///warbler
+"""
+
+import argparse
+import gzip
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+parser.add_argument('--views', type=int, default=3, help="views of each page")
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = args.uri
+
+import assets
+from app import app, CURR_USER_KEY
+from models import User
+
+ASSET_RE = re.compile(r'''(?:href|src)="(/(?:static|assets)/[^"]+)"|url\(["']?(/(?:static|assets)/[^"')]+)''')
+
+
+def decoded(resp):
+    """The response body, decompressed."""
+
+    encoding = resp.headers.get('Content-Encoding')
+    if encoding == 'gzip':
+        return gzip.decompress(resp.data)
+    if encoding == 'br':
+        return assets.brotli.decompress(resp.data)
+    return resp.data
+
+
+def response_bytes(resp):
+    """Status line, headers and body, roughly as sent."""
+
+    headers = sum(len(k) + len(v) + 4 for k, v in resp.headers.items())
+    return len(resp.status) + 11 + headers + 2 + len(resp.data)
+
+
+class Browser:
+    def __init__(self, user_id=None):
+        self.client = app.test_client()
+        self.cache = {}
+
+        if user_id:
+            with self.client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+    def get(self, url):
+        """Fetch `url` unless it's cached and immutable; (bytes, requests, body)."""
+
+        cached = self.cache.get(url)
+        if cached and 'immutable' in cached.headers.get('Cache-Control', ''):
+            return 0, 0, decoded(cached)
+
+        headers = {'Accept-Encoding': 'gzip, deflate, br'}
+        if cached and cached.headers.get('ETag'):
+            headers['If-None-Match'] = cached.headers['ETag']
+
+        resp = self.client.get(url, headers=headers)
+        sent = response_bytes(resp)
+
+        if resp.status_code == 304:
+            return sent, 1, decoded(cached)
+
+        self.cache[url] = resp
+        return sent, 1, decoded(resp)
+
+    def view(self, page):
+        """Load `page` and everything it links; (bytes, requests)."""
+
+        total, requests, body = self.get(page)
+        seen = set()
+        pending = [body]
+
+        while pending:
+            for match in ASSET_RE.finditer(pending.pop().decode('utf-8', 'replace')):
+                url = match.group(1) or match.group(2)
+                if url in seen:
+                    continue
+                seen.add(url)
+
+                sent, fetched, body = self.get(url)
+                total += sent
+                requests += fetched
+                if url.endswith('.css'):
+                    pending.append(body)
+
+        return total, requests
+
+
+def measure(label, pages):
+    print(label)
+    for name, page, user_id in pages:
+        browser = Browser(user_id)
+        views = [browser.view(page) for _ in range(args.views)]
+        first, repeat = views[0], views[-1]
+        print(f"  {name:<12} first view {first[0]:>9,} B in {first[1]:>2} requests   "
+              f"repeat view {repeat[0]:>9,} B in {repeat[1]:>2} requests")
+
+
+with app.app_context():
+    user_id = User.query.order_by(User.id).first().id
+
+pages = [('anonymous', '/', None), ('home', '/', user_id), ('profile', f'/users/{user_id}', user_id)]
+
+assets_dir = tempfile.mkdtemp()
+try:
+    app.config['ASSETS_DIR'] = os.path.join(assets_dir, 'missing')
+    app.extensions.pop('assets_manifest', None)
+    measure("Before: /static/", pages)
+
+    assets.build(app.static_folder, assets_dir)
+    app.config['ASSETS_DIR'] = assets_dir
+    app.extensions.pop('assets_manifest', None)
+    measure("After: built /assets/", pages)
+finally:
+    shutil.rmtree(assets_dir)
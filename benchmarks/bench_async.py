@@ -0,0 +1,129 @@
+"""Compare WSGI worker counts against the ASGI app under simulated DB latency.
+
+Every query is delayed by `--latency` seconds. The WSGI app is driven by a
+pool of `--workers` threads (standing in for sync workers); the ASGI app
+runs all requests concurrently on one event loop, limited only by
+`--concurrency`. Prints requests/second and latency percentiles for each:
+
+    python benchmarks/bench_async.py --uri postgresql:///warbler \\
+        --latency 0.02 --workers 1 4 16 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+parser.add_argument('--latency', type=float, default=0.02,
+                    help="seconds added to every query")
+parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+parser.add_argument('--concurrency', type=int, default=64)
+parser.add_argument('--requests', type=int, default=400)
+parser.add_argument('--path', default=None, help="page to request (default: a profile)")
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = args.uri
+os.environ.setdefault('DB_POOL_SIZE', str(max(args.workers)))
+
+from sqlalchemy import event
+
+import asgi
+from app import app, CURR_USER_KEY
+from models import db, User
+
+
+def report(label, elapsed, timings):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[int(len(timings) * 0.99) - 1] * 1000
+    print(f"{label:<24} {len(timings) / elapsed:8.1f} req/s   "
+          f"p50 {p50:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+def run_wsgi(path, user_id, workers):
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            with local.client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+        return local.client
+
+    def request(i):
+        start = perf_counter()
+        resp = client().get(path)
+        assert resp.status_code == 200, resp.status_code
+        return perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = perf_counter()
+        timings = list(pool.map(request, range(args.requests)))
+        elapsed = perf_counter() - start
+
+    report(f"wsgi, {workers} workers", elapsed, timings)
+
+
+async def run_asgi(path, user_id):
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    asgi._databases[asyncio.get_running_loop()] = asgi.AsyncPostgres(
+        args.uri, size=args.concurrency, connect_args=options.get('connect_args'),
+        latency=args.latency)
+
+    cookie = app.session_interface.get_signing_serializer(app).dumps({CURR_USER_KEY: user_id})
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+             'headers': [(b'cookie', f"{app.session_cookie_name}={cookie}".encode())]}
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def request():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async with slots:
+            start = perf_counter()
+            await asgi.application(scope, receive, send)
+            assert sent[0]['status'] == 200, sent[0]['status']
+            return perf_counter() - start
+
+    try:
+        start = perf_counter()
+        timings = await asyncio.gather(*[request() for i in range(args.requests)])
+        elapsed = perf_counter() - start
+    finally:
+        asgi.close_database()
+
+    report(f"asgi, {args.concurrency} concurrent", elapsed, timings)
+
+
+def main():
+    with app.app_context():
+        user_id = db.session.query(User.id).order_by(User.id).limit(1).scalar()
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def simulate_latency(conn, cursor, statement, parameters, context, executemany):
+            sleep(args.latency)
+
+    path = args.path or f"/users/{user_id}"
+
+    print(f"GET {path}, {args.requests} requests, {args.latency * 1000:.0f} ms per query")
+
+    for workers in args.workers:
+        run_wsgi(path, user_id, workers)
+
+    asyncio.run(run_asgi(path, user_id))
+
+
+if __name__ == "__main__":
+    main()
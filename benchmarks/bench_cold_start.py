@@ -0,0 +1,85 @@
+"""Worker cold start with and without precompiled templates.
+
+Each run starts a fresh Python process, as a new worker would, that
+imports the app and then makes the first request to a few pages. Three
+setups are compared:
+
+    lazy         no bytecode cache; templates compiled on first use
+    warm         no bytecode cache; all templates compiled at startup
+    precompiled  `flask compile-templates` already run; startup loads
+                 every template from the shared bytecode cache
+
+Prints median startup time, first-request time and their total:
+
+    python benchmarks/bench_cold_start.py --uri postgresql:///warbler
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+parser.add_argument('--runs', type=int, default=7)
+args = parser.parse_args()
+
+WORKER = """
+import json, sys
+from time import perf_counter
+
+sys.path.insert(0, %(root)r)
+start = perf_counter()
+
+from app import app, CURR_USER_KEY
+from models import User
+
+started = perf_counter()
+
+client = app.test_client()
+with app.app_context():
+    user_id = User.query.order_by(User.id).first().id
+with client.session_transaction() as sess:
+    sess[CURR_USER_KEY] = user_id
+
+requests = perf_counter()
+for path in ['/', '/users', f'/users/{user_id}', f'/users/{user_id}/followers',
+             f'/users/{user_id}/likes', '/messages/new', '/popular']:
+    assert client.get(path).status_code == 200, path
+
+print(json.dumps([started - start, perf_counter() - requests]))
+"""
+
+
+def run(env):
+    out = subprocess.run([sys.executable, '-c', WORKER % {'root': ROOT}], env=env,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def measure(label, env):
+    runs = [run(env) for _ in range(args.runs)]
+    startup = statistics.median(r[0] for r in runs) * 1000
+    first = statistics.median(r[1] for r in runs) * 1000
+    print(f"{label:<12} startup {startup:7.1f} ms   first requests {first:7.1f} ms   "
+          f"total {startup + first:7.1f} ms")
+
+
+cache_dir = tempfile.mkdtemp()
+base = dict(os.environ, DATABASE_URL=args.uri, FLASK_ENV='production')
+
+try:
+    measure('lazy', dict(base, TEMPLATE_CACHE_DIR='', WARM_TEMPLATES='0'))
+    measure('warm', dict(base, TEMPLATE_CACHE_DIR='', WARM_TEMPLATES='1'))
+
+    env = dict(base, TEMPLATE_CACHE_DIR=cache_dir, WARM_TEMPLATES='1', FLASK_APP='app.py')
+    subprocess.run(['flask', 'compile-templates'], env=env, cwd=ROOT, check=True)
+    measure('precompiled', env)
+finally:
+    shutil.rmtree(cache_dir)
@@ -0,0 +1,82 @@
+"""CPU cost versus bytes saved by response compression, per page.
+
+Renders representative pages uncompressed through the app, then
+compresses each with gzip and brotli at several levels the way
+compress.py does: in one piece, and in `--chunk`-byte pieces each flushed
+on its own as streamed list pages are. Prints the compressed size and CPU
+milliseconds per response:
+
+    python benchmarks/bench_compress.py --uri postgresql:///warbler
+"""
+
+import argparse
+import os
+import sys
+from time import process_time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+parser.add_argument('--repeat', type=int, default=50)
+parser.add_argument('--chunk', type=int, default=4096,
+                    help="bytes per flushed piece in the streamed runs")
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = args.uri
+
+import compress
+from app import app, CURR_USER_KEY
+from models import db, User, Follows
+
+SETTINGS = [('gzip', compress.GzipEncoder, level) for level in (1, 6, 9)]
+if compress.brotli is not None:
+    SETTINGS += [('br', compress.BrotliEncoder, quality) for quality in (1, 4, 6, 11)]
+
+
+def encode(encoder_class, level, pieces):
+    encoder = encoder_class(level)
+    return b''.join([encoder.chunk(piece) for piece in pieces] + [encoder.finish()])
+
+
+def cpu_ms(encoder_class, level, pieces):
+    start = process_time()
+    for _ in range(args.repeat):
+        encode(encoder_class, level, pieces)
+    return (process_time() - start) / args.repeat * 1000
+
+
+with app.app_context():
+    # The user following the most people has the fullest home timeline.
+    user_id = (db.session.query(Follows.user_following_id)
+               .group_by(Follows.user_following_id)
+               .order_by(db.func.count().desc())
+               .limit(1).scalar()) or User.query.first().id
+
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess[CURR_USER_KEY] = user_id
+
+pages = [
+    ('home', '/'),
+    ('users index', '/users'),
+    ('profile', f'/users/{user_id}'),
+    ('followers', f'/users/{user_id}/followers'),
+    ('api timeline', '/api/v1/timeline'),
+]
+
+print(f"{'page':<14} {'raw':>8}  {'encoding':<8} {'bytes':>7} {'saved':>6} "
+      f"{'cpu ms':>7}  {'streamed bytes':>14} {'cpu ms':>7}")
+
+for name, path in pages:
+    body = client.get(path).data
+    pieces = [body[i:i + args.chunk] for i in range(0, len(body), args.chunk)]
+
+    for label, encoder_class, level in SETTINGS:
+        whole = encode(encoder_class, level, [body])
+        streamed = encode(encoder_class, level, pieces)
+
+        print(f"{name:<14} {len(body):>8,}  {label + '-' + str(level):<8} {len(whole):>7,} "
+              f"{1 - len(whole) / len(body):>6.1%} {cpu_ms(encoder_class, level, [body]):>7.2f}  "
+              f"{len(streamed):>14,} {cpu_ms(encoder_class, level, pieces):>7.2f}")
+    print()
@@ -0,0 +1,91 @@
+"""Time follow graph queries on a synthetic 1M-edge graph.
+
+Builds a FollowGraph from random edges (no database) with a skewed
+popularity distribution, then times suggestions, mutual follower counts
+and "followed by people you follow" lookups for random users:
+
+    python benchmarks/bench_graph.py [users] [edges]
+"""
+
+import os
+import random
+import sys
+from statistics import median
+from threading import Thread
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import FollowGraph
+
+
+def synthetic_edges(users, edges, seed=31):
+    """Random follows; popular accounts (low ids) attract more followers."""
+
+    rng = random.Random(seed)
+    seen = set()
+
+    while len(seen) < edges:
+        follower = rng.randrange(1, users + 1)
+        followed = min(int(rng.paretovariate(1.2)), users)
+        followed = rng.randrange(1, users + 1) if rng.random() < 0.5 else followed
+        if follower != followed:
+            seen.add((follower, followed))
+
+    return seen
+
+
+def timed(fn, args_list):
+    """Return per-call times in ms."""
+
+    times = []
+    for args in args_list:
+        start = perf_counter()
+        fn(*args)
+        times.append((perf_counter() - start) * 1000)
+    return sorted(times)
+
+
+def report(name, times):
+    p99 = times[int(len(times) * 0.99) - 1]
+    print(f"{name:<24}{median(times):>9.3f}{p99:>9.3f}{times[-1]:>9.3f}")
+
+
+def main(users=100_000, edges=1_000_000, samples=1000):
+    print(f"generating {edges:,} edges over {users:,} users ...")
+    pairs = synthetic_edges(users, edges)
+
+    start = perf_counter()
+    graph = FollowGraph.from_edges(pairs)
+    print(f"snapshot built in {perf_counter() - start:.2f}s\n")
+
+    rng = random.Random(7)
+    viewers = [rng.randrange(1, users + 1) for _ in range(samples)]
+    others = [rng.randrange(1, users + 1) for _ in range(samples)]
+
+    print(f"{'query':<24}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    report("suggestions", timed(graph.suggestions, [(v,) for v in viewers]))
+    report("mutual_followers", timed(graph.mutual_followers, list(zip(viewers, others))))
+    report("followed_by_following", timed(graph.followed_by_following, list(zip(viewers, others))))
+
+    for user_id in viewers[:100]:
+        graph.follow(user_id, others[0])
+    report("suggestions (w/ delta)", timed(graph.suggestions, [(v,) for v in viewers]))
+
+    # Compact in the background, as a follow does, timing lookups meanwhile.
+    compacting = Thread(target=graph.compact)
+    start = perf_counter()
+    compacting.start()
+    during = []
+    while compacting.is_alive():
+        lookup_start = perf_counter()
+        graph.mutual_followers(viewers[0], others[0])
+        during.append((perf_counter() - lookup_start) * 1000)
+    compacting.join()
+
+    print(f"\ncompaction: {(perf_counter() - start) * 1000:.0f} ms, "
+          f"slowest of {len(during)} lookups meanwhile: {max(during, default=0):.1f} ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,84 @@
+"""Import time of the app and of the database-only path scripts use.
+
+Each run imports a module in a fresh Python process with `-X importtime`
+and keeps the fastest of --runs runs (the one least disturbed by
+everything else on the machine). Prints each module's total and the
+modules it spends the most time importing, and fails if a total is over
+its budget in benchmarks/import_budgets.json:
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --write   # also update importtime.txt
+
+importtime.txt is the checked-in report, so a diff shows what a change
+added to startup.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS = os.path.join(ROOT, 'benchmarks', 'import_budgets.json')
+REPORT = os.path.join(ROOT, 'benchmarks', 'importtime.txt')
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+parser.add_argument('--runs', type=int, default=7)
+parser.add_argument('--top', type=int, default=15)
+parser.add_argument('--write', action='store_true', help="write the report to importtime.txt")
+args = parser.parse_args()
+
+
+def import_times(module, env):
+    """{imported module: (self us, cumulative us)} for one import of `module`."""
+
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            env=env, cwd=ROOT, check=True, capture_output=True,
+                            text=True).stderr
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def fastest(module, env):
+    return min((import_times(module, env) for _ in range(args.runs)),
+               key=lambda times: times[module][1])
+
+
+def report(module, times):
+    total = times[module][1] / 1000
+    lines = [f"{module}: {total:.1f} ms, {len(times)} modules",
+             f"  {'cumulative':>10}  {'self':>8}  module"]
+    heaviest = sorted(times.items(), key=lambda item: item[1][1], reverse=True)
+    for name, (own, cumulative) in heaviest[:args.top]:
+        lines.append(f"  {cumulative / 1000:8.1f}ms  {own / 1000:6.1f}ms  {name}")
+    return total, '\n'.join(lines)
+
+
+with open(BUDGETS) as f:
+    budgets = json.load(f)
+
+env = dict(os.environ, DATABASE_URL=args.uri, FLASK_ENV='production')
+sections = []
+over = []
+
+for module, budget_ms in budgets.items():
+    total, text = report(module, fastest(module, env))
+    print(text, end='\n\n')
+    sections.append(text)
+    if total > budget_ms:
+        over.append(f"{module} took {total:.1f} ms to import, over its {budget_ms} ms budget")
+
+if args.write:
+    with open(REPORT, 'w') as f:
+        f.write('\n\n'.join(sections) + '\n')
+
+if over:
+    sys.exit('\n'.join(over))
@@ -0,0 +1,156 @@
+"""Time message search queries over a synthetic corpus.
+
+Loads `--messages` synthetic messages (words drawn from a Zipf-like
+vocabulary, so some terms are rare and some are in most messages) into a
+scratch database, builds the search index, then reports p50/p99 latency
+for first pages and for a page reached through cursors:
+
+    createdb warbler_search_bench
+    python benchmarks/bench_search.py --uri postgresql:///warbler_search_bench \\
+        --messages 10000000
+
+Pass --reuse to skip loading when the corpus is already there, and
+--max-candidates to time searches capped as SEARCH_MAX_CANDIDATES caps them.
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from itertools import accumulate
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+
+import queries
+from models import db, Message, User, MESSAGE_SEARCH_DDL
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa",
+             "qu", "bri", "sto", "fle", "gra", "dun", "wel", "cho", "ry", "ox"]
+
+COPY_CHUNK = 100_000
+
+
+def vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def load_corpus(engine, messages, users, words, rng):
+    """Create the tables and COPY in `users` users and `messages` messages."""
+
+    db.metadata.drop_all(bind=engine)
+    db.metadata.create_all(bind=engine)
+    engine.execute("DROP INDEX ix_messages_search_vector")
+
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    start = datetime(2020, 1, 1)
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+
+        buf = io.StringIO()
+        for user_id in range(1, users + 1):
+            buf.write(f"{user_id}\tuser{user_id}\tuser{user_id}@example.com\tHASHED\n")
+        buf.seek(0)
+        cursor.copy_expert(
+            "COPY users (id, username, email, password) FROM STDIN", buf)
+
+        for chunk_start in range(1, messages + 1, COPY_CHUNK):
+            buf = io.StringIO()
+            for message_id in range(chunk_start, min(chunk_start + COPY_CHUNK, messages + 1)):
+                picked = rng.choices(words, cum_weights=cum_weights, k=rng.randint(4, 14))
+                message = " ".join(picked)[:140]
+                timestamp = start + timedelta(seconds=message_id)
+                buf.write(f"{message_id}\t{message}\t{timestamp}\t{rng.randint(1, users)}\n")
+            buf.seek(0)
+            cursor.copy_expert(
+                "COPY messages (id, text, timestamp, user_id) FROM STDIN", buf)
+            print(f"  loaded {min(chunk_start + COPY_CHUNK - 1, messages):,} messages",
+                  end="\r", flush=True)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    print()
+
+    begin = perf_counter()
+    engine.execute(MESSAGE_SEARCH_DDL)
+    print(f"  built search index in {perf_counter() - begin:.1f} s")
+    engine.execute(text("ANALYZE users, messages").execution_options(autocommit=True))
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return (timings[len(timings) // 2] * 1000,
+            timings[max(int(len(timings) * 0.99) - 1, 0)] * 1000)
+
+
+def time_search(engine, q, iterations, pages, max_candidates=None):
+    """(p50 ms, p99 ms) for fetching pages 1 to `pages` of results for `q`."""
+
+    timings = []
+
+    for _ in range(iterations):
+        after = None
+        begin = perf_counter()
+        for _ in range(pages):
+            rows = engine.execute(queries.search_query(
+                q, 'postgresql', after=after, max_candidates=max_candidates)).fetchall()
+            if len(rows) < queries.SEARCH_LIMIT:
+                break
+            after = queries.parse_search_cursor(queries.search_cursor(rows[-1]))
+        timings.append(perf_counter() - begin)
+
+    return percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='postgresql:///warbler_search_bench')
+    parser.add_argument('--messages', type=int, default=10_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--words', type=int, default=50_000)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--reuse', action='store_true')
+    parser.add_argument('--max-candidates', type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(34)
+    words = vocabulary(args.words, rng)
+    engine = create_engine(args.uri)
+
+    if not args.reuse:
+        print(f"Loading {args.messages:,} messages into {args.uri}")
+        load_corpus(engine, args.messages, args.users, words, rng)
+
+    count = engine.execute("SELECT count(*) FROM messages").scalar()
+    searches = [
+        ("common word", words[0]),
+        ("mid word", words[100]),
+        ("rare word", words[-1]),
+        ("two words", f"{words[5]} {words[50]}"),
+        ("phrase", f'"{words[1]} {words[2]}"'),
+        ("no match", "zzzzzz"),
+    ]
+
+    print(f"\n{count:,} messages, {args.iterations} iterations each, "
+          f"max candidates {args.max_candidates or 'unset'}\n")
+    print(f"{'search':<14}{'page 1 p50':>12}{'p99':>10}{'page 5 p50':>12}{'p99':>10}")
+
+    for label, q in searches:
+        p50, p99 = time_search(engine, q, args.iterations, 1, args.max_candidates)
+        deep_p50, deep_p99 = time_search(engine, q, args.iterations, 5, args.max_candidates)
+        print(f"{label:<14}{p50:>10.2f}ms{p99:>8.2f}ms{deep_p50:>10.2f}ms{deep_p99:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
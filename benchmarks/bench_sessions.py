@@ -0,0 +1,77 @@
+"""Per-request session cost: signed cookies versus server-side stores.
+
+For each backend, opens and saves a logged-in session the way a request
+does, once unmodified (a plain page view) and once with `--flashes`
+flashed messages added, and reports microseconds per request and the
+size of the cookie sent back:
+
+    python benchmarks/bench_sessions.py
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--requests', type=int, default=5000)
+parser.add_argument('--flashes', type=int, default=3)
+args = parser.parse_args()
+
+from flask.sessions import SecureCookieSessionInterface
+
+import sessions
+from app import app, CURR_USER_KEY
+
+
+def cookie_header(response):
+    return response.headers.get('Set-Cookie', '').split(';')[0]
+
+
+def run(interface, flashes):
+    """Mean microseconds per open + save, and the Set-Cookie size."""
+
+    app.session_interface = interface
+
+    with app.test_request_context():
+        session = interface.open_session(app, app.request_class({}))
+        session[CURR_USER_KEY] = 1
+        response = app.response_class()
+        interface.save_session(app, session, response)
+        cookie = cookie_header(response)
+
+    environ = {'HTTP_COOKIE': cookie}
+    start = perf_counter()
+
+    for _ in range(args.requests):
+        with app.test_request_context(environ_base=environ):
+            request = app.request_class(dict(environ))
+            session = interface.open_session(app, request)
+            if flashes:
+                session['_flashes'] = [('info', f'Message number {i}!') for i in range(flashes)]
+            response = app.response_class()
+            interface.save_session(app, session, response)
+
+    return (perf_counter() - start) / args.requests * 1e6, len(cookie_header(response))
+
+
+tmp = tempfile.mkdtemp()
+try:
+    interfaces = [
+        ('cookie', SecureCookieSessionInterface()),
+        ('memory', sessions.ServerSessionInterface(sessions.MemoryStore(), CURR_USER_KEY)),
+        ('sqlite', sessions.ServerSessionInterface(
+            sessions.SQLiteStore(os.path.join(tmp, 'sessions.db')), CURR_USER_KEY)),
+    ]
+
+    print(f"{'backend':<8} {'page view':>12} {'with flashes':>14} {'cookie bytes':>14}")
+    for name, interface in interfaces:
+        plain, _ = run(interface, 0)
+        flashed, size = run(interface, args.flashes)
+        print(f"{name:<8} {plain:>9.1f} us {flashed:>11.1f} us {size:>14}")
+finally:
+    shutil.rmtree(tmp)
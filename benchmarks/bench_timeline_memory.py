@@ -0,0 +1,80 @@
+"""Memory allocated loading a timeline page as Message instances or as rows.
+
+For 100- and 1000-message pages (the newest messages of all users),
+compares loading what the timeline templates read:
+
+    orm   Message.query ... .all(), plus each message's author, as the
+          pages used to
+    rows  queries.timeline_rows(), TimelineRow tuples from a Core select
+
+and reports, with tracemalloc, the memory still held once the page is
+loaded (while the template would be rendering it) and the peak while
+loading it. Each is measured after a warm-up and in a fresh session. Run
+against a seeded database:
+
+    python seed.py
+    python benchmarks/bench_timeline_memory.py
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import true
+
+from app import app
+from models import db, Message
+import queries
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000])
+args = parser.parse_args()
+
+
+def orm_page(limit):
+    messages = (Message
+                .query
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(limit)
+                .all())
+    for message in messages:
+        message.user.username
+    return messages
+
+
+def rows_page(limit):
+    return queries.timeline_rows(queries._timeline_query(true(), limit=limit))
+
+
+def measure(load, limit):
+    """(KiB held by the loaded page, peak KiB while loading it)."""
+
+    load(limit)
+    db.session.remove()
+
+    tracemalloc.start()
+    try:
+        page = load(limit)
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(page) == limit, f"only {len(page)} messages; seed the database first"
+    db.session.remove()
+    return held / 1024, peak / 1024
+
+
+with app.app_context():
+    print(f"{'messages':>8}  {'loader':<5} {'held KiB':>9} {'peak KiB':>9}")
+
+    for limit in args.sizes:
+        orm_held, orm_peak = measure(orm_page, limit)
+        rows_held, rows_peak = measure(rows_page, limit)
+
+        print(f"{limit:>8}  {'orm':<5} {orm_held:9.1f} {orm_peak:9.1f}")
+        print(f"{limit:>8}  {'rows':<5} {rows_held:9.1f} {rows_peak:9.1f}"
+              f"   ({1 - rows_held / orm_held:.0%} less held, "
+              f"{1 - rows_peak / orm_peak:.0%} lower peak)")
@@ -0,0 +1,58 @@
+"""Time pushing a new message into the timeline cache of many followers.
+
+Fills every slot of a TimelineCache in a scratch file, then times
+`push` for authors with more and more followers, locking each slot on
+its own (stripe_slots=1) and a stripe at a time (the default):
+
+    python benchmarks/bench_timeline_push.py [max followers]
+"""
+
+import os
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timelines import TimelineCache, TIMELINE_CACHE_SLOTS, TIMELINE_CACHE_STRIPE_SLOTS
+
+
+def time_push(cache, followers, repeat):
+    """Per-push times in ms for an author with `followers` followers."""
+
+    user_ids = range(1, followers + 1)
+    times = []
+    for message_id in range(1, repeat + 1):
+        start = perf_counter()
+        cache.push(user_ids, message_id)
+        times.append((perf_counter() - start) * 1000)
+    return times
+
+
+def main(max_followers=100_000, repeat=5):
+    with tempfile.TemporaryDirectory() as tmp:
+        caches = {}
+        for stripe_slots in (1, TIMELINE_CACHE_STRIPE_SLOTS):
+            cache = caches[stripe_slots] = TimelineCache(
+                os.path.join(tmp, f"timelines-{stripe_slots}.bin"), stripe_slots=stripe_slots)
+            for user_id in range(1, TIMELINE_CACHE_SLOTS + 1):
+                cache.fill(user_id, [0], cache.version(user_id))
+
+        print(f"{TIMELINE_CACHE_SLOTS} slots, all filled; median of {repeat} pushes\n")
+        print(f"{'followers':>10}{'per slot ms':>14}"
+              f"{f'per {TIMELINE_CACHE_STRIPE_SLOTS} slots ms':>18}")
+
+        followers = 100
+        while followers <= max_followers:
+            per_slot = median(time_push(caches[1], followers, repeat))
+            striped = median(time_push(caches[TIMELINE_CACHE_STRIPE_SLOTS], followers, repeat))
+            print(f"{followers:>10,}{per_slot:>14.1f}{striped:>18.1f}")
+            followers *= 10
+
+        for cache in caches.values():
+            cache.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,77 @@
+"""Multi-threaded load generator for the connection pool.
+
+Each thread repeatedly checks out a connection, runs a query that holds it
+for `--hold` seconds and returns it. Prints throughput and the pool's
+checkout-wait metrics. Point it at PostgreSQL or a SQLite file:
+
+    DB_POOL_SIZE=5 DB_MAX_OVERFLOW=5 python benchmarks/pool_load.py \\
+        --uri postgresql:///warbler --threads 40 --seconds 10
+"""
+
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import exc
+
+import dbpool
+
+
+def worker(engine, hold, deadline):
+    """Run queries until `deadline`; return (completed, timed out)."""
+
+    completed = timeouts = 0
+    sleep_sql = ("SELECT pg_sleep(%s)" % hold
+                 if engine.dialect.name == 'postgresql' else None)
+
+    while monotonic() < deadline:
+        try:
+            with engine.connect() as conn:
+                if sleep_sql:
+                    conn.execute(sleep_sql)
+                else:
+                    conn.execute("SELECT 1")
+                    sleep(hold)
+            completed += 1
+        except exc.TimeoutError:
+            timeouts += 1
+
+    return completed, timeouts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default=os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--hold', type=float, default=0.02,
+                        help="seconds each query holds its connection")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+
+    config = dbpool.pool_config_from_env()
+    engine = dbpool.create_engine(args.uri, dbpool.engine_options(args.uri, config))
+
+    deadline = monotonic() + args.seconds
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda _: worker(engine, args.hold, deadline),
+                                range(args.threads)))
+
+    completed = sum(done for done, _ in results)
+    timeouts = sum(timed_out for _, timed_out in results)
+
+    print(f"{args.threads} threads, pool_size={config['DB_POOL_SIZE']} "
+          f"max_overflow={config['DB_MAX_OVERFLOW']}")
+    print(f"{completed / args.seconds:.0f} queries/s, {timeouts} checkout timeouts")
+    for key, value in dbpool.pool_stats(engine).items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""gzip/brotli compression of responses, as WSGI middleware.
+
+`init_app(app)` wraps `app.wsgi_app`. Responses are compressed when the
+client accepts an encoding we support (brotli, if the optional `brotli`
+package is installed, is preferred to gzip), their type is in
+COMPRESS_MIMETYPES, and they're at least COMPRESS_MIN_SIZE bytes.
+
+Responses without a Content-Length (streamed list pages) are buffered
+only until COMPRESS_MIN_SIZE bytes have arrived; after that each chunk
+the app yields is compressed and flushed on its own, so streaming still
+gets rows to the browser as they're rendered.
+
+Responses that already have a Content-Encoding (precompressed assets) or
+ask for `Cache-Control: no-transform` are passed through untouched. Any
+other response of a compressible type gets `Vary: Accept-Encoding`, even
+when it's sent uncompressed (too small, or not accepted), so caches
+don't hand one client's encoding to another. A compressed response's
+ETag is made weak: its bytes differ from the identity response's, so
+the two mustn't share a strong validator (If-None-Match still matches,
+as it compares weakly).
+"""
+
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESS_MIMETYPES = ('text/html', 'text/css', 'text/plain', 'text/xml',
+                      'application/json', 'application/javascript', 'image/svg+xml')
+
+# Statuses whose bodies are empty or must not be re-encoded.
+UNCOMPRESSIBLE_STATUSES = ('204', '206', '304')
+
+
+def init_app(app):
+    """Set default compression settings and wrap the app's WSGI callable."""
+
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_MIMETYPES', COMPRESS_MIMETYPES)
+
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, app.config)
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        """Compress `data` and flush it, so it can be decoded on arrival."""
+
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def choose_encoder(accept_encoding, config):
+    """An encoder for the best encoding the client accepts, or None."""
+
+    accepted = parse_accept_header(accept_encoding)
+
+    if brotli is not None and accepted['br']:
+        return BrotliEncoder(config['COMPRESS_BROTLI_QUALITY'])
+    if accepted['gzip']:
+        return GzipEncoder(config['COMPRESS_LEVEL'])
+
+    return None
+
+
+def negotiable(status, headers, config):
+    """Whether a response with `status` and `headers` is sent compressed or
+    not depending on Accept-Encoding, given its size.
+
+    Returns whether it is and its Content-Length (None if unknown).
+    """
+
+    if status[:3] in UNCOMPRESSIBLE_STATUSES:
+        return False, None
+
+    content_type = content_length = None
+
+    for name, value in headers:
+        name = name.lower()
+        if name == 'content-encoding':
+            return False, None
+        if name == 'cache-control' and 'no-transform' in value:
+            return False, None
+        if name == 'content-type':
+            content_type = value.split(';')[0].strip()
+        elif name == 'content-length':
+            content_length = int(value)
+
+    return content_type in config['COMPRESS_MIMETYPES'], content_length
+
+
+def compressible(status, headers, config):
+    """Whether a response with `status` and `headers` may be compressed."""
+
+    negotiated, content_length = negotiable(status, headers, config)
+
+    return negotiated and (content_length is None or
+                           content_length >= config['COMPRESS_MIN_SIZE'])
+
+
+def vary_on_encoding(headers):
+    """`headers` with Accept-Encoding added to any Vary header."""
+
+    vary = [value for name, value in headers if name.lower() == 'vary']
+    if any('accept-encoding' in value.lower() or value.strip() == '*' for value in vary):
+        return headers
+
+    headers = [(name, value) for name, value in headers if name.lower() != 'vary']
+    headers.append(('Vary', ', '.join(vary + ['Accept-Encoding'])))
+    return headers
+
+
+def weak_etag(headers):
+    """`headers` with a strong ETag made weak."""
+
+    return [(name, f'W/{value}' if name.lower() == 'etag' and not value.startswith('W/')
+             else value)
+            for name, value in headers]
+
+
+class CompressionMiddleware:
+    """Compress responses from `wsgi_app`, with settings read from `config`."""
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+
+    def __call__(self, environ, start_response):
+        config = self.config
+
+        if not config['COMPRESS_ENABLED'] or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        encoder = choose_encoder(environ.get('HTTP_ACCEPT_ENCODING', ''), config)
+        if encoder is None:
+            def start_identity(status, headers, exc_info=None):
+                if negotiable(status, headers, config)[0]:
+                    headers = vary_on_encoding(headers)
+                return start_response(status, headers, exc_info)
+
+            return self.wsgi_app(environ, start_identity)
+
+        response = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            response[:] = [status, headers, exc_info]
+            return written.append
+
+        body = self.wsgi_app(environ, capture)
+        status, headers, exc_info = response
+
+        if not compressible(status, headers, config):
+            if negotiable(status, headers, config)[0]:
+                # Too small to compress, but a larger version could be.
+                headers = vary_on_encoding(headers)
+            start_response(status, headers, exc_info)
+            return _chain(written, body)
+
+        return self._compress(status, headers, exc_info, written, body,
+                              encoder, start_response)
+
+    def _compress(self, status, headers, exc_info, written, body, encoder, start_response):
+        source = _chain(written, body)
+        chunks = iter(source)
+        buffered = []
+        size = 0
+
+        # Wait for enough of the body to know it's worth compressing.
+        for data in chunks:
+            buffered.append(data)
+            size += len(data)
+            if size >= self.config['COMPRESS_MIN_SIZE']:
+                break
+        else:
+            _close(source)
+            start_response(status, vary_on_encoding(headers), exc_info)
+            return buffered
+
+        headers = [(name, value) for name, value in weak_etag(vary_on_encoding(headers))
+                   if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', encoder.name))
+        start_response(status, headers, exc_info)
+
+        return _encode(encoder, b''.join(buffered), chunks, source)
+
+
+def _close(iterable):
+    if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+def _chain(written, body):
+    """Data passed to start_response's write() callable, then the body."""
+
+    if not written:
+        return body
+    return _ClosingChain(written, body)
+
+
+class _ClosingChain:
+    def __init__(self, written, body):
+        self.written = written
+        self.body = body
+
+    def __iter__(self):
+        yield from self.written
+        yield from self.body
+
+    def close(self):
+        _close(self.body)
+
+
+def _encode(encoder, first, chunks, source):
+    try:
+        yield encoder.chunk(first)
+        for data in chunks:
+            if data:
+                yield encoder.chunk(data)
+        yield encoder.finish()
+    finally:
+        _close(source)
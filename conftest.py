@@ -0,0 +1,147 @@
+"""pytest setup for a fast test run.
+
+- The app is imported here, before any test module, against
+  TEST_DATABASE_URL (default postgresql:///warbler_test), and the tables
+  are created; test modules don't set up the database themselves. Under
+  pytest-xdist each worker gets a database of its own (warbler_test_gw0,
+  ...), created on first use. TEST_DATABASE_URL=sqlite:// runs against an
+  in-memory database, skipping search, route budgets and the tests
+  marked `postgres`.
+- Passwords are hashed with the lowest bcrypt work factor, and like
+  toggles are written out before the response (LIKE_FLUSH_SECONDS=0).
+- Each test runs inside a transaction that's rolled back afterwards. The
+  app's commits only release a savepoint, so setUp's deletes and inserts
+  never reach the database. Tests that need data committed, because other
+  connections or threads read it, or that race real transactions against
+  each other, are marked `commits` and clean up after themselves.
+
+    pytest -q -n auto
+"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', 'postgresql:///warbler_test')
+
+
+# Fixtures insert rows with small explicit ids; generated ids start past
+# them (sequences aren't rolled back, and start at 1 in a new database).
+FIRST_GENERATED_ID = 1000
+
+
+def worker_database_url(url, worker):
+    """`url`, or a copy of its database for xdist worker `worker`."""
+
+    url = make_url(url)
+    if not worker or url.get_backend_name() != 'postgresql':
+        return str(url)
+
+    name = f"{url.database}_{worker}"
+    admin_url = make_url(str(url))
+    admin_url.database = 'postgres'
+
+    admin = create_engine(admin_url, isolation_level='AUTOCOMMIT')
+    try:
+        with admin.connect() as conn:
+            exists = conn.execute("SELECT 1 FROM pg_database WHERE datname = %s",
+                                  (name,)).scalar()
+            if not exists:
+                conn.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        admin.dispose()
+
+    url.database = name
+    return str(url)
+
+
+os.environ['DATABASE_URL'] = worker_database_url(
+    TEST_DATABASE_URL, os.environ.get('PYTEST_XDIST_WORKER'))
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+os.environ.setdefault('LIKE_FLUSH_SECONDS', '0')
+
+from app import app  # noqa: E402 - must follow the environment set up above
+from models import db, MESSAGE_SEARCH_DDL  # noqa: E402
+
+if db.get_engine(app).dialect.name == 'sqlite':
+    # pysqlite's own transaction handling breaks SAVEPOINT; let SQLAlchemy
+    # emit BEGIN itself. Cascading deletes need foreign keys enforced.
+    @event.listens_for(db.get_engine(app), 'connect')
+    def configure_sqlite(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+    @event.listens_for(db.get_engine(app), 'begin')
+    def begin(conn):
+        conn.execute('BEGIN')
+
+with app.app_context():
+    db.create_all()
+
+    if db.engine.dialect.name == 'postgresql':
+        # The messages table may predate the search column.
+        db.session.execute(MESSAGE_SEARCH_DDL)
+        db.session.execute(
+            "SELECT setval(format('%I.%I', schemaname, sequencename), :first) "
+            "FROM pg_sequences WHERE coalesce(last_value, 0) < :first",
+            {'first': FIRST_GENERATED_ID})
+        db.session.commit()
+
+IS_POSTGRES = db.engine.dialect.name == 'postgresql'
+
+# Full text search needs PostgreSQL as soon as these are imported.
+collect_ignore = [] if IS_POSTGRES else ['test_search.py', 'test_benchmarks.py']
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', "commits: data must really be committed (other connections read it)")
+    config.addinivalue_line('markers', "postgres: needs PostgreSQL")
+
+
+def pytest_collection_modifyitems(config, items):
+    if IS_POSTGRES:
+        return
+
+    skip = pytest.mark.skip(reason="needs PostgreSQL")
+    for item in items:
+        if item.get_closest_marker('postgres'):
+            item.add_marker(skip)
+
+
+@pytest.fixture(autouse=True)
+def rollback_transaction(request):
+    """Run the test in a transaction rolled back when it ends."""
+
+    if request.node.get_closest_marker('commits'):
+        yield
+        return
+
+    connection = db.engine.connect()
+    transaction = connection.begin()
+
+    session = db.create_scoped_session(options={'bind': connection, 'binds': {}})
+    session.begin_nested()
+
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(sess, trans):
+        if trans.nested and not trans._parent.nested:
+            sess.expire_all()
+            sess.begin_nested()
+
+    # Flask-SQLAlchemy removes the session after each request; closing it
+    # would end the outer transaction, so only forget loaded objects.
+    close = session.remove
+    session.remove = lambda: session.expunge_all()
+
+    app_session, db.session = db.session, session
+
+    try:
+        yield
+    finally:
+        db.session = app_session
+        close()
+        transaction.rollback()
+        connection.close()
@@ -0,0 +1,232 @@
+"""Connection pool configuration and health metrics.
+
+`engine_options` turns the DB_* settings in app.config into
+SQLALCHEMY_ENGINE_OPTIONS: pool size, overflow, timeout, recycle, pre-ping
+and a per-statement timeout. Pooled engines use `MeteredQueuePool`, which
+records how long checkouts wait and logs a warning when the pool is close
+to exhausted. Statements slower than DB_SLOW_QUERY_MS are recorded in each
+engine's `slow_queries` log (see slowlog.py).
+"""
+
+import logging
+import os
+from threading import Lock
+from time import monotonic, perf_counter
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import slowlog
+
+logger = logging.getLogger(__name__)
+
+# Warn when this fraction of the pool (size + overflow) is checked out,
+# at most once every SATURATION_WARNING_INTERVAL seconds.
+SATURATION_WARNING_INTERVAL = 10
+
+
+def pool_config_from_env(environ=os.environ):
+    """DB_* pool settings, read from environment variables."""
+
+    return {
+        'DB_POOL_SIZE': int(environ.get('DB_POOL_SIZE', 5)),
+        'DB_MAX_OVERFLOW': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'DB_POOL_TIMEOUT': float(environ.get('DB_POOL_TIMEOUT', 30)),
+        'DB_POOL_RECYCLE': int(environ.get('DB_POOL_RECYCLE', 1800)),
+        'DB_POOL_PRE_PING': environ.get('DB_POOL_PRE_PING', '1') == '1',
+        'DB_STATEMENT_TIMEOUT_MS': int(environ.get('DB_STATEMENT_TIMEOUT_MS', 30000)),
+        'DB_POOL_SATURATION_WARNING': float(environ.get('DB_POOL_SATURATION_WARNING', 0.9)),
+        'DB_SLOW_QUERY_MS': float(environ.get('DB_SLOW_QUERY_MS', 100)),
+        'DB_SLOW_QUERY_LOG_SIZE': int(environ.get('DB_SLOW_QUERY_LOG_SIZE', 100)),
+    }
+
+
+def engine_options(uri, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri` from the DB_* settings in `config`."""
+
+    url = make_url(uri)
+    backend = url.get_backend_name()
+
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    timeout_ms = config['DB_STATEMENT_TIMEOUT_MS']
+
+    if config.get('DB_SLOW_QUERY_MS'):
+        options.update(slow_query_ms=config['DB_SLOW_QUERY_MS'],
+                       slow_query_log_size=config['DB_SLOW_QUERY_LOG_SIZE'])
+
+    if backend == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy shares one connection (StaticPool) for these.
+        return options
+
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+        saturation_warning=config['DB_POOL_SATURATION_WARNING'],
+    )
+
+    if backend == 'postgresql' and timeout_ms:
+        options['connect_args'] = {'options': f"-c statement_timeout={timeout_ms}"}
+
+    elif backend == 'sqlite':
+        options['connect_args'] = {'check_same_thread': False}
+        if timeout_ms:
+            options['sqlite_statement_timeout_ms'] = timeout_ms
+
+    return options
+
+
+def create_engine(sa_url, options):
+    """Create an engine, applying the options SQLAlchemy doesn't know about.
+
+    `sqlite_statement_timeout_ms` interrupts SQLite statements that run too
+    long, standing in for PostgreSQL's statement_timeout. With
+    `slow_query_ms`, statements taking that long are recorded in the
+    engine's `slow_queries` log, which keeps `slow_query_log_size` of them.
+    """
+
+    options = dict(options)
+    sqlite_timeout_ms = options.pop('sqlite_statement_timeout_ms', None)
+    slow_query_ms = options.pop('slow_query_ms', None)
+    slow_query_log_size = options.pop('slow_query_log_size', 100)
+
+    engine = sqlalchemy.create_engine(sa_url, **options)
+
+    if sqlite_timeout_ms:
+        install_sqlite_statement_timeout(engine, sqlite_timeout_ms)
+
+    if slow_query_ms:
+        slowlog.install(engine, slowlog.SlowQueryLog(slow_query_ms, slow_query_log_size))
+
+    return engine
+
+
+def install_sqlite_statement_timeout(engine, timeout_ms):
+    """Abort SQLite statements running longer than `timeout_ms`."""
+
+    timeout = timeout_ms / 1000
+
+    @event.listens_for(engine, 'connect')
+    def set_progress_handler(dbapi_connection, connection_record):
+        info = connection_record.info
+        info['statement_deadline'] = None
+
+        def past_deadline():
+            deadline = info['statement_deadline']
+            return 1 if deadline and perf_counter() > deadline else 0
+
+        dbapi_connection.set_progress_handler(past_deadline, 1000)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_deadline(conn, cursor, statement, parameters, context, executemany):
+        conn.info['statement_deadline'] = perf_counter() + timeout
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def clear_deadline(conn, cursor, statement, parameters, context, executemany):
+        conn.info['statement_deadline'] = None
+
+
+class PoolStats:
+    """Checkout counts and wait times for one pool."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.saturation_warnings = 0
+        self.last_warning = None
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self, wait):
+        with self._lock:
+            self.timeouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def should_warn(self):
+        """Count a saturation event; True if it's time to log another warning."""
+
+        with self._lock:
+            self.saturation_warnings += 1
+            now = monotonic()
+            if self.last_warning is None or now - self.last_warning > SATURATION_WARNING_INTERVAL:
+                self.last_warning = now
+                return True
+            return False
+
+    def as_dict(self):
+        with self._lock:
+            waits = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_wait_ms': self.total_wait / waits * 1000 if waits else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'saturation_warnings': self.saturation_warnings,
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times checkouts and warns when nearly exhausted."""
+
+    def __init__(self, creator, saturation_warning=0.9, **kw):
+        super().__init__(creator, **kw)
+        self.saturation_warning = saturation_warning
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.saturation_warning = self.saturation_warning
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_timeout(perf_counter() - start)
+            logger.error("Connection pool exhausted: %s", self.status())
+            raise
+
+        self.stats.record_checkout(perf_counter() - start)
+        self._check_saturation()
+
+        return connection
+
+    def _check_saturation(self):
+        if self._max_overflow < 0:
+            return
+
+        capacity = self.size() + self._max_overflow
+        if self.checkedout() >= capacity * self.saturation_warning and self.stats.should_warn():
+            logger.warning("Connection pool near saturation: %s", self.status())
+
+
+def pool_stats(engine):
+    """Pool size, usage and checkout wait metrics for `engine`."""
+
+    pool = engine.pool
+    stats = {'pool': pool.__class__.__name__, 'status': pool.status()}
+
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow(), checked_in=pool.checkedin())
+
+    if isinstance(pool, MeteredQueuePool):
+        stats.update(pool.stats.as_dict())
+
+    return stats
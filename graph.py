@@ -0,0 +1,375 @@
+"""Follow graph snapshots for mutuals and "who to follow" suggestions.
+
+The `follows` table is loaded into a compressed sparse row (CSR) snapshot:
+for each user, a slice of one flat `array` holds the ids they follow, and a
+second pair of arrays holds their followers. Follows made by this process
+are recorded in a small delta on top of the snapshot. Once it grows, a
+background thread compacts it into new arrays, and lookups only wait for
+them to be swapped in. So that other workers' writes show up, a snapshot
+older than GRAPH_SNAPSHOT_TTL seconds is reloaded from the database in a
+background thread; requests keep using the old one until the new one is
+ready, and follows this process records meanwhile are handed over to it.
+"""
+
+import logging
+from array import array
+from collections import Counter
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Follows
+
+logger = logging.getLogger(__name__)
+
+GRAPH_SNAPSHOT_TTL = 60
+GRAPH_COMPACT_AFTER = 1000
+
+
+class Adjacency:
+    """One direction of the follow graph in CSR form.
+
+    `offsets[i]:offsets[i + 1]` is the slice of `targets` belonging to the
+    user with dense index `i` in `index`.
+    """
+
+    __slots__ = ('index', 'offsets', 'targets')
+
+    def __init__(self, index, offsets, targets):
+        self.index = index
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_sorted_pairs(cls, pairs):
+        """Build from (source, target) pairs sorted by source."""
+
+        index = {}
+        offsets = array('q', [0])
+        targets = array('q')
+        current = None
+
+        for source, target in pairs:
+            if source != current:
+                if current is not None:
+                    offsets.append(len(targets))
+                index[source] = len(index)
+                current = source
+            targets.append(target)
+
+        if current is not None:
+            offsets.append(len(targets))
+
+        return cls(index, offsets, targets)
+
+    def neighbors(self, user_id):
+        """Array of the ids adjacent to `user_id` in the snapshot."""
+
+        i = self.index.get(user_id)
+
+        if i is None:
+            return array('q')
+
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def merged(self, added, removed):
+        """A new Adjacency with the per-user `added`/`removed` sets applied."""
+
+        changed = set(added) | set(removed)
+        sources = sorted(set(self.index) | changed)
+
+        index = {}
+        offsets = array('q', [0])
+        targets = array('q')
+
+        for source in sources:
+            if source in changed:
+                neighbors = set(self.neighbors(source))
+                neighbors |= added.get(source, set())
+                neighbors -= removed.get(source, set())
+                if not neighbors:
+                    continue
+                targets.extend(sorted(neighbors))
+            else:
+                targets.extend(self.neighbors(source))
+
+            index[source] = len(index)
+            offsets.append(len(targets))
+
+        return Adjacency(index, offsets, targets)
+
+
+class FollowGraph:
+    """Snapshot of who follows whom, plus this process's recent changes."""
+
+    def __init__(self, out_edges, in_edges):
+        self.out_edges = out_edges
+        self.in_edges = in_edges
+        self.loaded_at = monotonic()
+
+        self._lock = Lock()
+        self._delta = {key: {} for key in
+                       ('out_added', 'out_removed', 'in_added', 'in_removed')}
+        self._delta_size = 0
+
+        # While compacting: the changes recorded since it started, to keep
+        # in the delta once the compacted arrays are swapped in.
+        self._changes_since_compact = None
+
+        # While a replacement loads: the changes to hand over to it. Once
+        # handed over: the replacement, which records any later ones.
+        self._changes_since_reload = None
+        self._replacement = None
+
+    @classmethod
+    def from_edges(cls, edges):
+        """Build from (follower_id, followed_id) pairs."""
+
+        edges = list(edges)
+        out_edges = Adjacency.from_sorted_pairs(sorted(edges))
+        in_edges = Adjacency.from_sorted_pairs(
+            sorted((followed, follower) for follower, followed in edges))
+
+        return cls(out_edges, in_edges)
+
+    @classmethod
+    def from_db(cls):
+        """Load a snapshot of the `follows` table."""
+
+        follower = Follows.user_following_id
+        followed = Follows.user_being_followed_id
+
+        def pairs(source, target):
+            query = select([source, target]).order_by(source, target)
+            return db.session.execute(
+                query.execution_options(stream_results=True))
+
+        out_edges = Adjacency.from_sorted_pairs(pairs(follower, followed))
+        in_edges = Adjacency.from_sorted_pairs(pairs(followed, follower))
+
+        return cls(out_edges, in_edges)
+
+    @property
+    def edge_count(self):
+        return len(self.out_edges.targets)
+
+    ##########################################################################
+    # Changes
+
+    def _record(self, follower_id, followed_id, added):
+        """Record a follow (added=True) or unfollow in the delta."""
+
+        change = (follower_id, followed_id, added)
+
+        with self._lock:
+            replacement = self._replacement
+
+            if replacement is None:
+                if self._changes_since_reload is not None:
+                    self._changes_since_reload.append(change)
+                if self._changes_since_compact is not None:
+                    self._changes_since_compact.append(change)
+
+                self._apply(*change)
+
+                compact = (self._delta_size >= GRAPH_COMPACT_AFTER
+                           and self._changes_since_compact is None)
+                if compact:
+                    self._changes_since_compact = []
+
+        if replacement is not None:
+            replacement._record(*change)
+        elif compact:
+            Thread(target=self._compact, daemon=True).start()
+
+    def _apply(self, follower_id, followed_id, added):
+        """Add a change to the delta. Caller holds the lock."""
+
+        delta = self._delta
+        add, remove = ('added', 'removed') if added else ('removed', 'added')
+
+        for direction, source, target in (('out', follower_id, followed_id),
+                                          ('in', followed_id, follower_id)):
+            delta[f'{direction}_{add}'].setdefault(source, set()).add(target)
+            delta[f'{direction}_{remove}'].get(source, set()).discard(target)
+
+        self._delta_size += 1
+
+    def start_reload(self):
+        """Start keeping changes to hand over to a replacement being loaded."""
+
+        with self._lock:
+            self._changes_since_reload = []
+
+    def hand_over(self, replacement):
+        """Apply the changes recorded since `start_reload` to `replacement`,
+        and pass it any later ones."""
+
+        with self._lock:
+            changes, self._changes_since_reload = self._changes_since_reload or [], None
+            self._replacement = replacement
+
+        for change in changes:
+            replacement._record(*change)
+
+    def follow(self, follower_id, followed_id):
+        self._record(follower_id, followed_id, added=True)
+
+    def unfollow(self, follower_id, followed_id):
+        self._record(follower_id, followed_id, added=False)
+
+    def compact(self):
+        """Fold the delta into new arrays, blocking lookups only to swap them in."""
+
+        with self._lock:
+            if self._changes_since_compact is None:
+                self._changes_since_compact = []
+            out_edges, in_edges = self.out_edges, self.in_edges
+            delta = {key: {source: set(targets) for source, targets in changes.items()}
+                     for key, changes in self._delta.items()}
+
+        try:
+            out_edges = out_edges.merged(delta['out_added'], delta['out_removed'])
+            in_edges = in_edges.merged(delta['in_added'], delta['in_removed'])
+        except BaseException:
+            with self._lock:
+                self._changes_since_compact = None
+            raise
+
+        with self._lock:
+            self.out_edges, self.in_edges = out_edges, in_edges
+            self._delta = {key: {} for key in delta}
+            self._delta_size = 0
+
+            changes, self._changes_since_compact = self._changes_since_compact, None
+            for change in changes:
+                self._apply(*change)
+
+    def _compact(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Compacting the follow graph failed")
+
+    ##########################################################################
+    # Lookups
+
+    def _neighbors(self, direction, user_id):
+        """Set of neighbor ids including this process's changes."""
+
+        adjacency = self.out_edges if direction == 'out' else self.in_edges
+
+        with self._lock:
+            added = self._delta[f'{direction}_added'].get(user_id)
+            removed = self._delta[f'{direction}_removed'].get(user_id)
+            neighbors = adjacency.neighbors(user_id)
+
+            if not added and not removed:
+                return neighbors
+
+            neighbors = set(neighbors)
+            neighbors |= added or set()
+            neighbors -= removed or set()
+            return neighbors
+
+    def following(self, user_id):
+        """Ids that `user_id` follows."""
+
+        return set(self._neighbors('out', user_id))
+
+    def followers(self, user_id):
+        """Ids that follow `user_id`."""
+
+        return set(self._neighbors('in', user_id))
+
+    def mutual_followers(self, user_id, other_id):
+        """How many users follow both `user_id` and `other_id`."""
+
+        return len(self.followers(user_id) & self.followers(other_id))
+
+    def followed_by_following(self, viewer_id, user_id):
+        """Ids of people `viewer_id` follows who also follow `user_id`."""
+
+        return self.following(viewer_id) & self.followers(user_id)
+
+    def suggestions(self, user_id, limit=5):
+        """Friends-of-friends `user_id` doesn't follow yet, best first.
+
+        Returns (id, score) pairs, where score is how many of the people
+        `user_id` follows already follow that user.
+        """
+
+        following = self.following(user_id)
+        scores = Counter()
+
+        for followed_id in following:
+            scores.update(self._neighbors('out', followed_id))
+
+        for seen in following | {user_id}:
+            scores.pop(seen, None)
+
+        return scores.most_common(limit)
+
+
+##############################################################################
+# Per-app snapshot
+
+_graph_lock = Lock()
+
+
+def _reload(app, stale):
+    try:
+        with app.app_context():
+            graph = FollowGraph.from_db()
+            db.session.remove()
+        # Follows recorded while it loaded may have been committed too late
+        # to be in it.
+        stale.hand_over(graph)
+        app.extensions['follow_graph'] = graph
+    finally:
+        app.extensions.pop('follow_graph_reloading', None)
+
+
+def get_graph():
+    """The current app's follow graph.
+
+    The first call loads it; after that a stale snapshot is served while a
+    background thread loads a new one.
+    """
+
+    app = current_app._get_current_object()
+    graph = app.extensions.get('follow_graph')
+    ttl = app.config.get('GRAPH_SNAPSHOT_TTL', GRAPH_SNAPSHOT_TTL)
+
+    if graph is None:
+        with _graph_lock:
+            graph = app.extensions.get('follow_graph')
+            if graph is None:
+                graph = app.extensions['follow_graph'] = FollowGraph.from_db()
+
+    elif monotonic() - graph.loaded_at > ttl:
+        with _graph_lock:
+            if not app.extensions.get('follow_graph_reloading'):
+                app.extensions['follow_graph_reloading'] = True
+                graph.start_reload()
+                Thread(target=_reload, args=(app, graph), daemon=True).start()
+
+    return graph
+
+
+def note_follow(follower_id, followed_id):
+    """Record a new follow in the loaded snapshot, if there is one."""
+
+    graph = current_app.extensions.get('follow_graph')
+    if graph is not None:
+        graph.follow(follower_id, followed_id)
+
+
+def note_unfollow(follower_id, followed_id):
+    """Record an unfollow in the loaded snapshot, if there is one."""
+
+    graph = current_app.extensions.get('follow_graph')
+    if graph is not None:
+        graph.unfollow(follower_id, followed_id)
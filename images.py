@@ -0,0 +1,464 @@
+"""Resized, cached copies of profile and header images.
+
+Users' `image_url` and `header_image_url` usually point at full-size
+remote images, which pages were loading just to show 48-pixel avatars.
+Templates pass those URLs through the `thumbnail` filter instead:
+
+    <img src="{{ user.image_url|thumbnail('avatar') }}">
+
+The first time a URL is seen at a size, the filter links to
+/images/<size>?src=<signed url>. For a /static/ image that resizes it
+and redirects to /images/<size>/<content hash>.<ext>; a remote image is
+queued to be fetched and resized by one of IMAGE_FETCH_WORKERS
+background threads, and the request redirects to the original meanwhile.
+Once resized, the filter links straight to the hashed file, which is
+served with a year-long immutable Cache-Control. The `src` parameter is
+signed with the app's secret key so the route can't be used as an open
+proxy.
+
+Users set their image URLs themselves, so remote fetches are limited:
+only hosts in IMAGE_PROXY_HOSTS (and their subdomains) are fetched from,
+if it's set, and never a host that resolves to a loopback, private,
+link-local, reserved or multicast address. That's checked before each
+connection, which then goes to the checked address, and again for every
+redirect (at most IMAGE_MAX_REDIRECTS).
+
+Resized files live under IMAGE_CACHE_DIR, one directory per size, with a
+`sources` directory mapping each original URL to its file so the mapping
+survives restarts. Each worker keeps the IMAGE_NAMES_MAX most recently
+used mappings in memory, along with URLs that aren't resized yet or
+couldn't be: those aren't looked for on disk again, and failed ones
+aren't fetched again, for IMAGE_RETRY_SECONDS. URLs that can't be fetched
+(anything but /static/ paths and http(s) URLs) are left as they are, as
+is everything when Pillow, which is optional, isn't installed.
+"""
+
+import hashlib
+import http.client
+import ipaddress
+import os
+import socket
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from threading import Lock
+from urllib.parse import urljoin, urlsplit
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.security import safe_join
+
+# Only Pillow's package is imported here; its image modules are slow to
+# import and only needed once something is resized (see `resize`).
+try:
+    import PIL
+except ImportError:  # pragma: no cover - optional dependency
+    PIL = None
+
+
+ImageSize = namedtuple('ImageSize', 'width height crop')
+
+# Twice the largest size each is shown at in style.css, for high-DPI
+# screens. Avatars and cards are cropped square; heroes are scaled to fit.
+IMAGE_SIZES = {
+    'avatar': ImageSize(96, 96, True),
+    'card': ImageSize(400, 400, True),
+    'hero': ImageSize(1280, 480, False),
+}
+
+JPEG_QUALITY = 85
+
+IMAGE_FETCH_WORKERS = 2
+IMAGE_MAX_REDIRECTS = 3
+
+IMAGE_NAMES_MAX = 10_000
+IMAGE_RETRY_SECONDS = 300
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class ImageError(Exception):
+    """The original image couldn't be fetched or read."""
+
+
+# What's remembered of a URL with no resized file: not to look for one
+# again until `retry_at` (a time.monotonic() time), and whether that's
+# because fetching or resizing it `failed`.
+Missing = namedtuple('Missing', 'retry_at failed')
+
+
+def init_app(app):
+    """Set default image cache settings and register the `thumbnail` filter."""
+
+    app.config.setdefault('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'image-cache'))
+    app.config.setdefault('IMAGE_FETCH_TIMEOUT', 5)
+    app.config.setdefault('IMAGE_MAX_BYTES', 10 * 1024 * 1024)
+    app.config.setdefault('IMAGE_MAX_REDIRECTS', IMAGE_MAX_REDIRECTS)
+    app.config.setdefault('IMAGE_FETCH_WORKERS', IMAGE_FETCH_WORKERS)
+    app.config.setdefault('IMAGE_NAMES_MAX', IMAGE_NAMES_MAX)
+    app.config.setdefault('IMAGE_RETRY_SECONDS', IMAGE_RETRY_SECONDS)
+    # Host names remote images may be fetched from; None: any public host.
+    app.config.setdefault('IMAGE_PROXY_HOSTS', None)
+
+    app.add_template_filter(thumbnail_url, 'thumbnail')
+
+
+def _signer():
+    return URLSafeSerializer(current_app.secret_key, salt='image-proxy')
+
+
+def _source_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def _size_dir(size):
+    return os.path.join(current_app.config['IMAGE_CACHE_DIR'], size)
+
+
+_names_lock = Lock()
+
+
+def _names():
+    """The app's most recently used (size, url) -> file name or Missing."""
+
+    app = current_app._get_current_object()
+
+    with _names_lock:
+        names = app.extensions.get('image_names')
+        if names is None:
+            names = app.extensions['image_names'] = OrderedDict()
+    return names
+
+
+def _remembered(url, size):
+    """The file name or Missing remembered for `url` at `size`, if any and
+    not due to be looked for again."""
+
+    names = _names()
+
+    with _names_lock:
+        entry = names.get((size, url))
+        if entry is not None:
+            names.move_to_end((size, url))
+
+    if isinstance(entry, Missing) and entry.retry_at <= time.monotonic():
+        return None
+    return entry
+
+
+def _remember(url, size, entry):
+    names = _names()
+    limit = current_app.config['IMAGE_NAMES_MAX']
+
+    with _names_lock:
+        names[(size, url)] = entry
+        names.move_to_end((size, url))
+        while len(names) > limit:
+            names.popitem(last=False)
+
+
+def _missing(failed=False):
+    return Missing(time.monotonic() + current_app.config['IMAGE_RETRY_SECONDS'], failed)
+
+
+def _read_source(url, size):
+    """The file name recorded on disk for `url` at `size`, or None."""
+
+    try:
+        with open(os.path.join(_size_dir(size), 'sources', _source_key(url))) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def cached_name(url, size):
+    """The file name `url` has been resized to at `size`, or None."""
+
+    entry = _remembered(url, size)
+
+    if entry is None:
+        entry = _read_source(url, size) or _missing()
+        _remember(url, size, entry)
+
+    return None if isinstance(entry, Missing) else entry
+
+
+def failed(url, size):
+    """Whether fetching or resizing `url` for `size` failed within the
+    last IMAGE_RETRY_SECONDS."""
+
+    entry = _remembered(url, size)
+    return isinstance(entry, Missing) and entry.failed
+
+
+def allowed_host(host):
+    """Whether remote images may be fetched from `host` (see IMAGE_PROXY_HOSTS)."""
+
+    hosts = current_app.config['IMAGE_PROXY_HOSTS']
+    if not host:
+        return False
+    if hosts is None:
+        return True
+
+    host = host.lower().rstrip('.')
+    return any(host == allowed or host.endswith('.' + allowed) for allowed in hosts)
+
+
+def fetchable(url):
+    """Whether `url` is a /static/ path or an http(s) URL on an allowed host."""
+
+    if url.startswith('/static/'):
+        return True
+
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and allowed_host(parts.hostname)
+
+
+def public_address(host, port):
+    """An address of `host` to connect to, if all of its addresses are public.
+
+    Raises ImageError for hosts that don't resolve, or resolve to any
+    loopback, private, link-local, reserved or multicast address.
+    """
+
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, UnicodeError) as exc:
+        raise ImageError(f"Can't resolve {host}: {exc}")
+
+    for *_, sockaddr in infos:
+        address = ipaddress.ip_address(sockaddr[0])
+        if getattr(address, 'ipv4_mapped', None):
+            address = address.ipv4_mapped
+
+        if (not address.is_global or address.is_loopback or address.is_private
+                or address.is_link_local or address.is_reserved
+                or address.is_multicast or address.is_unspecified):
+            raise ImageError(f"{host} isn't a public host")
+
+    return infos[0][4][0]
+
+
+def thumbnail_url(url, size):
+    """Where to load `url` resized to `size` from."""
+
+    if PIL is None or not url or not fetchable(url):
+        return url
+
+    name = cached_name(url, size)
+    if name:
+        return f"/images/{size}/{name}"
+
+    if failed(url, size):
+        return url
+
+    return f"/images/{size}?src={_signer().dumps(url)}"
+
+
+def source_url(src):
+    """The original URL signed into a `src` parameter, or None if tampered."""
+
+    try:
+        return _signer().loads(src)
+    except BadSignature:
+        return None
+
+
+def fetch(url):
+    """The bytes of the original image at `url`.
+
+    /static/ paths are read from the static folder; anything else must be
+    an http(s) URL on an allowed, public host (see `fetchable` and
+    `public_address`), no larger than IMAGE_MAX_BYTES.
+    """
+
+    config = current_app.config
+
+    if url.startswith('/static/'):
+        path = safe_join(current_app.static_folder, url[len('/static/'):])
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except (OSError, TypeError):
+            raise ImageError(f"No static image at {url}")
+
+    for _ in range(config['IMAGE_MAX_REDIRECTS'] + 1):
+        if not fetchable(url):
+            raise ImageError(f"Can't fetch {url}")
+
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        address = public_address(parts.hostname, port)
+
+        status, location, data = _get(url, address, config['IMAGE_FETCH_TIMEOUT'],
+                                      config['IMAGE_MAX_BYTES'])
+        if location is None:
+            break
+        url = urljoin(url, location)
+    else:
+        raise ImageError(f"Too many redirects fetching {url}")
+
+    if status != 200:
+        raise ImageError(f"Couldn't fetch {url}: HTTP {status}")
+
+    if len(data) > config['IMAGE_MAX_BYTES']:
+        raise ImageError(f"{url} is too large")
+
+    return data
+
+
+def _connection(parts, address, timeout):
+    """An HTTP(S) connection to the host of `parts`, at `address`."""
+
+    https = parts.scheme == 'https'
+    port = parts.port or (443 if https else 80)
+
+    connection_class = http.client.HTTPSConnection if https else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, port, timeout=timeout)
+
+    # Connect to the address that was checked, not whatever the name
+    # resolves to next; certificates are still checked against the name.
+    connection._create_connection = (
+        lambda _, timeout, source_address:
+        socket.create_connection((address, port), timeout, source_address))
+
+    return connection
+
+
+def _get(url, address, timeout, max_bytes):
+    """GET `url` from `address` without following redirects: (status,
+    redirect location or None, at most `max_bytes` + 1 bytes of body)."""
+
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    connection = _connection(parts, address, timeout)
+    try:
+        connection.request('GET', path, headers={'User-Agent': 'warbler-images'})
+        resp = connection.getresponse()
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader('Location'):
+            return resp.status, resp.getheader('Location'), b''
+        return resp.status, None, resp.read(max_bytes + 1)
+    except (OSError, ValueError, http.client.HTTPException) as exc:
+        raise ImageError(f"Couldn't fetch {url}: {exc}")
+    finally:
+        connection.close()
+
+
+def resize(data, size):
+    """Resize image bytes to `size`; returns (bytes, extension)."""
+
+    from PIL import Image, ImageOps
+
+    width, height, crop = IMAGE_SIZES[size]
+
+    # Decoding is lazy, so truncated files only fail once resized.
+    try:
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+
+        if crop:
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+    except (OSError, Image.DecompressionBombError) as exc:
+        raise ImageError(f"Not an image: {exc}")
+
+    out = BytesIO()
+
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image.convert('RGBA').save(out, 'PNG', optimize=True)
+        ext = 'png'
+    else:
+        image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY,
+                                  optimize=True, progressive=True)
+        ext = 'jpg'
+
+    return out.getvalue(), ext
+
+
+def _write(path, data):
+    """Write `data` to `path` atomically."""
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def make_thumbnail(url, size):
+    """Fetch and resize `url` to `size` if not done yet; returns its file name.
+
+    A failure is remembered (see `failed`) before the ImageError is raised.
+    """
+
+    # Look on disk even past a remembered miss: another worker may have
+    # resized it since.
+    entry = _remembered(url, size)
+    name = entry if isinstance(entry, str) else _read_source(url, size)
+
+    if name is None:
+        try:
+            data, ext = resize(fetch(url), size)
+        except ImageError:
+            _remember(url, size, _missing(failed=True))
+            raise
+
+        name = f"{hashlib.sha256(data).hexdigest()[:20]}.{ext}"
+
+        directory = _size_dir(size)
+        os.makedirs(os.path.join(directory, 'sources'), exist_ok=True)
+
+        _write(os.path.join(directory, name), data)
+        _write(os.path.join(directory, 'sources', _source_key(url)), name.encode())
+
+    _remember(url, size, name)
+    return name
+
+
+##############################################################################
+# Fetching in the background
+
+_fetcher_lock = Lock()
+
+
+def _fetcher():
+    """The app's fetch threads and the (size, url) pairs queued on them."""
+
+    app = current_app._get_current_object()
+
+    with _fetcher_lock:
+        fetcher = app.extensions.get('image_fetcher')
+        if fetcher is None:
+            fetcher = app.extensions['image_fetcher'] = (
+                ThreadPoolExecutor(app.config['IMAGE_FETCH_WORKERS'],
+                                   thread_name_prefix='image-fetch'), {})
+    return fetcher
+
+
+def queue_thumbnail(url, size):
+    """Fetch and resize `url` to `size` in a background thread.
+
+    Returns a Future of its file name (or ImageError); a URL already
+    queued at that size isn't queued twice.
+    """
+
+    app = current_app._get_current_object()
+    executor, queued = _fetcher()
+
+    def run():
+        try:
+            with app.app_context():
+                return make_thumbnail(url, size)
+        finally:
+            with _fetcher_lock:
+                queued.pop((size, url), None)
+
+    with _fetcher_lock:
+        future = queued.get((size, url))
+        if future is None:
+            future = queued[(size, url)] = executor.submit(run)
+
+    return future
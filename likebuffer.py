@@ -0,0 +1,439 @@
+"""Coalescing like and unlike writes.
+
+Every click on a like button used to be a transaction of its own, and
+clicking one a few times in a row wrote every click. Toggles now go into
+each process's `LikeBuffer`, which keeps only the latest wanted state of
+each (user, message) pair: toggling back to what's in the database drops
+the pending change altogether.
+
+The buffer is written out LIKE_FLUSH_SECONDS after its first change, or as
+soon as it holds LIKE_FLUSH_MAX changes, in one transaction. That is one
+multi-row INSERT for the likes, one DELETE for the unlikes and one score
+update per message for the popular feed (see popular.py). On PostgreSQL
+the scores only count the rows that really changed (a like made through
+another worker meanwhile isn't counted twice).
+
+Until then, readers see the pending changes through an overlay:
+`liked_message_ids`, `liked_timeline` and `user_profile` (its
+likes_count) apply them on top of what the database says. Other workers
+see a change once it's written.
+
+Pending changes are written out when a worker exits normally, but are
+lost if it's killed. With LIKE_FLUSH_SECONDS set to 0 each toggle is
+written out before the response is sent.
+
+If writing a batch fails, its changes stay pending and are tried again
+after LIKE_FLUSH_SECONDS (1 s if that's 0), doubling after each failure
+in a row up to LIKE_RETRY_MAX_SECONDS.
+"""
+
+import atexit
+import logging
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from threading import Lock, Timer
+
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Likes, MessageScore
+import popular
+import queries
+
+logger = logging.getLogger(__name__)
+
+LIKE_FLUSH_SECONDS = 1.0
+LIKE_FLUSH_MAX = 1000
+LIKE_RETRY_SECONDS = 1.0
+LIKE_RETRY_MAX_SECONDS = 60.0
+
+
+def init_app(app):
+    """Set default buffer settings and give the app its buffer."""
+
+    app.config.setdefault('LIKE_FLUSH_SECONDS', LIKE_FLUSH_SECONDS)
+    app.config.setdefault('LIKE_FLUSH_MAX', LIKE_FLUSH_MAX)
+
+    buffer = app.extensions['like_buffer'] = LikeBuffer(
+        app, app.config['LIKE_FLUSH_SECONDS'], app.config['LIKE_FLUSH_MAX'])
+    atexit.register(buffer.flush_in_app)
+
+
+class PendingLike:
+    """The wanted state of one user's like of one message."""
+
+    __slots__ = ('message_timestamp', 'liked_at_before', 'liked', 'liked_at')
+
+    def __init__(self, message_timestamp, liked_at_before):
+        self.message_timestamp = message_timestamp
+        # When it's liked in the database (None: it isn't).
+        self.liked_at_before = liked_at_before
+        self.liked = liked_at_before is not None
+        self.liked_at = liked_at_before
+        self.toggle()
+
+    def toggle(self):
+        self.liked = not self.liked
+        self.liked_at = datetime.utcnow() if self.liked else None
+
+    @property
+    def changed(self):
+        return self.liked != (self.liked_at_before is not None)
+
+
+class LikeBuffer:
+    """Like changes by user id and message id, not yet in the database."""
+
+    def __init__(self, app, flush_seconds=LIKE_FLUSH_SECONDS, max_pending=LIKE_FLUSH_MAX):
+        self.app = app
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = {}
+        self._size = 0
+        # The batch being written out; still unwritten as far as readers know.
+        self._writing = {}
+        self._timer = None
+        # Failed writes in a row; retries back off by this.
+        self._failures = 0
+        # Bumped whenever a batch stops being `_writing`: the database may
+        # then say something other than it did before.
+        self.generation = 0
+        self.toggles = 0
+        self.cancelled = 0
+        self.written = 0
+        self.batches = 0
+
+    def toggle(self, user_id, message_id, message_timestamp, liked_at, generation):
+        """Like or unlike a message; returns whether it's now liked.
+
+        `liked_at` is when the database said `user_id` liked it (None: not
+        liked), read once `generation` was the buffer's generation. It's
+        only used if no change to the like is pending; if a batch has been
+        written out since it was read, it's read again.
+        """
+
+        while True:
+            with self._lock:
+                pending = self._pending.get(user_id, {})
+                writing = self._writing.get(user_id, {})
+                if (message_id in pending or message_id in writing
+                        or generation == self.generation):
+                    flush_now, liked = self._toggle(user_id, message_id,
+                                                    message_timestamp, liked_at)
+                    break
+                generation = self.generation
+
+            # Read before the batch with this like in it was written.
+            target = queries.like_target(message_id, user_id)
+            liked_at = target.liked_at if target is not None else None
+
+        if flush_now:
+            self.flush()
+
+        return liked
+
+    def _toggle(self, user_id, message_id, message_timestamp, liked_at):
+        """`toggle`, with the lock held; returns (flush now?, liked now?)."""
+
+        self.toggles += 1
+        pending = self._pending.setdefault(user_id, {})
+        entry = pending.get(message_id)
+
+        if entry is not None:
+            entry.toggle()
+        else:
+            writing = self._writing.get(user_id, {}).get(message_id)
+            if writing is not None:
+                liked_at = writing.liked_at
+            entry = pending[message_id] = PendingLike(message_timestamp, liked_at)
+            self._size += 1
+
+        if not entry.changed:
+            del pending[message_id]
+            self._size -= 1
+            self.cancelled += 1
+        if not pending:
+            del self._pending[user_id]
+
+        flush_now = self.flush_seconds <= 0 or self._size >= self.max_pending
+        if self._size and not flush_now:
+            self._start_timer(self.flush_seconds)
+
+        return flush_now, entry.liked
+
+    def _start_timer(self, seconds):
+        """Flush in `seconds`, unless a flush is already due; with the lock held."""
+
+        if self._timer is None:
+            self._timer = Timer(seconds, self.flush_in_app)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def changes(self, user_id):
+        """{message_id: (liked in the database, liked now)} for `user_id`'s
+        unwritten changes."""
+
+        if not self._pending and not self._writing:
+            return {}
+
+        with self._lock:
+            changes = {message_id: (entry.liked_at_before is not None, entry.liked)
+                       for message_id, entry in self._writing.get(user_id, {}).items()}
+
+            for message_id, entry in self._pending.get(user_id, {}).items():
+                before = (changes[message_id][0] if message_id in changes
+                          else entry.liked_at_before is not None)
+                changes[message_id] = (before, entry.liked)
+
+        return changes
+
+    def flush(self):
+        """Write out the pending changes; returns how many rows changed.
+
+        Needs an app context. If writing fails, the changes are kept
+        and tried again later (see `_requeue`).
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                batch, self._pending, self._size = self._pending, {}, 0
+                self._writing = batch
+
+            if not batch:
+                return 0
+
+            try:
+                written = write(batch)
+            except Exception:
+                logger.exception("Writing out like changes failed; keeping them for later")
+                db.session.rollback()
+                written = 0
+                self._requeue(batch)
+            else:
+                self._failures = 0
+            finally:
+                with self._lock:
+                    self._writing = {}
+                    self.generation += 1
+
+            with self._lock:
+                self.written += written
+                self.batches += 1
+
+            return written
+
+    def _requeue(self, batch):
+        """Keep a batch that couldn't be written, and try again later:
+        longer after each failure in a row."""
+
+        with self._lock:
+            for user_id, entries in batch.items():
+                pending = self._pending.setdefault(user_id, {})
+                for message_id, entry in entries.items():
+                    if message_id not in pending:
+                        pending[message_id] = entry
+                        self._size += 1
+
+            self._failures += 1
+            seconds = self.flush_seconds if self.flush_seconds > 0 else LIKE_RETRY_SECONDS
+            self._start_timer(min(seconds * 2 ** (self._failures - 1), LIKE_RETRY_MAX_SECONDS))
+
+    def flush_in_app(self):
+        """`flush`, from a thread (or exit handler) without an app context."""
+
+        with self.app.app_context():
+            try:
+                self.flush()
+            finally:
+                db.session.remove()
+
+    def as_dict(self):
+        return {
+            'pending': self._size,
+            'toggles': self.toggles,
+            'cancelled': self.cancelled,
+            'written': self.written,
+            'batches': self.batches,
+            'failures': self._failures,
+        }
+
+
+def write(batch):
+    """Write `batch` ({user_id: {message_id: PendingLike}}) in one transaction.
+
+    Returns how many rows changed. If the batch can't be written because
+    a message or user in it was deleted meanwhile, its changes are written
+    one at a time, skipping those.
+    """
+
+    try:
+        written = _write([(user_id, message_id, entry)
+                          for user_id, entries in batch.items()
+                          for message_id, entry in entries.items()])
+        db.session.commit()
+        return written
+    except IntegrityError:
+        db.session.rollback()
+
+    written = 0
+    for user_id, entries in batch.items():
+        for message_id, entry in entries.items():
+            try:
+                written += _write([(user_id, message_id, entry)])
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                logger.info("Dropped like change of message %s by user %s: it's gone",
+                            message_id, user_id)
+
+    return written
+
+
+def _write(changes):
+    """Insert and delete the likes in `changes` and update their scores.
+
+    Returns how many rows changed.
+    """
+
+    table = Likes.__table__
+    dialect = db.session.get_bind(mapper=None, clause=table).dialect.name
+
+    added = [(user_id, message_id, entry) for user_id, message_id, entry in changes
+             if entry.liked]
+    removed = [(user_id, message_id, entry) for user_id, message_id, entry in changes
+               if not entry.liked]
+
+    # (message_id, liked_at, +1 or -1) for each like added or removed.
+    scored = []
+
+    if removed:
+        query = table.delete().where(or_(*[
+            and_(table.c.user_id == user_id, table.c.message_id == message_id)
+            for user_id, message_id, _ in removed]))
+
+        if dialect == 'postgresql':
+            query = query.returning(table.c.message_id, table.c.liked_at)
+            scored += [(message_id, liked_at, -1)
+                       for message_id, liked_at in db.session.execute(query)]
+        else:
+            db.session.execute(query)
+            scored += [(message_id, entry.liked_at_before, -1)
+                       for _, message_id, entry in removed]
+
+    if added:
+        rows = [dict(user_id=user_id, message_id=message_id, liked_at=entry.liked_at)
+                for user_id, message_id, entry in added]
+
+        if dialect == 'postgresql':
+            query = (pg_insert(table).values(rows).on_conflict_do_nothing()
+                     .returning(table.c.message_id, table.c.liked_at))
+            scored += [(message_id, liked_at, 1)
+                       for message_id, liked_at in db.session.execute(query)]
+        else:
+            query = table.insert().values(rows)
+            if dialect == 'sqlite':
+                query = query.prefix_with('OR IGNORE')
+            db.session.execute(query)
+            scored += [(message_id, entry.liked_at, 1) for _, message_id, entry in added]
+
+    timestamps = {message_id: entry.message_timestamp for _, message_id, entry in changes}
+    scores = {}
+
+    for message_id, liked_at, sign in scored:
+        weight = popular.like_weight(timestamps[message_id], liked_at)
+        if weight is not None:
+            total, likes = scores.get(message_id, (0.0, 0))
+            scores[message_id] = (total + sign * weight, likes + sign)
+
+    for message_id, (weight, likes) in scores.items():
+        MessageScore.add(message_id, timestamps[message_id], weight, likes=likes)
+
+    return len(scored)
+
+
+##############################################################################
+# Reading through the buffer
+
+
+def get_buffer():
+    """The current app's like buffer."""
+
+    return current_app.extensions['like_buffer']
+
+
+def generation():
+    """The buffer's generation, to read the like with before `toggle`."""
+
+    return get_buffer().generation
+
+
+def toggle(user_id, message_id, message_timestamp, liked_at, generation):
+    """Like or unlike a message through the buffer; returns whether it's now liked."""
+
+    return get_buffer().toggle(user_id, message_id, message_timestamp, liked_at, generation)
+
+
+def liked_message_ids(user_id, message_ids=None):
+    """`queries.liked_message_ids`, with `user_id`'s unwritten changes."""
+
+    liked_ids = queries.liked_message_ids(user_id, message_ids)
+    changes = get_buffer().changes(user_id)
+
+    if changes and message_ids is not None:
+        message_ids = set(message_ids)
+        changes = {message_id: change for message_id, change in changes.items()
+                   if message_id in message_ids}
+
+    for message_id, (_, liked) in changes.items():
+        if liked:
+            liked_ids.add(message_id)
+        else:
+            liked_ids.discard(message_id)
+
+    return liked_ids
+
+
+def liked_timeline(user_id, limit=queries.TIMELINE_LIMIT):
+    """The first page of `queries.liked_timeline`, with `user_id`'s unwritten changes."""
+
+    changes = get_buffer().changes(user_id)
+    unliked = {message_id for message_id, (_, liked) in changes.items() if not liked}
+
+    # Enough rows for a full page once unliked messages are taken out.
+    rows = queries.liked_timeline(user_id, limit=limit + len(unliked))
+    if not changes:
+        return rows
+
+    shown = {row.id for row in rows}
+    rows = [row for row in rows if row.id not in unliked]
+    rows += queries.messages_by_ids(message_id for message_id, (_, liked) in changes.items()
+                                    if liked and message_id not in shown)
+
+    return sorted(rows, key=lambda row: (row.timestamp, row.id), reverse=True)[:limit]
+
+
+def user_profile(user_id, viewer_id=None):
+    """`queries.user_profile`, with `user_id`'s unwritten changes in likes_count."""
+
+    row = queries.user_profile(user_id, viewer_id)
+    if row is None:
+        return None
+
+    delta = sum(liked - before for before, liked in get_buffer().changes(user_id).values())
+    if not delta:
+        return row
+
+    return _profile_row(tuple(row.keys()))(*row)._replace(likes_count=row.likes_count + delta)
+
+
+@lru_cache()
+def _profile_row(fields):
+    return namedtuple('ProfileRow', fields)
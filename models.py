@@ -1,11 +1,45 @@
 """SQLAlchemy models for Warbler."""
 
+import os
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy import DDL, event, literal_column, orm
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+import dbpool
+from replicas import RoutingSession
+
+DEFAULT_DATABASE_URL = 'postgresql:///warbler'
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy, creating engines through `dbpool` and sessions
+    that can read from replicas (see `replicas`)."""
+
+    def create_engine(self, sa_url, engine_opts):
+        return dbpool.create_engine(sa_url, engine_opts)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def get_bcrypt():
+    """Flask-Bcrypt, set up for `db`'s app on first use.
+
+    Imported only then: scripts that just read the database never hash a
+    password.
+    """
+
+    app = db.get_app()
+    bcrypt = app.extensions.get('bcrypt')
+    if bcrypt is None:
+        from flask_bcrypt import Bcrypt
+        bcrypt = app.extensions['bcrypt'] = Bcrypt(app)
+    return bcrypt
+
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -53,12 +87,59 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    @classmethod
+    def follow(cls, follower_id, followed_id):
+        """Make `follower_id` follow `followed_id`.
+
+        Runs a single INSERT that does nothing if the follow already exists,
+        without loading either user's collections. Returns True if a row
+        was added. Raises IntegrityError if either user doesn't exist.
+        """
+
+        values = dict(user_following_id=follower_id,
+                      user_being_followed_id=followed_id)
+        dialect = db.session.get_bind(mapper=None, clause=cls.__table__).dialect.name
+
+        if dialect == 'postgresql':
+            stmt = pg_insert(cls.__table__).values(**values).on_conflict_do_nothing()
+        elif dialect == 'sqlite':
+            stmt = cls.__table__.insert().values(**values).prefix_with('OR IGNORE')
+        else:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(cls.__table__.insert().values(**values))
+            except IntegrityError:
+                if not cls.query.filter_by(**values).count():
+                    raise
+                return False
+            return True
+
+        return db.session.execute(stmt).rowcount == 1
+
+    @classmethod
+    def unfollow(cls, follower_id, followed_id):
+        """Stop `follower_id` following `followed_id`.
+
+        A single DELETE; returns True if a follow was removed.
+        """
+
+        stmt = cls.__table__.delete().where(
+            (cls.user_following_id == follower_id)
+            & (cls.user_being_followed_id == followed_id))
+
+        return db.session.execute(stmt).rowcount == 1
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
+    # Each user can like a message once.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True
@@ -72,8 +153,12 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
-        # Check this functionality - unique=True.
+    )
+
+    liked_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
     )
 
 
@@ -172,7 +257,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = get_bcrypt().generate_password_hash(password).decode('UTF-8')
 
         user = User(
             username=username,
@@ -198,7 +283,7 @@ class User(db.Model):
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = get_bcrypt().check_password_hash(user.password, password)
             if is_auth:
                 return user
 
@@ -210,6 +295,11 @@ class Message(db.Model):
 
     __tablename__ = 'messages'
 
+    # Timelines filter by author and page newest-first.
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -223,7 +313,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -238,6 +328,202 @@ class Message(db.Model):
 
     # **********
 
+    @classmethod
+    def search_vector(cls):
+        """The `search_vector` tsvector column (see MESSAGE_SEARCH_DDL).
+
+        It's PostgreSQL-only and not mapped, so the model still works on
+        databases without it.
+        """
+
+        return literal_column('messages.search_vector', type_=TSVECTOR)
+
+
+# Full-text search (PostgreSQL): a generated tsvector column, which
+# PostgreSQL keeps current (along with its GIN index) on every INSERT and
+# UPDATE. The statements are idempotent, so running them also upgrades an
+# existing database.
+MESSAGE_SEARCH_CONFIG = 'english'
+
+MESSAGE_SEARCH_DDL = DDL(
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{MESSAGE_SEARCH_CONFIG}', text)) STORED; "
+    "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages "
+    "USING gin (search_vector)")
+
+event.listen(Message.__table__, 'after_create',
+             MESSAGE_SEARCH_DDL.execute_if(dialect='postgresql'))
+
+
+class MessageTag(db.Model):
+    """A #tag used in a message (see tags.index_message)."""
+
+    __tablename__ = 'message_tags'
+
+    # Tag timelines page newest-first through this index.
+    __table_args__ = (
+        db.Index('ix_message_tags_tag_timestamp', 'tag', 'timestamp', 'message_id'),
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # The message's timestamp, copied so the index can serve the timeline.
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class Mention(db.Model):
+    """An @mention of a user in a message (see tags.index_message)."""
+
+    __tablename__ = 'mentions'
+
+    # Mentions timelines page newest-first through this index.
+    __table_args__ = (
+        db.Index('ix_mentions_user_id_timestamp', 'user_id', 'timestamp', 'message_id'),
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class TagCount(db.Model):
+    """Number of messages using a tag in one hour.
+
+    Trending tags are summed from these counters (see tags.trending_tags).
+    """
+
+    __tablename__ = 'tag_counts'
+
+    hour = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    tag = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    @classmethod
+    def increment(cls, hour, tags, by=1):
+        """Add `by` to the counters for `tags` in `hour`, creating missing ones.
+
+        Two statements whatever the number of tags: an INSERT of any missing
+        counters, then one UPDATE.
+        """
+
+        if not tags:
+            return
+
+        table = cls.__table__
+        rows = [dict(hour=hour, tag=tag, count=0) for tag in tags]
+        dialect = db.session.get_bind(mapper=None, clause=table).dialect.name
+
+        if dialect == 'postgresql':
+            insert = pg_insert(table).on_conflict_do_nothing()
+        elif dialect == 'sqlite':
+            insert = table.insert().prefix_with('OR IGNORE')
+        else:
+            existing = {tag for (tag,) in db.session.execute(
+                db.select([table.c.tag]).where(
+                    (table.c.hour == hour) & table.c.tag.in_(tags)))}
+            rows = [row for row in rows if row['tag'] not in existing]
+            insert = table.insert()
+
+        if rows:
+            db.session.execute(insert, rows)
+
+        db.session.execute(
+            table.update()
+            .where((table.c.hour == hour) & table.c.tag.in_(tags))
+            .values(count=table.c.count + by))
+
+
+class MessageScore(db.Model):
+    """A message's forward-decayed like score (see popular.py)."""
+
+    __tablename__ = 'message_scores'
+
+    # The popular feed only reads recent messages' scores.
+    __table_args__ = (
+        db.Index('ix_message_scores_timestamp', 'timestamp'),
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # The message's timestamp, copied so recent scores can be read alone.
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+        default=0.0,
+    )
+
+    @classmethod
+    def add(cls, message_id, timestamp, weight, likes=1):
+        """Add `weight` and `likes` to a message's score, creating it if missing."""
+
+        table = cls.__table__
+        row = dict(message_id=message_id, timestamp=timestamp, likes=0, score=0.0)
+        dialect = db.session.get_bind(mapper=None, clause=table).dialect.name
+
+        if dialect == 'postgresql':
+            db.session.execute(pg_insert(table).values(**row).on_conflict_do_nothing())
+        elif dialect == 'sqlite':
+            db.session.execute(table.insert().values(**row).prefix_with('OR IGNORE'))
+        elif not cls.query.get(message_id):
+            db.session.execute(table.insert().values(**row))
+
+        db.session.execute(
+            table.update()
+            .where(table.c.message_id == message_id)
+            .values(likes=table.c.likes + likes, score=table.c.score + weight))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -247,3 +533,26 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+
+
+def connect_script_db(uri=None):
+    """Connect to the database from a script that doesn't serve the site.
+
+    Importing `app` sets up everything for serving requests (templates,
+    sessions, images, assets); scripts like seed.py only need `db`. Uses
+    `uri`, or DATABASE_URL, with the same DB_* pool settings as the app.
+    Returns the bare Flask app `db` is connected through.
+    """
+
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri or os.environ.get(
+        'DATABASE_URL', DEFAULT_DATABASE_URL)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(dbpool.pool_config_from_env())
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbpool.engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+
+    connect_db(app)
+    return app
@@ -0,0 +1,135 @@
+"""The "popular now" feed: recent messages ranked by time-decayed likes.
+
+Scores use forward decay relative to the message's own timestamp: a like
+at `liked_at` adds exp((liked_at - message.timestamp) / tau) to the
+message's row in `message_scores`, and unliking subtracts exactly the same
+weight. At time t a message's decayed score is
+
+    score * exp(-(t - message.timestamp) / tau)
+
+so messages rank by log(score) + message.timestamp / tau, with no need to
+revisit scores as time passes. Only likes made within POPULAR_WINDOW of a
+message being posted count, which keeps the weights small.
+
+Each process keeps the top POPULAR_TOP_K message ids in a compact
+snapshot, refreshed from `message_scores` in a background thread once it
+is POPULAR_REFRESH_SECONDS old, so requests never scan `likes`.
+"""
+
+import heapq
+import math
+from array import array
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, MessageScore
+
+POPULAR_HALF_LIFE = timedelta(hours=6)
+POPULAR_WINDOW = timedelta(hours=48)
+POPULAR_TOP_K = 100
+POPULAR_REFRESH_SECONDS = 60
+
+TAU = POPULAR_HALF_LIFE.total_seconds() / math.log(2)
+
+
+def like_weight(message_timestamp, liked_at):
+    """A like's forward-decay weight, or None if it's outside the window."""
+
+    age = liked_at - message_timestamp
+
+    if age > POPULAR_WINDOW:
+        return None
+
+    return math.exp(max(age.total_seconds(), 0) / TAU)
+
+
+def note_like(message, liked_at):
+    """Add a new like of `message` to its score."""
+
+    weight = like_weight(message.timestamp, liked_at)
+    if weight is not None:
+        MessageScore.add(message.id, message.timestamp, weight)
+
+
+def note_unlike(message, liked_at):
+    """Remove a like (made at `liked_at`) of `message` from its score."""
+
+    weight = like_weight(message.timestamp, liked_at)
+    if weight is not None:
+        MessageScore.add(message.id, message.timestamp, -weight, likes=-1)
+
+
+class TopMessages:
+    """Message ids and like counts, best first, as of `refreshed_at`."""
+
+    __slots__ = ('message_ids', 'likes', 'refreshed_at')
+
+    def __init__(self, message_ids, likes, refreshed_at):
+        self.message_ids = message_ids
+        self.likes = likes
+        self.refreshed_at = refreshed_at
+
+    @classmethod
+    def from_db(cls, now=None, k=POPULAR_TOP_K):
+        """Rank the scores of messages posted in the last POPULAR_WINDOW."""
+
+        now = now or datetime.utcnow()
+        epoch = now - POPULAR_WINDOW
+
+        query = (select([MessageScore.message_id, MessageScore.timestamp,
+                         MessageScore.likes, MessageScore.score])
+                 .where(MessageScore.timestamp > epoch)
+                 .where(MessageScore.likes > 0))
+
+        ranked = heapq.nlargest(k, (
+            (math.log(score) + (timestamp - epoch).total_seconds() / TAU, message_id, likes)
+            for message_id, timestamp, likes, score in db.session.execute(query)
+            if score > 0))
+
+        return cls(array('q', [message_id for _, message_id, _ in ranked]),
+                   array('q', [likes for _, _, likes in ranked]),
+                   monotonic())
+
+    def top(self, limit):
+        """(message_id, likes) pairs for the best `limit` messages."""
+
+        return list(zip(self.message_ids[:limit], self.likes[:limit]))
+
+
+_refresh_lock = Lock()
+
+
+def _refresh(app):
+    try:
+        with app.app_context():
+            app.extensions['popular_messages'] = TopMessages.from_db()
+            db.session.remove()
+    finally:
+        app.extensions.pop('popular_refreshing', None)
+
+
+def get_top_messages():
+    """The current app's top messages snapshot.
+
+    The first call loads it; after that a stale snapshot is served while a
+    background thread replaces it.
+    """
+
+    app = current_app._get_current_object()
+    top = app.extensions.get('popular_messages')
+    max_age = app.config.get('POPULAR_REFRESH_SECONDS', POPULAR_REFRESH_SECONDS)
+
+    if top is None:
+        top = app.extensions['popular_messages'] = TopMessages.from_db()
+
+    elif monotonic() - top.refreshed_at > max_age:
+        with _refresh_lock:
+            if not app.extensions.get('popular_refreshing'):
+                app.extensions['popular_refreshing'] = True
+                Thread(target=_refresh, args=(app,), daemon=True).start()
+
+    return top
@@ -0,0 +1,549 @@
+"""Read-path queries for Warbler.
+
+These build Core ``select()`` statements over just the columns a page or API
+response needs and return plain rows, so no ORM objects (and no password
+hashes) are loaded or tracked by the session.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import REAL, and_, cast, exists, false as sql_false, func, literal, or_, select
+from sqlalchemy.orm import aliased
+
+from models import (db, User, Message, Follows, Likes, MessageTag, Mention,
+                    MESSAGE_SEARCH_CONFIG)
+
+TIMELINE_LIMIT = 100
+CONNECTIONS_LIMIT = 100
+SEARCH_LIMIT = 20
+# The app's default cap on the matches of a search that are ranked (see
+# `search_query`): ranking every match of a common word takes seconds.
+SEARCH_MAX_CANDIDATES = 1000
+
+TIMELINE_COLUMNS = [
+    Message.id,
+    Message.text,
+    Message.timestamp,
+    Message.user_id,
+    User.username,
+    User.image_url,
+]
+
+# What timelines return for each TIMELINE_COLUMNS row: a plain tuple with
+# named fields. Unlike the result's own rows (or Message instances), it
+# doesn't keep the result's metadata and processors alive, and isn't
+# tracked by the session.
+TimelineRow = namedtuple('TimelineRow', 'id text timestamp user_id username image_url')
+
+CONNECTION_COLUMNS = [
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+]
+
+
+##############################################################################
+# Cursors
+
+
+def encode_cursor(*parts):
+    """Encode the parts of a keyset position as an opaque cursor string."""
+
+    raw = "|".join(str(part) for part in parts)
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into its string parts.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    padded = cursor + '=' * (-len(cursor) % 4)
+
+    try:
+        return urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+    except (UnicodeError, ValueError) as err:
+        raise ValueError("Invalid cursor.") from err
+
+
+def timeline_cursor(row):
+    """Cursor pointing just past this timeline row."""
+
+    return encode_cursor(row.timestamp.isoformat(), row.id)
+
+
+def parse_timeline_cursor(cursor):
+    """Return (timestamp, message_id) for a timeline cursor, or None."""
+
+    if not cursor:
+        return None
+
+    try:
+        timestamp, message_id = decode_cursor(cursor)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor.") from err
+
+
+def search_cursor(row):
+    """Cursor pointing just past this search result row."""
+
+    return encode_cursor(repr(row.rank), row.id)
+
+
+def parse_search_cursor(cursor):
+    """Return (rank, message_id) for a search cursor, or None."""
+
+    if not cursor:
+        return None
+
+    try:
+        rank, message_id = decode_cursor(cursor)
+        return float(rank), int(message_id)
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor.") from err
+
+
+def parse_id_cursor(cursor):
+    """Return the user id for a connections cursor, or None."""
+
+    if not cursor:
+        return None
+
+    try:
+        (user_id,) = decode_cursor(cursor)
+        return int(user_id)
+    except (TypeError, ValueError) as err:
+        raise ValueError("Invalid cursor.") from err
+
+
+##############################################################################
+# Timelines
+
+
+def following_ids(user_id):
+    """Select the ids of users that `user_id` follows."""
+
+    return (select([Follows.user_being_followed_id])
+            .where(Follows.user_following_id == user_id))
+
+
+def _timeline_query(condition, before=None, limit=TIMELINE_LIMIT):
+    """Newest-first messages matching `condition`, with author columns.
+
+    `before` is a (timestamp, message_id) keyset position from
+    `parse_timeline_cursor`.
+    """
+
+    query = (select(TIMELINE_COLUMNS)
+             .select_from(Message.__table__.join(User.__table__))
+             .where(condition))
+
+    if before:
+        timestamp, message_id = before
+        query = query.where(or_(
+            Message.timestamp < timestamp,
+            and_(Message.timestamp == timestamp, Message.id < message_id),
+        ))
+
+    return (query
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit))
+
+
+def home_timeline_query(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Select messages from `user_id` and the users they follow."""
+
+    return _timeline_query(
+        or_(Message.user_id == user_id,
+            Message.user_id.in_(following_ids(user_id))),
+        before=before, limit=limit)
+
+
+def user_timeline_query(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Select messages written by `user_id`."""
+
+    return _timeline_query(Message.user_id == user_id, before=before, limit=limit)
+
+
+def liked_timeline_query(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Select messages liked by `user_id`."""
+
+    liked_ids = select([Likes.message_id]).where(Likes.user_id == user_id)
+
+    return _timeline_query(Message.id.in_(liked_ids), before=before, limit=limit)
+
+
+def _indexed_timeline_query(table, condition, before=None, limit=TIMELINE_LIMIT):
+    """Newest-first messages through a side table with its own timestamp.
+
+    `table` (message_tags or mentions) is paged on its (key, timestamp,
+    message_id) index and joined to messages only for the rows returned.
+    """
+
+    query = (select(TIMELINE_COLUMNS)
+             .select_from(table
+                          .join(Message.__table__, Message.id == table.c.message_id)
+                          .join(User.__table__, User.id == Message.user_id))
+             .where(condition))
+
+    if before:
+        timestamp, message_id = before
+        query = query.where(or_(
+            table.c.timestamp < timestamp,
+            and_(table.c.timestamp == timestamp, table.c.message_id < message_id),
+        ))
+
+    return (query
+            .order_by(table.c.timestamp.desc(), table.c.message_id.desc())
+            .limit(limit))
+
+
+def tag_timeline_query(tag, before=None, limit=TIMELINE_LIMIT):
+    """Select messages tagged #`tag`."""
+
+    return _indexed_timeline_query(MessageTag.__table__, MessageTag.tag == tag,
+                                   before=before, limit=limit)
+
+
+def mentions_timeline_query(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Select messages mentioning `user_id`."""
+
+    return _indexed_timeline_query(Mention.__table__, Mention.user_id == user_id,
+                                   before=before, limit=limit)
+
+
+def liked_ids_query(user_id, message_ids):
+    """Select which of `message_ids` `user_id` has liked."""
+
+    return (select([Likes.message_id])
+            .where(Likes.user_id == user_id)
+            .where(Likes.message_id.in_(message_ids)))
+
+
+def timeline_rows(query):
+    """Run a timeline query; returns a list of TimelineRow."""
+
+    return [TimelineRow._make(row) for row in db.session.execute(query)]
+
+
+def home_timeline(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Messages from `user_id` and the users they follow."""
+
+    return timeline_rows(home_timeline_query(user_id, before=before, limit=limit))
+
+
+def user_timeline(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Messages written by `user_id`."""
+
+    return timeline_rows(user_timeline_query(user_id, before=before, limit=limit))
+
+
+def liked_timeline(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Messages liked by `user_id`."""
+
+    return timeline_rows(liked_timeline_query(user_id, before=before, limit=limit))
+
+
+def tag_timeline(tag, before=None, limit=TIMELINE_LIMIT):
+    """Messages tagged #`tag`."""
+
+    return timeline_rows(tag_timeline_query(tag, before=before, limit=limit))
+
+
+def mentions_timeline(user_id, before=None, limit=TIMELINE_LIMIT):
+    """Messages mentioning `user_id`."""
+
+    return timeline_rows(mentions_timeline_query(user_id, before=before, limit=limit))
+
+
+def timeline_next_cursor(rows, limit):
+    """Cursor for the page after `rows`, or None if this is the last page."""
+
+    return timeline_cursor(rows[-1]) if len(rows) == limit else None
+
+
+def messages_by_ids(message_ids):
+    """Timeline rows for `message_ids`, in the order given."""
+
+    message_ids = list(message_ids)
+
+    if not message_ids:
+        return []
+
+    query = (select(TIMELINE_COLUMNS)
+             .select_from(Message.__table__.join(User.__table__))
+             .where(Message.id.in_(message_ids)))
+    rows = {row.id: row for row in timeline_rows(query)}
+
+    return [rows[message_id] for message_id in message_ids if message_id in rows]
+
+
+def liked_message_ids(user_id, message_ids=None):
+    """Set of message ids liked by `user_id`, optionally limited to `message_ids`."""
+
+    if message_ids is None:
+        query = select([Likes.message_id]).where(Likes.user_id == user_id)
+    elif not message_ids:
+        return set()
+    else:
+        query = liked_ids_query(user_id, message_ids)
+
+    return {message_id for (message_id,) in db.session.execute(query)}
+
+
+def like_target(message_id, user_id):
+    """The author and timestamp of a message, and when `user_id` liked it.
+
+    Returns a row (user_id, timestamp, liked_at), with liked_at None if
+    they haven't, or None if there's no such message.
+    """
+
+    query = (select([Message.user_id, Message.timestamp, Likes.liked_at])
+             .select_from(Message.__table__.outerjoin(
+                 Likes.__table__,
+                 and_(Likes.message_id == Message.id, Likes.user_id == user_id)))
+             .where(Message.id == message_id))
+
+    return db.session.execute(query).first()
+
+
+def message_query(message_id, viewer_id=None):
+    """Select one message with its author's columns.
+
+    `viewer_follows` says whether `viewer_id` follows the author.
+    """
+
+    columns = TIMELINE_COLUMNS + [
+        viewer_follows(viewer_id, Message.user_id).label('viewer_follows')]
+
+    return (select(columns)
+            .select_from(Message.__table__.join(User.__table__))
+            .where(Message.id == message_id))
+
+
+##############################################################################
+# Users
+
+
+def user_exists(user_id):
+    """Is there a user with this id?"""
+
+    query = select([User.id]).where(User.id == user_id)
+    return db.session.execute(query).first() is not None
+
+
+def users_by_ids(user_ids):
+    """Card rows (CONNECTION_COLUMNS) for `user_ids`, in the order given."""
+
+    user_ids = list(user_ids)
+
+    if not user_ids:
+        return []
+
+    query = select(CONNECTION_COLUMNS).where(User.id.in_(user_ids))
+    rows = {row.id: row for row in db.session.execute(query)}
+
+    return [rows[user_id] for user_id in user_ids if user_id in rows]
+
+
+def viewer_follows(viewer_id, user_id_column):
+    """Column expression: does `viewer_id` follow the user in `user_id_column`?"""
+
+    if viewer_id is None:
+        return sql_false()
+
+    viewer_follow = aliased(Follows)
+
+    return exists().where(and_(
+        viewer_follow.user_following_id == viewer_id,
+        viewer_follow.user_being_followed_id == user_id_column,
+    ))
+
+
+def user_profile_query(user_id, viewer_id=None):
+    """Select profile columns for `user_id` plus message/follow/like counts.
+
+    `viewer_follows` says whether `viewer_id` follows this user.
+    """
+
+    def count(column, condition):
+        return select([func.count(column)]).where(condition).as_scalar()
+
+    query = select([
+        User.id,
+        User.username,
+        User.image_url,
+        User.header_image_url,
+        User.bio,
+        User.location,
+        count(Message.id, Message.user_id == User.id).label('messages_count'),
+        count(Follows.user_being_followed_id,
+              Follows.user_following_id == User.id).label('following_count'),
+        count(Follows.user_following_id,
+              Follows.user_being_followed_id == User.id).label('followers_count'),
+        count(Likes.id, Likes.user_id == User.id).label('likes_count'),
+        viewer_follows(viewer_id, User.id).label('viewer_follows'),
+    ]).where(User.id == user_id)
+
+    return query
+
+
+def user_profile(user_id, viewer_id=None):
+    """Profile row for `user_id` (see `user_profile_query`), or None."""
+
+    return db.session.execute(user_profile_query(user_id, viewer_id)).first()
+
+
+def _connections(join_column, filter_column, user_id, viewer_id=None,
+                 after=None, limit=CONNECTIONS_LIMIT):
+    """Users joined to `user_id` through `follows`, ordered by id.
+
+    Each row also has `viewer_follows`: whether `viewer_id` follows that user.
+    """
+
+    columns = CONNECTION_COLUMNS + [
+        viewer_follows(viewer_id, User.id).label('viewer_follows')]
+
+    query = (select(columns)
+             .select_from(User.__table__.join(
+                 Follows.__table__, join_column == User.id))
+             .where(filter_column == user_id))
+
+    if after:
+        query = query.where(User.id > after)
+
+    query = query.order_by(User.id).limit(limit)
+
+    return db.session.execute(query).fetchall()
+
+
+def following(user_id, viewer_id=None, after=None, limit=CONNECTIONS_LIMIT):
+    """Users that `user_id` follows."""
+
+    return _connections(Follows.user_being_followed_id,
+                        Follows.user_following_id,
+                        user_id, viewer_id=viewer_id, after=after, limit=limit)
+
+
+def followers(user_id, viewer_id=None, after=None, limit=CONNECTIONS_LIMIT):
+    """Users that follow `user_id`."""
+
+    return _connections(Follows.user_following_id,
+                        Follows.user_being_followed_id,
+                        user_id, viewer_id=viewer_id, after=after, limit=limit)
+
+
+def connections_cursor(rows, limit):
+    """Cursor for the page after `rows`, or None if this is the last page."""
+
+    return encode_cursor(rows[-1].id) if len(rows) == limit else None
+
+
+##############################################################################
+# Search
+
+
+def _search_condition(q, dialect_name):
+    """(where clause, tsquery or None) matching the search `q`."""
+
+    if dialect_name == 'postgresql':
+        tsquery = func.websearch_to_tsquery(MESSAGE_SEARCH_CONFIG, q)
+        return Message.search_vector().op('@@')(tsquery), tsquery
+
+    return and_(*[func.lower(Message.text).contains(word, autoescape=True)
+                  for word in q.lower().split()]), None
+
+
+def search_query(q, dialect_name, after=None, limit=SEARCH_LIMIT, max_candidates=None):
+    """Select messages matching the search `q`, best match first.
+
+    On PostgreSQL this is a full-text match (`websearch_to_tsquery` syntax:
+    words, "quoted phrases", -excluded) served by ix_messages_search_vector
+    and ranked with `ts_rank`. Elsewhere every word must appear in the
+    text and results are newest first.
+
+    Every match is ranked, unless `max_candidates` is set: then only the
+    newest that many are (see `search_truncated`). Rows have
+    TIMELINE_COLUMNS plus `rank`; `after` is a (rank, message_id) position
+    from `parse_search_cursor`.
+    """
+
+    condition, tsquery = _search_condition(q, dialect_name)
+    columns = [Message.id, Message.text, Message.timestamp, Message.user_id]
+
+    if tsquery is not None:
+        columns.append(Message.search_vector().label('search_vector'))
+
+    candidates = select(columns).where(condition)
+    if max_candidates is not None:
+        candidates = candidates.order_by(Message.id.desc()).limit(max_candidates)
+    candidates = candidates.alias('candidates')
+
+    if tsquery is not None:
+        rank = func.ts_rank(candidates.c.search_vector, tsquery)
+    else:
+        rank = literal(0.0)
+
+    query = (select([candidates.c.id,
+                     candidates.c.text,
+                     candidates.c.timestamp,
+                     candidates.c.user_id,
+                     User.username,
+                     User.image_url,
+                     rank.label('rank')])
+             .select_from(candidates.join(User.__table__,
+                                          User.id == candidates.c.user_id)))
+
+    if after:
+        # ts_rank is a float4; compare in float4 so cursors round-trip.
+        after_rank, message_id = after
+        after_rank = cast(after_rank, REAL)
+        query = query.where(or_(
+            rank < after_rank,
+            and_(rank == after_rank, candidates.c.id < message_id),
+        ))
+
+    return query.order_by(rank.desc(), candidates.c.id.desc()).limit(limit)
+
+
+def _search_dialect_name():
+    # The read may go to a replica of a different dialect (see replicas).
+    return db.session.get_bind(clause=select([Message.id])).dialect.name
+
+
+def search_messages(q, after=None, limit=SEARCH_LIMIT, max_candidates=None):
+    """Messages matching the search `q` (see `search_query`)."""
+
+    if not q.split():
+        return []
+
+    query = search_query(q, _search_dialect_name(), after=after, limit=limit,
+                         max_candidates=max_candidates)
+
+    return db.session.execute(query).fetchall()
+
+
+def search_truncated(q, max_candidates):
+    """Whether more than `max_candidates` messages match `q`, so that
+    `search_messages` with that cap leaves some out."""
+
+    if max_candidates is None or not q.split():
+        return False
+
+    condition, _ = _search_condition(q, _search_dialect_name())
+    query = (select([Message.id]).where(condition)
+             .order_by(Message.id.desc()).offset(max_candidates).limit(1))
+
+    return db.session.execute(select([exists(query)])).scalar()
+
+
+def search_next_cursor(rows, limit):
+    """Cursor for the page after `rows`, or None if this is the last page."""
+
+    return search_cursor(rows[-1]) if len(rows) == limit else None
@@ -0,0 +1,106 @@
+"""Route read-only requests to replica databases.
+
+When SQLALCHEMY_REPLICA_URIS is set, SELECTs issued while handling a GET
+(or HEAD) request go to one of the replica engines; everything else, and
+every request shortly after the same client POSTed a change, goes to the
+primary so users always see their own writes.
+"""
+
+import random
+from time import time
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy.sql import Select, CompoundSelect
+
+import dbpool
+
+# Session key holding the time until which this client reads from the primary.
+READ_PRIMARY_UNTIL_KEY = "_read_primary_until"
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends plain SELECTs to a replica when the request allows it."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and _is_plain_select(clause):
+            engine = current_replica()
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper, clause)
+
+
+def _is_plain_select(clause):
+    """Is `clause` a SELECT that doesn't lock rows?"""
+
+    if isinstance(clause, CompoundSelect):
+        return True
+
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+def current_replica():
+    """The replica engine chosen for this request, or None to use the primary."""
+
+    from flask import g, has_request_context
+
+    if not has_request_context():
+        return None
+
+    return g.get('replica_engine')
+
+
+def replica_engines(app):
+    """Engines for the app's SQLALCHEMY_REPLICA_URIS, created on first use."""
+
+    uris = tuple(app.config['SQLALCHEMY_REPLICA_URIS'])
+    cached = app.extensions.get('replica_engines')
+
+    if cached is None or cached[0] != uris:
+        if cached is not None:
+            for engine in cached[1]:
+                engine.dispose()
+
+        engines = [dbpool.create_engine(uri, dbpool.engine_options(uri, app.config))
+                   for uri in uris]
+        cached = app.extensions['replica_engines'] = (uris, engines)
+
+    return cached[1]
+
+
+def init_app(app):
+    """Choose a replica per request and keep clients on the primary after writes.
+
+    Call this before registering any before_request handlers that query
+    the database.
+    """
+
+    from flask import g, request, session
+
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+
+    @app.before_request
+    def choose_replica():
+        g.replica_engine = None
+
+        if request.method not in READ_METHODS or not app.config['SQLALCHEMY_REPLICA_URIS']:
+            return
+
+        if session.get(READ_PRIMARY_UNTIL_KEY, 0) > time():
+            return
+
+        g.replica_engine = random.choice(replica_engines(app))
+
+    @app.after_request
+    def stick_to_primary(response):
+        """After a successful write, read from the primary for a short window."""
+
+        if (request.method not in READ_METHODS
+                and response.status_code < 400
+                and app.config['SQLALCHEMY_REPLICA_URIS']):
+            session[READ_PRIMARY_UNTIL_KEY] = time() + app.config['REPLICA_STICKY_SECONDS']
+
+        return response
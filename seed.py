@@ -1,9 +1,9 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from models import db, connect_script_db, User, Message, Follows
 
+connect_script_db()
 
 db.drop_all()
 db.create_all()
@@ -0,0 +1,319 @@
+"""Server-side sessions.
+
+By default Flask keeps the whole session in a signed cookie, which is
+verified and deserialized on every request and grows with every flashed
+message. With SESSION_BACKEND set to 'memory' or 'sqlite', the cookie
+holds only an opaque random session id and the data lives in a store:
+
+    memory   an in-process LRU with expiry; for a single worker
+    sqlite   a SQLite file (SESSION_SQLITE_PATH) shared by the workers
+             on one host
+
+Any object implementing `SessionStore` can be given as SESSION_STORE
+instead, to share sessions across hosts.
+
+Sessions are stored with the id of the user they're logged in as (the
+`user_key` entry given to `init_app`), so `logout_everywhere` can drop
+all of a user's sessions. Data is only written back when the session was
+modified, and each request's store read and write times are sent in a
+Server-Timing header and totalled in `SessionStats`.
+"""
+
+import base64
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock, local
+from time import perf_counter, time
+
+from flask import session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SESSION_BACKENDS = ('cookie', 'memory', 'sqlite')
+
+serializer = TaggedJSONSerializer()
+
+
+def new_session_id():
+    """A random, URL-safe, 256-bit session id."""
+
+    return base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data loaded from a store, tracking whether it changed."""
+
+    def __init__(self, data=None, sid=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(data, on_update)
+        self.sid = sid or new_session_id()
+        self.new = sid is None
+        self.modified = False
+        self.regenerated_from = None
+        self.timings = []
+
+    def regenerate(self):
+        """Move the data to a new id, e.g. on login, against session fixation."""
+
+        if not self.new and self.regenerated_from is None:
+            self.regenerated_from = self.sid
+        self.sid = new_session_id()
+        self.modified = True
+
+
+class SessionStore(ABC):
+    """Where server-side session data is kept.
+
+    `data` is the encoded session (bytes); `user_id` is who it's logged in
+    as, or None; `ttl` is in seconds.
+    """
+
+    @abstractmethod
+    def get(self, sid):
+        """The data stored for `sid`, or None if it's missing or expired."""
+
+    @abstractmethod
+    def set(self, sid, data, user_id, ttl):
+        pass
+
+    @abstractmethod
+    def delete(self, sid):
+        pass
+
+    @abstractmethod
+    def delete_user(self, user_id):
+        """Drop every session logged in as `user_id`."""
+
+
+class MemoryStore(SessionStore):
+    """Sessions in this process, least recently used dropped past `max_entries`."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+
+            data, user_id, expires = entry
+            if expires < time():
+                del self._entries[sid]
+                return None
+
+            self._entries.move_to_end(sid)
+            return data
+
+    def set(self, sid, data, user_id, ttl):
+        with self._lock:
+            self._entries[sid] = (data, user_id, time() + ttl)
+            self._entries.move_to_end(sid)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for sid in [sid for sid, (_, owner, _) in self._entries.items()
+                        if owner == user_id]:
+                del self._entries[sid]
+
+
+class SQLiteStore(SessionStore):
+    """Sessions in a SQLite file, usable from several processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = local()
+
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "sid TEXT PRIMARY KEY, user_id INTEGER, "
+                         "data BLOB NOT NULL, expires REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)")
+
+    def _connection(self):
+        """This thread's connection."""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, sid):
+        row = self._connection().execute(
+            "SELECT data FROM sessions WHERE sid = ? AND expires >= ?",
+            (sid, time())).fetchone()
+        return row and row[0]
+
+    def set(self, sid, data, user_id, ttl):
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                         (sid, user_id, data, time() + ttl))
+
+    def delete(self, sid):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def delete_user(self, user_id):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def delete_expired(self):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires < ?", (time(),))
+
+
+class SessionStats:
+    """Store read and write counts and times."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reads = 0
+        self.writes = 0
+        self.read_time = 0.0
+        self.write_time = 0.0
+
+    def record_read(self, elapsed):
+        with self._lock:
+            self.reads += 1
+            self.read_time += elapsed
+
+    def record_write(self, elapsed):
+        with self._lock:
+            self.writes += 1
+            self.write_time += elapsed
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'reads': self.reads,
+                'writes': self.writes,
+                'mean_read_ms': self.read_time / self.reads * 1000 if self.reads else 0.0,
+                'mean_write_ms': self.write_time / self.writes * 1000 if self.writes else 0.0,
+            }
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keep session data in `store`; the cookie only holds the session id."""
+
+    def __init__(self, store, user_key):
+        self.store = store
+        self.user_key = user_key
+        self.stats = SessionStats()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.session_cookie_name)
+
+        if not sid:
+            return ServerSession()
+
+        start = perf_counter()
+        data = self.store.get(sid)
+        elapsed = self._record('read', start)
+
+        try:
+            session = ServerSession(serializer.loads(data.decode()), sid)
+        except (AttributeError, ValueError):
+            session = ServerSession()
+
+        session.timings.append(('read', elapsed))
+        return session
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.modified:
+            start = perf_counter()
+
+            if session.regenerated_from:
+                self.store.delete(session.regenerated_from)
+
+            if session:
+                ttl = app.permanent_session_lifetime.total_seconds()
+                self.store.set(session.sid, serializer.dumps(dict(session)).encode(),
+                               session.get(self.user_key), ttl)
+            elif not session.new:
+                self.store.delete(session.sid)
+
+            session.timings.append(('write', self._record('write', start)))
+
+            if session:
+                response.set_cookie(
+                    app.session_cookie_name, session.sid,
+                    expires=self.get_expiration_time(app, session),
+                    httponly=self.get_cookie_httponly(app),
+                    domain=domain, path=path,
+                    secure=self.get_cookie_secure(app),
+                    samesite=self.get_cookie_samesite(app))
+            elif not session.new:
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+
+        if session.timings:
+            response.headers.add('Server-Timing', ', '.join(
+                f"session-{name};dur={elapsed * 1000:.2f}" for name, elapsed in session.timings))
+
+    def _record(self, name, start):
+        elapsed = perf_counter() - start
+        getattr(self.stats, f'record_{name}')(elapsed)
+        return elapsed
+
+
+def init_app(app, user_key):
+    """Use server-side sessions if SESSION_BACKEND (or SESSION_STORE) asks for them.
+
+    `user_key` is the session key holding the logged in user's id.
+    """
+
+    app.config.setdefault('SESSION_BACKEND', 'cookie')
+    app.config.setdefault('SESSION_STORE', None)
+    app.config.setdefault('SESSION_SQLITE_PATH', os.path.join(app.instance_path, 'sessions.db'))
+    app.config.setdefault('SESSION_MEMORY_MAX_ENTRIES', 10000)
+
+    backend = app.config['SESSION_BACKEND']
+    store = app.config['SESSION_STORE']
+
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"SESSION_BACKEND must be one of {', '.join(SESSION_BACKENDS)}")
+
+    if store is None and backend == 'memory':
+        store = MemoryStore(app.config['SESSION_MEMORY_MAX_ENTRIES'])
+    elif store is None and backend == 'sqlite':
+        os.makedirs(os.path.dirname(app.config['SESSION_SQLITE_PATH']), exist_ok=True)
+        store = SQLiteStore(app.config['SESSION_SQLITE_PATH'])
+
+    if store is not None:
+        app.session_interface = ServerSessionInterface(store, user_key)
+
+
+def regenerate():
+    """Give the current session a new id, if it's stored server-side."""
+
+    current = session._get_current_object()
+    if isinstance(current, ServerSession):
+        current.regenerate()
+
+
+def logout_everywhere(app, user_id):
+    """Drop all of `user_id`'s sessions; False if sessions are cookies."""
+
+    if not isinstance(app.session_interface, ServerSessionInterface):
+        return False
+
+    app.session_interface.store.delete_user(user_id)
+    return True
@@ -0,0 +1,207 @@
+"""Slow query log.
+
+`install(engine, log)` times every statement `engine` runs; the ones
+taking at least `log.threshold_ms` are logged and aggregated in `log`, a
+`SlowQueryLog`, by fingerprint: the SQL with literals, bound parameter
+names and IN lists normalized away, plus the shape of the parameters
+(how many of each type). So
+
+    SELECT ... WHERE messages.user_id IN (%(user_id_1)s, %(user_id_2)s)
+    SELECT ... WHERE messages.user_id IN (%(user_id_1)s, ..., %(user_id_40)s)
+
+share a fingerprint, with parameter shapes "2 int" and "40 int". Each
+entry also counts the routes and the lines of our code (the innermost
+frame outside libraries: a view, a query helper, or a template) the
+statement came from.
+
+The log keeps at most `max_entries` fingerprints; when it's full, the one
+with the least total time makes way for a new one.
+"""
+
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from threading import Lock
+from time import perf_counter
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Our own modules that only pass statements through.
+SKIPPED_FILES = {os.path.join(ROOT, name) for name in ('slowlog.py', 'dbpool.py')}
+
+SORT_KEYS = ('total_ms', 'max_ms', 'count')
+
+# How many routes and locations to keep per fingerprint.
+TOP_SOURCES = 5
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+PARAM_RE = re.compile(r"%\(\w+\)s|%s|(?<![:\w]):[A-Za-z_]\w*|\?")
+IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+SPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """`statement` with literals and parameters as ? and IN lists as IN (...)."""
+
+    statement = STRING_RE.sub('?', statement)
+    statement = PARAM_RE.sub('?', statement)
+    statement = NUMBER_RE.sub('?', statement)
+    statement = IN_LIST_RE.sub('IN (...)', statement)
+    return SPACE_RE.sub(' ', statement).strip()
+
+
+def parameter_shape(parameters, executemany=False):
+    """How many parameters of each type, e.g. '2 int, 1 datetime'."""
+
+    if executemany:
+        rows = list(parameters)
+        shape = parameter_shape(rows[0]) if rows else "none"
+        return f"{len(rows)} rows of {shape}"
+
+    if isinstance(parameters, dict):
+        values = parameters.values()
+    elif isinstance(parameters, (list, tuple)):
+        values = parameters
+    else:
+        values = []
+
+    counts = Counter(type(value).__name__ for value in values)
+    if not counts:
+        return "none"
+
+    return ', '.join(f"{count} {name}" for name, count in sorted(counts.items()))
+
+
+def current_route():
+    """The route of the request being handled, e.g. 'GET /users/<int:user_id>'."""
+
+    # Flask isn't imported for it: scripts using only the database don't
+    # load it, and without it there's no request.
+    flask = sys.modules.get('flask')
+    if flask is None or not flask.has_request_context():
+        return None
+
+    request = flask.request
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return f"{request.method} {rule}"
+
+
+def caller_location():
+    """The innermost frame in our code (not a library) as 'file:line (function)'."""
+
+    frame = sys._getframe(1)
+
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(ROOT) and filename not in SKIPPED_FILES
+                and f'{os.sep}site-packages{os.sep}' not in filename):
+            return (f"{os.path.relpath(filename, ROOT)}:{frame.f_lineno} "
+                    f"({frame.f_code.co_name})")
+        frame = frame.f_back
+
+    return None
+
+
+class SlowQueryLog:
+    """Slow statements aggregated by fingerprint and parameter shape."""
+
+    def __init__(self, threshold_ms, max_entries=100):
+        self.threshold_ms = threshold_ms
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = {}
+        self.evicted = 0
+
+    def record(self, sql, shape, elapsed_ms, route, location):
+        """Count a statement with fingerprint `sql` and parameter shape `shape`."""
+
+        key = (sql, shape)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                if len(self._entries) >= self.max_entries:
+                    smallest = min(self._entries, key=lambda k: self._entries[k]['total_ms'])
+                    del self._entries[smallest]
+                    self.evicted += 1
+
+                entry = self._entries[key] = {
+                    'fingerprint': key[0], 'parameters': shape,
+                    'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'routes': Counter(), 'locations': Counter(),
+                }
+
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            entry['routes'][route] += 1
+            entry['locations'][location] += 1
+
+    def top(self, limit=20, sort='total_ms'):
+        """The `limit` entries with the most `sort` (total_ms, max_ms or count)."""
+
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda e: e[sort], reverse=True)
+
+            return [dict(entry,
+                         mean_ms=entry['total_ms'] / entry['count'],
+                         routes=dict(entry['routes'].most_common(TOP_SOURCES)),
+                         locations=dict(entry['locations'].most_common(TOP_SOURCES)))
+                    for entry in entries[:limit]]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.evicted = 0
+
+    def as_dict(self, limit=20, sort='total_ms'):
+        return {
+            'threshold_ms': self.threshold_ms,
+            'fingerprints': len(self._entries),
+            'evicted': self.evicted,
+            'queries': self.top(limit, sort),
+        }
+
+
+def install(engine, log):
+    """Time `engine`'s statements, recording slow ones in `log`."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_if_slow(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (perf_counter() - conn.info['slow_query_start'].pop()) * 1000
+
+        if elapsed_ms < log.threshold_ms:
+            return
+
+        sql = fingerprint(statement)
+        shape = parameter_shape(parameters, executemany)
+        route = current_route()
+        location = caller_location()
+
+        log.record(sql, shape, elapsed_ms, route, location)
+        logger.warning("Slow query (%.0f ms) from %s at %s: %s [%s]",
+                       elapsed_ms, route, location, sql, shape)
+
+    @event.listens_for(engine, 'handle_error')
+    def discard_timer(context):
+        if context.connection is not None and context.cursor is not None:
+            starts = context.connection.info.get('slow_query_start')
+            if starts:
+                starts.pop()
+
+    engine.slow_queries = log
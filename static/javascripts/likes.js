@@ -0,0 +1,24 @@
+// Like buttons toggle in place: the form is posted asking for JSON, and
+// the button's colour follows the answer. If that fails for any reason,
+// the form is submitted the old way.
+$(document).on('submit', 'form[action^="/users/add_like/"]', function (evt) {
+  evt.preventDefault();
+  var form = this;
+  var $button = $(form).find('button');
+
+  $button.prop('disabled', true);
+
+  $.ajax({
+    url: form.action,
+    method: 'POST',
+    dataType: 'json',
+    headers: {Accept: 'application/json'}
+  }).done(function (resp) {
+    $button.toggleClass('btn-primary', resp.liked)
+           .toggleClass('btn-secondary', !resp.liked);
+  }).fail(function () {
+    form.submit();
+  }).always(function () {
+    $button.prop('disabled', false);
+  });
+});
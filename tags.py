@@ -0,0 +1,106 @@
+"""Hashtags and @mentions.
+
+Tags and mentions are parsed out of a message's text when it's posted and
+stored in side tables (MessageTag, Mention) that are indexed for
+newest-first timelines. Each tag use also bumps an hourly counter
+(TagCount), so trending tags are summed from a day of counters instead of
+scanning messages.
+"""
+
+import re
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, User, MessageTag, Mention, TagCount
+
+TAG_RE = re.compile(r'(?<![\w#])#(\w{1,64})')
+MENTION_RE = re.compile(r'(?<![\w@])@(\w{1,64})')
+
+TRENDING_WINDOW_HOURS = 24
+TRENDING_LIMIT = 10
+
+
+def parse_tags(text):
+    """Lowercased #tags in `text`, without duplicates, in order of use."""
+
+    return list(dict.fromkeys(tag.lower() for tag in TAG_RE.findall(text)))
+
+
+def parse_mentions(text):
+    """@usernames in `text`, without duplicates, in order of use."""
+
+    return list(dict.fromkeys(MENTION_RE.findall(text)))
+
+
+def hour_of(when):
+    """The start of the hour containing `when`."""
+
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def index_message(message):
+    """Store `message`'s tags and mentions, and count its tags.
+
+    Call after the message has been flushed (it needs an id and timestamp).
+    Mentions of usernames that don't exist are ignored.
+    """
+
+    tags = parse_tags(message.text)
+    usernames = parse_mentions(message.text)
+
+    if tags:
+        db.session.execute(MessageTag.__table__.insert(), [
+            dict(message_id=message.id, tag=tag, timestamp=message.timestamp)
+            for tag in tags])
+        TagCount.increment(hour_of(message.timestamp), tags)
+
+    if usernames:
+        user_ids = select([User.id]).where(User.username.in_(usernames))
+        rows = [dict(message_id=message.id, user_id=user_id, timestamp=message.timestamp)
+                for (user_id,) in db.session.execute(user_ids)]
+        if rows:
+            db.session.execute(Mention.__table__.insert(), rows)
+
+
+def unindex_message(message):
+    """Uncount `message`'s tags before it's deleted.
+
+    Its MessageTag and Mention rows are removed with it (ON DELETE CASCADE).
+    """
+
+    query = select([MessageTag.tag]).where(MessageTag.message_id == message.id)
+    tags = [tag for (tag,) in db.session.execute(query)]
+
+    TagCount.increment(hour_of(message.timestamp), tags, by=-1)
+
+
+def trending_tags_query(hour, hours=TRENDING_WINDOW_HOURS, limit=TRENDING_LIMIT):
+    """Select the most used tags in the `hours` up to and including `hour`."""
+
+    total = func.sum(TagCount.count)
+
+    return (select([TagCount.tag, total.label('count')])
+            .where(TagCount.hour > hour - timedelta(hours=hours))
+            .where(TagCount.hour <= hour)
+            .group_by(TagCount.tag)
+            .having(total > 0)
+            .order_by(total.desc(), TagCount.tag)
+            .limit(limit))
+
+
+def trending_tags():
+    """(tag, count) rows for the last day's most used tags.
+
+    Computed at most once an hour per process, from the hourly counters.
+    """
+
+    hour = hour_of(datetime.utcnow())
+    cached = current_app.extensions.get('trending_tags')
+
+    if cached is None or cached[0] != hour:
+        rows = db.session.execute(trending_tags_query(hour)).fetchall()
+        cached = current_app.extensions['trending_tags'] = (hour, rows)
+
+    return cached[1]
@@ -0,0 +1,90 @@
+"""Compiling templates ahead of time and sharing the result between workers.
+
+Jinja compiles each template to Python bytecode the first time it's used,
+separately in every worker process. `init_app(app)` gives the app's Jinja
+environment a bytecode cache in TEMPLATE_CACHE_DIR, so a template compiled
+by one process (or by `flask compile-templates` during a deploy) is only
+unmarshalled by the others. With WARM_TEMPLATES set, every template in
+templates/ is loaded when the app starts instead of on its first request.
+
+Call `init_app` after everything that adds template filters and globals:
+compiling a template checks that the filters it uses exist.
+"""
+
+import os
+from time import perf_counter
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """A FileSystemBytecodeCache safe to write from several processes.
+
+    Each file is written under a temporary name and renamed into place,
+    so other workers never read a partly written one.
+    """
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        tmp = f"{filename}.{os.getpid()}.tmp"
+
+        with open(tmp, 'wb') as f:
+            bucket.write_bytecode(f)
+        os.replace(tmp, filename)
+
+
+def init_app(app):
+    """Add the bytecode cache, warm the templates and add the CLI command."""
+
+    app.config.setdefault('TEMPLATE_CACHE_DIR', os.path.join(app.instance_path, 'jinja-cache'))
+    app.config.setdefault('WARM_TEMPLATES', True)
+
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = SharedBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+
+    if app.config['WARM_TEMPLATES']:
+        warm(app)
+
+    @app.cli.command('compile-templates')
+    def compile_templates():
+        """Compile every template into TEMPLATE_CACHE_DIR."""
+
+        start = perf_counter()
+        count = compile_all(app)
+        click.echo(f"Compiled {count} templates in {(perf_counter() - start) * 1000:.0f} ms "
+                   f"into {app.config['TEMPLATE_CACHE_DIR']}")
+
+
+def compile_all(app):
+    """Compile every template from source into the bytecode cache.
+
+    Returns how many were compiled.
+    """
+
+    env = app.jinja_env
+    names = app.jinja_loader.list_templates()
+
+    for name in names:
+        source, filename, _ = app.jinja_loader.get_source(env, name)
+        bucket = env.bytecode_cache.get_bucket(env, name, filename, source)
+        bucket.code = env.compile(source, name, filename)
+        env.bytecode_cache.set_bucket(bucket)
+
+    return len(names)
+
+
+def warm(app):
+    """Load every template in the app's templates folder.
+
+    Returns how many were loaded and how long it took, in seconds.
+    """
+
+    start = perf_counter()
+    names = app.jinja_loader.list_templates()
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names), perf_counter() - start
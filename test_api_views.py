@@ -0,0 +1,185 @@
+"""JSON API view tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_api_views.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Likes, Follows
+from app import app, CURR_USER_KEY
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiViewTestCase(TestCase):
+    """Test JSON API views."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        user1 = User(id=1, username="apiuser1", email="api1@test.com",
+                     password="HASHED_PASSWORD1", bio="bio 1")
+        user2 = User(id=2, username="apiuser2", email="api2@test.com",
+                     password="HASHED_PASSWORD2")
+        user3 = User(id=3, username="apiuser3", email="api3@test.com",
+                     password="HASHED_PASSWORD3")
+
+        db.session.add_all([user1, user2, user3])
+        db.session.commit()
+
+        now = datetime(2020, 1, 1)
+
+        db.session.add_all([
+            Message(id=1, text="user1 old", user_id=1, timestamp=now),
+            Message(id=2, text="user1 new", user_id=1, timestamp=now + timedelta(minutes=1)),
+            Message(id=3, text="user2 newest", user_id=2, timestamp=now + timedelta(minutes=2)),
+            Message(id=4, text="user3 hidden", user_id=3, timestamp=now + timedelta(minutes=3)),
+            Follows(user_following_id=1, user_being_followed_id=2),
+            Follows(user_following_id=3, user_being_followed_id=1),
+        ])
+        db.session.commit()
+
+        db.session.add(Likes(user_id=1, message_id=3))
+        db.session.commit()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def login(self, c, user_id=1):
+        """Log the test client in as `user_id`."""
+
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_timeline_logged_out(self):
+        """Is the timeline API unauthorized when logged out?"""
+
+        with self.client as c:
+            resp = c.get("/api/v1/timeline")
+
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual(resp.get_json(), {"error": "Access unauthorized."})
+
+    def test_timeline(self):
+        """Does the timeline include own and followed messages, newest first?"""
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/api/v1/timeline")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "application/json")
+
+            data = resp.get_json()
+            self.assertEqual([m["id"] for m in data["messages"]], [3, 2, 1])
+            self.assertEqual([m["liked"] for m in data["messages"]], [True, False, False])
+            self.assertEqual(sorted(data["users"]), ["1", "2"])
+            self.assertEqual(data["users"]["2"]["username"], "apiuser2")
+            self.assertNotIn("password", data["users"]["2"])
+            self.assertIsNone(data["next_cursor"])
+
+    def test_timeline_cursor(self):
+        """Does cursor pagination walk the timeline without repeats?"""
+
+        with self.client as c:
+            self.login(c)
+
+            first = c.get("/api/v1/timeline", query_string={"limit": 2}).get_json()
+            self.assertEqual([m["id"] for m in first["messages"]], [3, 2])
+            self.assertIsNotNone(first["next_cursor"])
+
+            second = c.get("/api/v1/timeline", query_string={
+                "limit": 2, "cursor": first["next_cursor"]}).get_json()
+            self.assertEqual([m["id"] for m in second["messages"]], [1])
+            self.assertIsNone(second["next_cursor"])
+
+    def test_timeline_bad_cursor(self):
+        """Is a malformed cursor rejected?"""
+
+        with self.client as c:
+            self.login(c)
+            resp = c.get("/api/v1/timeline", query_string={"cursor": "not-a-cursor"})
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_timeline_bad_limit(self):
+        """Are non-numeric and negative limits rejected in the API's own words?"""
+
+        with self.client as c:
+            self.login(c)
+
+            for limit in ("ten", "-1", "0"):
+                resp = c.get("/api/v1/timeline", query_string={"limit": limit})
+
+                self.assertEqual(resp.status_code, 400)
+                self.assertEqual(resp.get_json(),
+                                 {"error": "limit must be a positive whole number."})
+
+    def test_users_show(self):
+        """Does the profile API include counts and the user's messages?"""
+
+        with self.client as c:
+            resp = c.get("/api/v1/users/1")
+
+            self.assertEqual(resp.status_code, 200)
+
+            data = resp.get_json()
+            self.assertEqual(data["user"]["username"], "apiuser1")
+            self.assertEqual(data["user"]["bio"], "bio 1")
+            self.assertEqual(data["user"]["counts"],
+                             {"messages": 2, "following": 1, "followers": 1, "likes": 1})
+            self.assertEqual([m["id"] for m in data["messages"]], [2, 1])
+
+    def test_users_show_missing(self):
+        """Does the profile API 404 for an unknown user?"""
+
+        with self.client as c:
+            resp = c.get("/api/v1/users/999")
+
+            self.assertEqual(resp.status_code, 404)
+
+    def test_users_likes(self):
+        """Does the likes API list liked messages?"""
+
+        with self.client as c:
+            self.login(c, 3)
+            resp = c.get("/api/v1/users/1/likes")
+
+            self.assertEqual(resp.status_code, 200)
+            data = resp.get_json()
+            self.assertEqual([m["id"] for m in data["messages"]], [3])
+            self.assertNotIn("liked", data["messages"][0])
+
+    def test_following_and_followers(self):
+        """Do the following/followers APIs list the right users?"""
+
+        with self.client as c:
+            self.login(c)
+
+            following = c.get("/api/v1/users/1/following").get_json()
+            self.assertEqual([u["username"] for u in following["users"]], ["apiuser2"])
+
+            followers = c.get("/api/v1/users/1/followers").get_json()
+            self.assertEqual([u["username"] for u in followers["users"]], ["apiuser3"])
+
+    def test_following_logged_out(self):
+        """Is the following API unauthorized when logged out?"""
+
+        with self.client as c:
+            resp = c.get("/api/v1/users/1/following")
+
+            self.assertEqual(resp.status_code, 401)
@@ -0,0 +1,170 @@
+"""ASGI serving mode tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_asgi.py
+
+
+import asyncio
+from unittest import TestCase
+
+import pytest
+
+from models import db, Message, User, Likes, Follows
+from app import app, CURR_USER_KEY
+import asgi
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+async def call(path, user_id=None):
+    """GET `path` from the ASGI app; returns (status, headers, body)."""
+
+    headers = []
+    if user_id is not None:
+        cookie = app.session_interface.get_signing_serializer(app).dumps(
+            {CURR_USER_KEY: user_id})
+        headers.append((b"cookie", f"{app.session_cookie_name}={cookie}".encode()))
+
+    scope = {"type": "http", "method": "GET", "path": path,
+             "query_string": b"", "headers": headers}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+
+    start, body = sent
+    return start["status"], dict(start["headers"]), body["body"].decode()
+
+
+def get(path, user_id=None):
+    """GET `path` on a fresh event loop, closing its connections afterwards."""
+
+    async def run():
+        try:
+            return await call(path, user_id)
+        finally:
+            asgi.close_database()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.commits
+@pytest.mark.postgres
+class AsgiViewTestCase(TestCase):
+    """Test the async read routes against the test database."""
+
+    def setUp(self):
+        """Add a user who follows and likes another user's message."""
+
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        reader = User(id=1, username="reader", email="reader@test.com", password="HASHED")
+        author = User(id=2, username="author", email="author@test.com", password="HASHED")
+
+        db.session.add_all([reader, author])
+        db.session.commit()
+
+        db.session.add_all([
+            Message(id=1, text="from the author", user_id=2),
+            Message(id=2, text="from the reader", user_id=1),
+        ])
+        db.session.commit()
+
+        db.session.add_all([
+            Follows(user_following_id=1, user_being_followed_id=2),
+            Likes(id=1, user_id=1, message_id=1),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_homepage(self):
+        """Does the homepage show followed users' messages and counts?"""
+
+        status, headers, html = get("/", 1)
+
+        self.assertEqual(status, 200)
+        self.assertIn("from the author", html)
+        self.assertIn("from the reader", html)
+        self.assertIn("@reader", html)
+        self.assertIn("btn-primary", html)
+
+    def test_homepage_anon(self):
+        """Do logged out visitors get the signup page?"""
+
+        status, headers, html = get("/")
+
+        self.assertEqual(status, 200)
+        self.assertIn("Sign up now", html)
+
+    def test_users_show(self):
+        """Does the profile page list the user's messages?"""
+
+        status, headers, html = get("/users/2", 1)
+
+        self.assertEqual(status, 200)
+        self.assertIn("@author", html)
+        self.assertIn("from the author", html)
+        self.assertIn("Unfollow", html)
+        self.assertNotIn("from the reader", html)
+
+    def test_users_show_missing(self):
+        self.assertEqual(get("/users/999")[0], 404)
+
+    def test_users_likes(self):
+        """Does the likes page list liked messages with their authors?"""
+
+        status, headers, html = get("/users/1/likes", 1)
+
+        self.assertEqual(status, 200)
+        self.assertIn("from the author", html)
+        self.assertIn("@author", html)
+
+    def test_users_likes_unauthorized(self):
+        """Are logged out visitors redirected home with a flash message?"""
+
+        status, headers, html = get("/users/1/likes")
+
+        self.assertEqual(status, 302)
+        self.assertIn(b"session", headers[b"set-cookie"])
+
+    def test_messages_show(self):
+        """Does the message page show the message and the follow state?"""
+
+        status, headers, html = get("/messages/1", 1)
+
+        self.assertEqual(status, 200)
+        self.assertIn("from the author", html)
+        self.assertIn("Unfollow", html)
+
+    def test_messages_show_missing(self):
+        self.assertEqual(get("/messages/999", 1)[0], 404)
+
+    def test_other_routes_not_served(self):
+        """Are routes without an async view left to the WSGI app?"""
+
+        self.assertEqual(get("/signup")[0], 404)
+        self.assertEqual(get("/users")[0], 404)
+
+    def test_concurrent_requests(self):
+        """Do concurrent requests share the event loop's connections?"""
+
+        async def many():
+            try:
+                return await asyncio.gather(*[call("/users/2", 1) for i in range(10)])
+            finally:
+                asgi.close_database()
+
+        results = asyncio.run(many())
+
+        self.assertEqual({status for status, headers, html in results}, {200})
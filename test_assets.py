@@ -0,0 +1,109 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from app import app
+import assets
+import images
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AssetsTestCase(TestCase):
+    """Test building fingerprinted assets and serving them."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.assets_dir = tempfile.mkdtemp()
+        cls.manifest = assets.build(app.static_folder, cls.assets_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.assets_dir)
+
+    def setUp(self):
+        self.default_dir = app.config['ASSETS_DIR']
+        app.config['ASSETS_DIR'] = self.assets_dir
+        app.extensions.pop('assets_manifest', None)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['ASSETS_DIR'] = self.default_dir
+        app.extensions.pop('assets_manifest', None)
+
+    def read(self, path):
+        with open(os.path.join(self.assets_dir, path), 'rb') as f:
+            return f.read()
+
+    def test_build(self):
+        """Are assets fingerprinted, and only compressible ones compressed?"""
+
+        css = self.manifest['stylesheets/style.css']
+        logo = self.manifest['images/warbler-logo.png']
+
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(self.assets_dir, css + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(self.assets_dir, logo + '.gz')))
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')), self.read(css))
+
+        if assets.brotli is not None:
+            self.assertTrue(os.path.exists(os.path.join(self.assets_dir, css + '.br')))
+
+    def test_css_urls_rewritten(self):
+        css = self.read(self.manifest['stylesheets/style.css']).decode()
+
+        self.assertIn(f"/assets/{self.manifest['images/nav-bg.png']}", css)
+        self.assertNotIn("/static/", css)
+
+    def test_asset_url(self):
+        """Do templates link fingerprinted assets only once they're built?"""
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('favicon.ico'),
+                             f"/assets/{self.manifest['favicon.ico']}")
+
+        app.config['ASSETS_DIR'] = os.path.join(self.assets_dir, 'missing')
+        app.extensions.pop('assets_manifest')
+
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('favicon.ico'), "/static/favicon.ico")
+
+    def test_serve(self):
+        """Are assets served immutable, in the best accepted encoding?"""
+
+        url = f"/assets/{self.manifest['stylesheets/style.css']}"
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Content-Type'], 'text/css; charset=utf-8')
+        self.assertEqual(resp.headers['Cache-Control'], images.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+
+        resp = self.client.get(url)
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertEqual(resp.data, self.read(self.manifest['stylesheets/style.css']))
+
+        if assets.brotli is not None:
+            resp = self.client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'br')
+
+    def test_missing(self):
+        self.assertEqual(self.client.get("/assets/nope.css").status_code, 404)
+        self.assertEqual(self.client.get("/assets/../app.py").status_code, 404)
+
+    def test_pages_link_assets(self):
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertIn(f"/assets/{self.manifest['stylesheets/style.css']}", html)
+        self.assertIn(f"/assets/{self.manifest['images/warbler-logo.png']}", html)
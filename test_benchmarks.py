@@ -0,0 +1,240 @@
+"""Query-count and latency budgets for every page.
+
+Loads the generator/ CSVs (as seed.py does) and requests each route,
+counting the SQL statements it runs and the rows it fetches and timing
+it. The results are checked against benchmarks/route_budgets.json:
+
+- statements and rows may not go up at all, so an N+1 query or a lost
+  LIMIT fails the test;
+- time may not exceed the baseline by more than BENCHMARK_TIME_FACTOR
+  (default 3) times plus BENCHMARK_TIME_SLACK_MS (default 25).
+
+The baseline is committed, so `git diff` on it compares commits. After a
+change that's meant to run more queries, re-record it with
+
+    BENCHMARK_UPDATE=1 python -m pytest test_benchmarks.py
+"""
+
+import json
+import os
+import subprocess
+from csv import DictReader
+from datetime import datetime
+from threading import local
+from time import perf_counter
+from unittest import TestCase
+
+import pytest
+from psycopg2.extensions import cursor as pg_cursor
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, Likes
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'benchmarks', 'route_budgets.json')
+
+TIME_FACTOR = float(os.environ.get('BENCHMARK_TIME_FACTOR', 3))
+TIME_SLACK_MS = float(os.environ.get('BENCHMARK_TIME_SLACK_MS', 25))
+
+# Pages are requested once to warm caches, then timed this many times.
+REPEAT = 3
+
+ME, OTHER = 1, 2
+
+# (method, path); {me}, {other} and {message} are filled in. POSTs change
+# data, so they come last and are requested only once.
+ROUTES = [
+    ('GET', '/'),
+    ('GET', '/signup'),
+    ('GET', '/login'),
+    ('GET', '/users'),
+    ('GET', '/users?q=an'),
+    ('GET', '/users/{me}'),
+    ('GET', '/users/{other}'),
+    ('GET', '/users/{other}/following'),
+    ('GET', '/users/{other}/followers'),
+    ('GET', '/users/{other}/likes'),
+    ('GET', '/users/{other}/mentions'),
+    ('GET', '/users/profile'),
+    ('GET', '/messages/new'),
+    ('GET', '/messages/{message}'),
+    ('GET', '/messages/search?q=computer'),
+    ('GET', '/tags/flask'),
+    ('GET', '/popular'),
+    ('GET', '/api/v1/timeline'),
+    ('GET', '/api/v1/users/{other}'),
+    ('GET', '/api/v1/users/{other}/likes'),
+    ('GET', '/api/v1/users/{other}/following'),
+    ('GET', '/api/v1/users/{other}/followers'),
+    ('GET', '/api/v1/users/{other}/mutuals'),
+    ('GET', '/api/v1/suggestions'),
+    ('POST', '/users/add_like/{message}'),
+    ('POST', '/users/follow/{other}'),
+    ('POST', '/users/stop-following/{other}'),
+    ('POST', '/messages/new'),
+]
+
+# Per-app caches, dropped so every run starts from the same state.
+CACHES = ('follow_graph', 'popular_messages', 'trending_tags')
+
+# Transaction bookkeeping from the test fixture, not the app's queries.
+IGNORED_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+counts = local()
+
+
+class CountingCursor(pg_cursor):
+    """A psycopg2 cursor that counts the rows fetched through it."""
+
+    def _count(self, rows):
+        if getattr(counts, 'active', False):
+            counts.rows += len(rows)
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        return row if row is None else self._count([row])[0]
+
+    def fetchmany(self, *args):
+        return self._count(super().fetchmany(*args))
+
+    def fetchall(self):
+        return self._count(super().fetchall())
+
+
+@event.listens_for(db.engine, 'checkout')
+def use_counting_cursor(dbapi_connection, connection_record, connection_proxy):
+    dbapi_connection.cursor_factory = CountingCursor
+
+
+@event.listens_for(db.engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(counts, 'active', False) and not statement.startswith(IGNORED_STATEMENTS):
+        counts.statements += 1
+
+
+def measure(send):
+    """Statements run, rows fetched and milliseconds taken by `send()`."""
+
+    counts.statements = counts.rows = 0
+    counts.active = True
+    start = perf_counter()
+
+    try:
+        resp = send()
+    finally:
+        elapsed = perf_counter() - start
+        counts.active = False
+
+    return resp, {'statements': counts.statements, 'rows': counts.rows,
+                  'ms': round(elapsed * 1000, 2)}
+
+
+def load_csv(name):
+    with open(os.path.join(HERE, 'generator', name)) as f:
+        return list(DictReader(f))
+
+
+def recorded_at():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+@pytest.mark.postgres
+class RouteBudgetTestCase(TestCase):
+    """Keep each route's queries and time within the recorded baseline."""
+
+    def setUp(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        # Follows refer to users by their line number.
+        db.session.bulk_insert_mappings(User, [
+            dict(row, id=i) for i, row in enumerate(load_csv('users.csv'), 1)])
+        db.session.bulk_insert_mappings(Message, load_csv('messages.csv'))
+        db.session.bulk_insert_mappings(Follows, load_csv('follows.csv'))
+        db.session.commit()
+
+        message_ids = [id for (id,) in db.session.query(Message.id).order_by(Message.id)]
+        users = db.session.query(User.id).count()
+        db.session.bulk_insert_mappings(Likes, [
+            {'user_id': (i * 7) % users + 1, 'message_id': message_id,
+             'liked_at': datetime.utcnow()}
+            for i, message_id in enumerate(message_ids)])
+        db.session.commit()
+
+        self.message_id = (Message.query.filter(Message.user_id != ME)
+                           .order_by(Message.id).first().id)
+
+        for name in CACHES:
+            app.extensions.pop(name, None)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        for name in CACHES:
+            app.extensions.pop(name, None)
+
+    def request(self, method, path):
+        """Send a request and read the whole (possibly streamed) body."""
+
+        resp = self.client.open(path, method=method, data={'text': "#flask benchmark"})
+        resp.get_data()
+        return resp
+
+    def measure_routes(self):
+        results = {}
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = ME
+
+        for method, path in ROUTES:
+            url = path.format(me=ME, other=OTHER, message=self.message_id)
+
+            if method == 'GET':
+                self.request(method, url)
+                runs = [measure(lambda: self.request(method, url)) for _ in range(REPEAT)]
+            else:
+                runs = [measure(lambda: self.request(method, url))]
+
+            resp = runs[0][0]
+            self.assertLess(resp.status_code, 400, f"{method} {url}")
+
+            result = min((measured for _, measured in runs), key=lambda m: m['ms'])
+            results[f"{method} {path}"] = result
+
+        return results
+
+    def test_routes_within_budget(self):
+        results = self.measure_routes()
+
+        if os.environ.get('BENCHMARK_UPDATE') or not os.path.exists(BASELINE):
+            with open(BASELINE, 'w') as f:
+                json.dump({'recorded_at': recorded_at(), 'routes': results}, f, indent=2)
+                f.write('\n')
+            self.skipTest(f"Recorded a new baseline in {BASELINE}")
+
+        with open(BASELINE) as f:
+            baseline = json.load(f)['routes']
+
+        for route, measured in results.items():
+            with self.subTest(route=route):
+                self.assertIn(route, baseline, "Not in the baseline; re-record it")
+                budget = baseline[route]
+
+                self.assertLessEqual(measured['statements'], budget['statements'],
+                                     f"More SQL statements than the baseline: {measured}")
+                self.assertLessEqual(measured['rows'], budget['rows'],
+                                     f"More rows fetched than the baseline: {measured}")
+                self.assertLessEqual(measured['ms'],
+                                     budget['ms'] * TIME_FACTOR + TIME_SLACK_MS,
+                                     f"Slower than the baseline: {measured}")
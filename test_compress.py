@@ -0,0 +1,158 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_compress.py
+
+
+import gzip
+import os
+import zlib
+from unittest import TestCase, skipIf
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from models import db, User
+from app import app
+import compress
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+CONFIG = dict(COMPRESS_ENABLED=True, COMPRESS_LEVEL=6, COMPRESS_BROTLI_QUALITY=4,
+              COMPRESS_MIN_SIZE=100, COMPRESS_MIMETYPES=compress.COMPRESS_MIMETYPES)
+
+
+def wsgi_app(chunks, content_type='text/html; charset=utf-8', headers=(), length=True):
+    """A WSGI app sending `chunks`, tracking whether it was closed."""
+
+    class Body(list):
+        closed = False
+
+        def close(self):
+            Body.closed = True
+
+    def application(environ, start_response):
+        response_headers = [('Content-Type', content_type), *headers]
+        if length:
+            response_headers.append(('Content-Length', str(sum(map(len, chunks)))))
+        start_response('200 OK', response_headers)
+        return Body(chunks)
+
+    application.body = Body
+    return application
+
+
+def get(application, encoding='gzip', **config):
+    client = Client(compress.CompressionMiddleware(application, {**CONFIG, **config}),
+                    BaseResponse)
+    return client.get('/', headers={'Accept-Encoding': encoding}, buffered=True)
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    """Test negotiating, thresholds and streaming."""
+
+    def test_gzip(self):
+        page = wsgi_app([b'<p>hello</p>' * 100])
+        resp = get(page)
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Vary'], 'Accept-Encoding')
+        self.assertNotIn('Content-Length', resp.headers)
+        self.assertEqual(gzip.decompress(resp.data), b'<p>hello</p>' * 100)
+        self.assertTrue(page.body.closed)
+
+    @skipIf(compress.brotli is None, "brotli is not installed")
+    def test_brotli_preferred(self):
+        resp = get(wsgi_app([b'<p>hello</p>' * 100]), encoding='gzip, deflate, br')
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'br')
+        self.assertEqual(compress.brotli.decompress(resp.data), b'<p>hello</p>' * 100)
+
+    def test_not_accepted(self):
+        for encoding in ('identity', 'gzip;q=0', ''):
+            resp = get(wsgi_app([b'x' * 1000]), encoding=encoding)
+            self.assertNotIn('Content-Encoding', resp.headers)
+
+    def test_skipped(self):
+        """Are small, binary, already encoded and no-transform responses left alone?"""
+
+        cases = [
+            wsgi_app([b'x' * 99]),
+            wsgi_app([b'x' * 99], length=False),
+            wsgi_app([b'x' * 1000], content_type='image/png'),
+            wsgi_app([b'x' * 1000], headers=[('Content-Encoding', 'br')]),
+            wsgi_app([b'x' * 1000], headers=[('Cache-Control', 'no-transform')]),
+        ]
+
+        for page in cases:
+            resp = get(page)
+            self.assertNotEqual(resp.headers.get('Content-Encoding'), 'gzip')
+            self.assertTrue(page.body.closed)
+
+        self.assertEqual(get(cases[1]).data, b'x' * 99)
+
+    def test_etag_weakened(self):
+        """Does a compressed response get a weak ETag, and the identity one keep its own?"""
+
+        page = wsgi_app([b'<p>hello</p>' * 100], headers=[('ETag', '"abc"')])
+
+        self.assertEqual(get(page).headers['ETag'], 'W/"abc"')
+        self.assertEqual(get(page, encoding='identity').headers['ETag'], '"abc"')
+
+    def test_vary_when_uncompressed(self):
+        """Do responses sent uncompressed, but negotiable, still vary on Accept-Encoding?"""
+
+        for page, encoding in [(wsgi_app([b'x' * 99]), 'gzip'),
+                               (wsgi_app([b'x' * 99], length=False), 'gzip'),
+                               (wsgi_app([b'x' * 1000]), 'identity')]:
+            self.assertEqual(get(page, encoding=encoding).headers['Vary'], 'Accept-Encoding')
+
+        binary = get(wsgi_app([b'x' * 1000], content_type='image/png'))
+        self.assertNotIn('Vary', binary.headers)
+
+    def test_streaming(self):
+        """Is each streamed chunk past the threshold flushed as it arrives?"""
+
+        chunks = [b'<li>row %d</li>' % i * 10 for i in range(20)]
+        page = wsgi_app(chunks, headers=[('Vary', 'Cookie')], length=False)
+        middleware = compress.CompressionMiddleware(page, CONFIG)
+
+        environ = {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}
+        started = []
+        body = middleware(environ, lambda status, headers, exc_info=None: started.append(headers))
+
+        self.assertIn(('Vary', 'Cookie, Accept-Encoding'), started[0])
+
+        decoder = zlib.decompressobj(31)
+        received = []
+        for data in body:
+            received.append(decoder.decompress(data))
+
+        # Every chunk can be decoded as soon as it's received.
+        self.assertEqual(received[:-1], chunks)
+        self.assertEqual(b''.join(received), b''.join(chunks))
+        self.assertTrue(page.body.closed)
+
+    def test_level(self):
+        page = wsgi_app([os.urandom(50).hex().encode() * 40])
+
+        fast = get(page, COMPRESS_LEVEL=1).data
+        best = get(page, COMPRESS_LEVEL=9).data
+
+        self.assertLess(len(best), len(fast))
+
+
+class CompressedPagesTestCase(TestCase):
+    def test_pages_compressed(self):
+        User.query.delete()
+        db.session.add(User(id=1, username="alice", email="alice@test.com", password="HASHED"))
+        db.session.commit()
+
+        client = app.test_client()
+        plain = client.get("/users")
+        resp = client.get("/users", headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertLess(len(resp.data), len(plain.data))
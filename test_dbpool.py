@@ -0,0 +1,135 @@
+"""Connection pool configuration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_dbpool.py
+
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from time import sleep
+from unittest import TestCase
+
+from sqlalchemy import exc
+
+import dbpool
+
+POSTGRES_URI = "postgresql:///warbler_test"
+
+
+def settings(**overrides):
+    """Default DB_* settings with `overrides` applied."""
+
+    config = dbpool.pool_config_from_env({})
+    config.update(overrides)
+    return config
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test engine options built from DB_* settings."""
+
+    def test_postgres_options(self):
+        """Are pool and statement timeout settings passed to PostgreSQL?"""
+
+        options = dbpool.engine_options(POSTGRES_URI, settings(
+            DB_POOL_SIZE=3, DB_MAX_OVERFLOW=2, DB_STATEMENT_TIMEOUT_MS=500))
+
+        self.assertIs(options['poolclass'], dbpool.MeteredQueuePool)
+        self.assertEqual(options['pool_size'], 3)
+        self.assertEqual(options['max_overflow'], 2)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=500'})
+
+    def test_sqlite_memory_options(self):
+        """Are in-memory SQLite databases left on a single shared connection?"""
+
+        options = dbpool.engine_options("sqlite://", settings())
+
+        self.assertEqual(options, {'pool_pre_ping': True, 'slow_query_ms': 100,
+                                   'slow_query_log_size': 100})
+
+    def test_env(self):
+        """Are settings read from the environment?"""
+
+        config = dbpool.pool_config_from_env({'DB_POOL_SIZE': '20', 'DB_POOL_PRE_PING': '0'})
+
+        self.assertEqual(config['DB_POOL_SIZE'], 20)
+        self.assertFalse(config['DB_POOL_PRE_PING'])
+
+
+class MeteredPoolTestCase(TestCase):
+    """Test pool metrics against a SQLite file standing in for the database."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.uri = f"sqlite:///{os.path.join(self.tmpdir.name, 'pool.db')}"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def engine(self, **overrides):
+        engine = dbpool.create_engine(
+            self.uri, dbpool.engine_options(self.uri, settings(**overrides)))
+        self.addCleanup(engine.dispose)
+        return engine
+
+    def test_checkout_metrics_under_load(self):
+        """Are waits, timeouts and saturation recorded under a threaded load?"""
+
+        engine = self.engine(DB_POOL_SIZE=2, DB_MAX_OVERFLOW=0, DB_POOL_TIMEOUT=0.3)
+        barrier = Barrier(6)
+
+        def hold_connection(hold):
+            barrier.wait()
+            try:
+                with engine.connect() as conn:
+                    conn.execute("SELECT 1")
+                    sleep(hold)
+                return "ok"
+            except exc.TimeoutError:
+                return "timeout"
+
+        with self.assertLogs('dbpool', level='WARNING') as logs:
+            with ThreadPoolExecutor(max_workers=6) as pool:
+                results = list(pool.map(hold_connection, [0.1] * 4 + [1, 1]))
+
+        stats = dbpool.pool_stats(engine)
+
+        self.assertIn("timeout", results)
+        self.assertGreater(stats['timeouts'], 0)
+        self.assertEqual(stats['checkouts'] + stats['timeouts'], 6)
+        self.assertGreater(stats['max_wait_ms'], 50)
+        self.assertGreater(stats['saturation_warnings'], 0)
+        self.assertTrue(any("near saturation" in line for line in logs.output))
+        self.assertTrue(any("exhausted" in line for line in logs.output))
+
+    def test_sqlite_statement_timeout(self):
+        """Are long-running SQLite statements interrupted?"""
+
+        engine = self.engine(DB_STATEMENT_TIMEOUT_MS=100)
+
+        slow = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                "SELECT count(*) FROM n")
+
+        with self.assertRaises(exc.OperationalError):
+            engine.execute(slow)
+
+        self.assertEqual(engine.execute("SELECT 1").scalar(), 1)
+
+
+class PostgresTimeoutTestCase(TestCase):
+    """Test the statement timeout against PostgreSQL."""
+
+    def test_statement_timeout(self):
+        """Is a statement over the timeout cancelled?"""
+
+        engine = dbpool.create_engine(POSTGRES_URI, dbpool.engine_options(
+            POSTGRES_URI, settings(DB_STATEMENT_TIMEOUT_MS=100)))
+        self.addCleanup(engine.dispose)
+
+        with self.assertRaises(exc.OperationalError):
+            engine.execute("SELECT pg_sleep(2)")
+
+        self.assertEqual(engine.execute("SELECT 1").scalar(), 1)
@@ -0,0 +1,139 @@
+"""Follow/unfollow primitive tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_follows.py
+
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+import pytest
+
+from models import db, User, Follows
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowsTestCase(TestCase):
+    """Test idempotent follow/unfollow."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Follows.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=1, username="follower", email="follower@test.com", password="HASHED"),
+            User(id=2, username="followed", email="followed@test.com", password="HASHED"),
+        ])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+
+    def follow_count(self):
+        return Follows.query.filter_by(user_following_id=1, user_being_followed_id=2).count()
+
+    def test_follow_twice(self):
+        """Is following twice a no-op the second time?"""
+
+        self.assertTrue(Follows.follow(1, 2))
+        self.assertFalse(Follows.follow(1, 2))
+        db.session.commit()
+
+        self.assertEqual(self.follow_count(), 1)
+
+    def test_unfollow_twice(self):
+        """Is unfollowing someone you don't follow a no-op?"""
+
+        Follows.follow(1, 2)
+        db.session.commit()
+
+        self.assertTrue(Follows.unfollow(1, 2))
+        self.assertFalse(Follows.unfollow(1, 2))
+        db.session.commit()
+
+        self.assertEqual(self.follow_count(), 0)
+
+    def test_follow_missing_user(self):
+        """Does following a missing user 404 instead of erroring?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            self.assertEqual(c.post("/users/follow/999").status_code, 404)
+            self.assertEqual(c.post("/users/stop-following/999").status_code, 302)
+
+    def test_double_click(self):
+        """Do repeated follow/unfollow posts all succeed?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            for _ in range(2):
+                self.assertEqual(c.post("/users/follow/2").status_code, 302)
+            self.assertEqual(self.follow_count(), 1)
+
+            for _ in range(2):
+                self.assertEqual(c.post("/users/stop-following/2").status_code, 302)
+            self.assertEqual(self.follow_count(), 0)
+
+
+@pytest.mark.commits
+@pytest.mark.postgres
+class ConcurrentFollowsTestCase(TestCase):
+    """Test racing follow/unfollow requests, each in a transaction of its own."""
+
+    def setUp(self):
+        self.delete_data()
+
+        db.session.add_all([
+            User(id=1, username="follower", email="follower@test.com", password="HASHED"),
+            User(id=2, username="followed", email="followed@test.com", password="HASHED"),
+        ])
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self):
+        self.delete_data()
+
+    def delete_data(self):
+        Follows.query.filter(Follows.user_following_id.in_([1, 2])).delete(
+            synchronize_session=False)
+        User.query.filter(User.id.in_([1, 2])).delete(synchronize_session=False)
+        db.session.commit()
+
+    def follow_count(self):
+        return Follows.query.filter_by(user_following_id=1, user_being_followed_id=2).count()
+
+    def test_concurrent_follow_unfollow(self):
+        """Do concurrent follow/unfollow posts for one pair never 500?"""
+
+        def click(i):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            url = "/users/follow/2" if i % 2 == 0 else "/users/stop-following/2"
+            return client.post(url).status_code
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(click, range(200)))
+
+        self.assertEqual(set(statuses), {302})
+        self.assertIn(self.follow_count(), (0, 1))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(lambda i: click(0), range(50)))
+
+        self.assertEqual(set(statuses), {302})
+        self.assertEqual(self.follow_count(), 1)
@@ -0,0 +1,237 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_graph.py
+
+
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Follows
+from app import app, CURR_USER_KEY
+import graph
+from graph import FollowGraph
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# 1 follows 2 and 3; 2 and 3 both follow 4; 3 follows 5; 4 follows 1.
+EDGES = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (4, 1)]
+
+
+class FollowGraphTestCase(TestCase):
+    """Test the in-memory follow graph."""
+
+    def setUp(self):
+        self.graph = FollowGraph.from_edges(EDGES)
+
+    def test_adjacency(self):
+        """Are following/followers read from the CSR snapshot?"""
+
+        self.assertEqual(self.graph.edge_count, 6)
+        self.assertEqual(self.graph.following(1), {2, 3})
+        self.assertEqual(self.graph.followers(4), {2, 3})
+        self.assertEqual(self.graph.following(99), set())
+
+    def test_mutual_followers(self):
+        """Are shared followers counted?"""
+
+        self.assertEqual(self.graph.mutual_followers(2, 3), 1)
+        self.assertEqual(self.graph.mutual_followers(4, 5), 1)
+        self.assertEqual(self.graph.mutual_followers(1, 5), 0)
+
+    def test_followed_by_following(self):
+        """Which people I follow also follow this user?"""
+
+        self.assertEqual(self.graph.followed_by_following(1, 4), {2, 3})
+        self.assertEqual(self.graph.followed_by_following(1, 5), {3})
+
+    def test_suggestions(self):
+        """Are friends-of-friends ranked by how many friends follow them?"""
+
+        self.assertEqual(self.graph.suggestions(1), [(4, 2), (5, 1)])
+        self.assertEqual(self.graph.suggestions(5), [])
+
+    def test_delta(self):
+        """Are follows/unfollows applied on top of the snapshot?"""
+
+        self.graph.follow(1, 4)
+        self.graph.unfollow(1, 3)
+
+        self.assertEqual(self.graph.following(1), {2, 4})
+        self.assertEqual(self.graph.followers(3), set())
+        self.assertEqual(self.graph.suggestions(1), [])
+
+        self.graph.follow(1, 3)
+        self.assertEqual(self.graph.following(1), {2, 3, 4})
+
+    def test_compact(self):
+        """Does compacting the delta give the same answers?"""
+
+        self.graph.follow(5, 2)
+        self.graph.unfollow(3, 5)
+        self.graph.follow(6, 1)
+
+        before = {user_id: (self.graph.following(user_id), self.graph.followers(user_id))
+                  for user_id in range(1, 7)}
+
+        self.graph.compact()
+
+        after = {user_id: (self.graph.following(user_id), self.graph.followers(user_id))
+                 for user_id in range(1, 7)}
+
+        self.assertEqual(before, after)
+        self.assertEqual(self.graph.edge_count, 7)
+
+    def test_changes_during_compaction(self):
+        """Are follows recorded while the arrays are rebuilt kept?"""
+
+        merged = graph.Adjacency.merged
+        calls = []
+
+        def merged_meanwhile(adjacency, added, removed):
+            if not calls:
+                calls.append(True)
+                self.graph.follow(5, 1)
+            return merged(adjacency, added, removed)
+
+        self.graph.follow(5, 2)
+        with patch.object(graph.Adjacency, 'merged', merged_meanwhile):
+            self.graph.compact()
+
+        self.assertEqual(self.graph.following(5), {1, 2})
+        self.assertEqual(self.graph.followers(1), {4, 5})
+        self.assertEqual(self.graph._delta_size, 1)
+
+    def test_compacts_in_background(self):
+        with patch('graph.GRAPH_COMPACT_AFTER', 2):
+            self.graph.follow(5, 1)
+            self.graph.follow(5, 2)
+
+            for _ in range(100):
+                if self.graph._delta_size == 0:
+                    break
+                sleep(0.01)
+
+        self.assertEqual(self.graph._delta_size, 0)
+        self.assertEqual(self.graph.edge_count, 8)
+        self.assertEqual(self.graph.following(5), {1, 2})
+
+    def test_hand_over(self):
+        """Does a reloaded snapshot get the changes made while it loaded?"""
+
+        self.graph.start_reload()
+        self.graph.follow(5, 2)
+
+        reloaded = FollowGraph.from_edges(EDGES)
+        self.graph.hand_over(reloaded)
+        self.graph.unfollow(1, 3)
+
+        self.assertEqual(reloaded.followers(2), {1, 5})
+        self.assertEqual(reloaded.following(1), {2})
+
+
+class FollowGraphViewTestCase(TestCase):
+    """Test follow graph details on profile pages and the API."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        Follows.query.delete()
+        User.query.delete()
+
+        for user_id in range(1, 6):
+            db.session.add(User(id=user_id, username=f"graphuser{user_id}",
+                                email=f"graph{user_id}@test.com", password="HASHED"))
+        db.session.commit()
+
+        for follower, followed in EDGES:
+            db.session.add(Follows(user_following_id=follower,
+                                   user_being_followed_id=followed))
+        db.session.commit()
+
+        app.extensions.pop('follow_graph', None)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Clean up any fouled transaction."""
+
+        db.session.rollback()
+        app.extensions.pop('follow_graph', None)
+
+    def test_own_profile_suggestions(self):
+        """Does your own profile suggest who to follow?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            html = c.get("/users/1").get_data(as_text=True)
+
+            self.assertIn("Who to follow", html)
+            self.assertIn("@graphuser4", html)
+
+    def test_other_profile_followed_by(self):
+        """Does another profile say which people you follow follow them?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            html = c.get("/users/4").get_data(as_text=True)
+
+            self.assertIn('id="followed-by"', html)
+            self.assertIn("@graphuser2", html)
+            self.assertIn("@graphuser3", html)
+
+    def test_follow_updates_graph(self):
+        """Does following someone update the loaded snapshot?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.get("/api/v1/suggestions")
+            c.post("/users/follow/4")
+
+            data = c.get("/api/v1/suggestions").get_json()
+            self.assertEqual([u["id"] for u in data["users"]], [5])
+            self.assertEqual(data["users"][0]["followed_by_following"], 1)
+
+    def test_background_reload(self):
+        """Is a stale snapshot served while a new one loads in the background?"""
+
+        with app.app_context():
+            stale = graph.get_graph()
+            db.session.add(Follows(user_following_id=5, user_being_followed_id=1))
+            db.session.commit()
+
+            app.config['GRAPH_SNAPSHOT_TTL'] = 0
+            try:
+                self.assertIs(graph.get_graph(), stale)
+
+                for _ in range(100):
+                    if not app.extensions.get('follow_graph_reloading'):
+                        break
+                    sleep(0.05)
+            finally:
+                del app.config['GRAPH_SNAPSHOT_TTL']
+
+            self.assertIsNot(app.extensions['follow_graph'], stale)
+            self.assertEqual(app.extensions['follow_graph'].followers(1), {4, 5})
+
+    def test_api_mutuals(self):
+        """Does the mutuals API report shared followers?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            data = c.get("/api/v1/users/4/mutuals").get_json()
+
+            self.assertEqual(data["mutual_followers"], 0)
+            self.assertEqual([u["id"] for u in data["followed_by_following"]], [2, 3])
+
+            resp = c.get("/api/v1/users/999/mutuals")
+            self.assertEqual(resp.status_code, 404)
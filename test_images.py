@@ -0,0 +1,267 @@
+"""Image resizing and caching tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_images.py
+
+
+import os
+import shutil
+import socket
+import tempfile
+from io import BytesIO
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from models import db, User
+from app import app
+import images
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+DEFAULT_PIC = "/static/images/default-pic.png"
+HERO = "/static/images/warbler-hero.jpg"
+
+
+@skipIf(images.PIL is None, "Pillow is not installed")
+class ImageViewTestCase(TestCase):
+    """Test resizing images on first use and serving cached copies."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        app.config['IMAGE_CACHE_DIR'] = self.cache_dir
+        app.extensions.pop('image_names', None)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        app.extensions.pop('image_names', None)
+
+    def resize(self, url, size):
+        """Follow the filter's first link; return the cached image's path."""
+
+        with app.test_request_context():
+            first = images.thumbnail_url(url, size)
+
+        self.assertTrue(first.startswith(f"/images/{size}?src="))
+
+        resp = self.client.get(first)
+        self.assertEqual(resp.status_code, 302)
+
+        return resp.location.replace("http://localhost", "")
+
+    def test_avatar(self):
+        """Is an avatar cropped, cached by content hash and linked directly?"""
+
+        path = self.resize(DEFAULT_PIC, 'avatar')
+        resp = self.client.get(path)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'], images.IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(Image.open(BytesIO(resp.data)).size, (96, 96))
+
+        with app.test_request_context():
+            self.assertEqual(images.thumbnail_url(DEFAULT_PIC, 'avatar'), path)
+
+        # The mapping survives a restart.
+        app.extensions.pop('image_names')
+        with app.test_request_context():
+            self.assertEqual(images.thumbnail_url(DEFAULT_PIC, 'avatar'), path)
+
+    def test_hero_keeps_aspect_ratio(self):
+        path = self.resize(HERO, 'hero')
+        image = Image.open(BytesIO(self.client.get(path).data))
+
+        self.assertTrue(path.endswith(".jpg"))
+        self.assertLessEqual(image.size[0], 1280)
+        self.assertLessEqual(image.size[1], 480)
+
+    def test_remote(self):
+        """Are remote images fetched in the background, and oversized ones refused?"""
+
+        with open(os.path.join(app.static_folder, "images", "default-pic.png"), "rb") as f:
+            data = f.read()
+
+        url = "https://example.com/me.png"
+        with app.test_request_context():
+            first = images.thumbnail_url(url, 'card')
+
+        with patch('images.public_address', return_value="93.184.216.34"), \
+                patch('images._get', return_value=(200, None, data)):
+            # Sent to the original while it's fetched.
+            self.assertEqual(self.client.get(first).location, url)
+
+            with app.test_request_context():
+                images.queue_thumbnail(url, 'card').result()
+                path = images.thumbnail_url(url, 'card')
+
+        self.assertEqual(Image.open(BytesIO(self.client.get(path).data)).size,
+                         (400, 400))
+
+        app.config['IMAGE_MAX_BYTES'] = 10
+        try:
+            with patch('images.public_address', return_value="93.184.216.34"), \
+                    patch('images._get', return_value=(200, None, data)), \
+                    app.test_request_context():
+                with self.assertRaises(images.ImageError):
+                    images.queue_thumbnail("https://example.com/big.png", 'card').result()
+        finally:
+            app.config['IMAGE_MAX_BYTES'] = 10 * 1024 * 1024
+
+    def test_unreadable_falls_back(self):
+        """Do missing or non-image sources redirect to the original?"""
+
+        self.assertEqual(self.resize("/static/images/missing.png", 'avatar'),
+                         "/static/images/missing.png")
+        self.assertEqual(self.resize("/static/stylesheets/style.css", 'avatar'),
+                         "/static/stylesheets/style.css")
+        self.assertFalse(self.resize("/static/../app.py", 'avatar').startswith("/images/"))
+
+        with app.test_request_context():
+            self.assertEqual(images.thumbnail_url("me.png", 'avatar'), "me.png")
+            self.assertEqual(images.thumbnail_url("file:///etc/passwd", 'avatar'),
+                             "file:///etc/passwd")
+
+    def test_misses_remembered(self):
+        """Is a URL not resized yet looked for on disk once per retry delay?"""
+
+        url = "https://example.com/me.png"
+
+        with patch('images._read_source', return_value=None) as read, \
+                app.test_request_context():
+            first = images.thumbnail_url(url, 'avatar')
+            self.assertEqual(images.thumbnail_url(url, 'avatar'), first)
+            self.assertEqual(read.call_count, 1)
+
+            later = images.time.monotonic() + images.IMAGE_RETRY_SECONDS
+            with patch('images.time.monotonic', return_value=later):
+                images.thumbnail_url(url, 'avatar')
+            self.assertEqual(read.call_count, 2)
+
+    def test_failures_remembered(self):
+        """Is an image that couldn't be fetched linked as it is, and not
+        fetched again until the retry delay has passed?"""
+
+        url = "https://example.com/broken.png"
+        with app.test_request_context():
+            first = images.thumbnail_url(url, 'avatar')
+
+        with patch('images.fetch', side_effect=images.ImageError("nope")), \
+                app.test_request_context():
+            with self.assertRaises(images.ImageError):
+                images.queue_thumbnail(url, 'avatar').result()
+
+        with patch('images.queue_thumbnail') as queue:
+            self.assertEqual(self.client.get(first).location, url)
+            queue.assert_not_called()
+
+        with app.test_request_context():
+            self.assertEqual(images.thumbnail_url(url, 'avatar'), url)
+
+            later = images.time.monotonic() + images.IMAGE_RETRY_SECONDS
+            with patch('images.time.monotonic', return_value=later):
+                self.assertEqual(images.thumbnail_url(url, 'avatar'), first)
+
+    def test_names_bounded(self):
+        """Are only the IMAGE_NAMES_MAX most recently used URLs kept in memory?"""
+
+        app.config['IMAGE_NAMES_MAX'] = 2
+        try:
+            with app.test_request_context():
+                for name in ("a", "b", "a", "c"):
+                    images.thumbnail_url(f"https://example.com/{name}.png", 'avatar')
+        finally:
+            app.config['IMAGE_NAMES_MAX'] = images.IMAGE_NAMES_MAX
+
+        self.assertEqual(list(app.extensions['image_names']),
+                         [('avatar', "https://example.com/a.png"),
+                          ('avatar', "https://example.com/c.png")])
+
+    def test_private_addresses_refused(self):
+        """Are hosts resolving to internal addresses never connected to?"""
+
+        for address in ("127.0.0.1", "10.1.2.3", "169.254.169.254", "224.0.0.1",
+                        "0.0.0.0", "::1", "fe80::1", "::ffff:127.0.0.1"):
+            family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            info = [(family, socket.SOCK_STREAM, 6, "", (address, 80))]
+
+            with patch('socket.getaddrinfo', return_value=info), \
+                    patch('socket.create_connection') as connect, \
+                    app.test_request_context():
+                with self.assertRaises(images.ImageError, msg=address):
+                    images.fetch("http://internal.example.com/me.png")
+
+            connect.assert_not_called()
+
+    def test_redirects_checked(self):
+        """Is every redirect checked like the first URL?"""
+
+        def getaddrinfo(host, port, **kwargs):
+            address = "93.184.216.34" if host == "example.com" else host
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))]
+
+        responses = [(302, "http://169.254.169.254/latest/meta-data", b"")]
+
+        with patch('socket.getaddrinfo', side_effect=getaddrinfo), \
+                patch('images._get', side_effect=responses) as get, \
+                app.test_request_context():
+            with self.assertRaises(images.ImageError):
+                images.fetch("https://example.com/me.png")
+
+            get.assert_called_once_with("https://example.com/me.png", "93.184.216.34",
+                                        5, 10 * 1024 * 1024)
+
+            with patch('images._get', return_value=(302, "/again", b"")) as get:
+                with self.assertRaises(images.ImageError):
+                    images.fetch("https://example.com/me.png")
+
+            self.assertEqual(get.call_count, images.IMAGE_MAX_REDIRECTS + 1)
+
+    def test_allowed_hosts(self):
+        """With IMAGE_PROXY_HOSTS set, are other hosts' images left alone?"""
+
+        app.config['IMAGE_PROXY_HOSTS'] = ["example.com"]
+        try:
+            with app.test_request_context():
+                self.assertIn("src=", images.thumbnail_url("https://cdn.example.com/a.png", 'avatar'))
+                self.assertEqual(images.thumbnail_url("https://example.org/a.png", 'avatar'),
+                                 "https://example.org/a.png")
+                with self.assertRaises(images.ImageError):
+                    images.fetch("https://example.org/a.png")
+        finally:
+            app.config['IMAGE_PROXY_HOSTS'] = None
+
+    def test_bad_requests(self):
+        """Are unsigned sources and unknown sizes refused?"""
+
+        with app.test_request_context():
+            src = images.thumbnail_url(DEFAULT_PIC, 'avatar').split("src=")[1]
+
+        self.assertEqual(self.client.get("/images/avatar?src=nope").status_code, 404)
+        self.assertEqual(self.client.get(f"/images/huge?src={src}").status_code, 404)
+        self.assertEqual(self.client.get("/images/avatar/nope.png").status_code, 404)
+
+    def test_pages_use_thumbnails(self):
+        User.query.delete()
+        db.session.add(User(id=1, username="alice", email="alice@test.com", password="HASHED"))
+        db.session.commit()
+
+        html = self.client.get("/users/1").get_data(as_text=True)
+
+        self.assertIn("/images/card?src=", html)
+        self.assertIn("/images/hero?src=", html)
+        self.assertNotIn(f'"{DEFAULT_PIC}"', html)
+
+
+class NoPillowTestCase(TestCase):
+    def test_passthrough(self):
+        """Without Pillow, are original URLs used?"""
+
+        with patch('images.PIL', None), app.test_request_context():
+            self.assertEqual(images.thumbnail_url(DEFAULT_PIC, 'avatar'), DEFAULT_PIC)
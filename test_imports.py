@@ -0,0 +1,61 @@
+"""Import path tests.
+
+Each test imports a module in a fresh Python process and checks which
+modules came along with it. benchmarks/bench_import.py measures how
+long those imports take.
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_imports.py
+
+
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+IMPORTED = """
+import json, sys
+import %s
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def modules_imported_by(module):
+    env = dict(os.environ, FLASK_ENV='production')
+    env.setdefault('DATABASE_URL', "postgresql:///warbler_test")
+
+    out = subprocess.run([sys.executable, '-c', IMPORTED % module], env=env, cwd=ROOT,
+                         check=True, capture_output=True, text=True).stdout
+    return set(json.loads(out.splitlines()[-1]))
+
+
+class ImportTestCase(TestCase):
+    """Test that only what's needed is imported."""
+
+    def test_models(self):
+        """Do scripts using only the models skip the web app?"""
+
+        modules = modules_imported_by('models')
+
+        for module in ('app', 'flask_wtf', 'wtforms', 'flask_debugtoolbar', 'PIL.Image',
+                       'flask_bcrypt', 'bcrypt'):
+            self.assertNotIn(module, modules)
+
+    def test_database_helpers(self):
+        """Do the pool and slow query log leave Flask out?"""
+
+        for helper in ('dbpool', 'slowlog'):
+            self.assertNotIn('flask', modules_imported_by(helper))
+
+    def test_app(self):
+        """Does the app leave debugging tools and image libraries until they're used?"""
+
+        modules = modules_imported_by('app')
+
+        for module in ('flask_debugtoolbar', 'pdb', 'pkg_resources', 'PIL.Image'):
+            self.assertNotIn(module, modules)
@@ -0,0 +1,191 @@
+"""Like buffer tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_likebuffer.py
+
+
+from datetime import datetime, timedelta
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Message, User, Likes, MessageScore
+from app import app, CURR_USER_KEY
+import likebuffer
+import queries
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+JSON = {"Accept": "application/json"}
+
+
+class LikeBufferTestCase(TestCase):
+    """Test buffered like toggles, and reading through them."""
+
+    def setUp(self):
+        Likes.query.delete()
+        MessageScore.query.delete()
+        User.query.delete()
+        Message.query.delete()
+
+        for user_id, username in [(1, "author"), (2, "reader")]:
+            user = User.signup(username=username, email=f"{username}@test.com",
+                               password="password", image_url=None)
+            user.id = user_id
+        db.session.commit()
+
+        now = datetime.utcnow()
+        db.session.add_all([
+            Message(id=1, text="first message", user_id=1, timestamp=now - timedelta(hours=1)),
+            Message(id=2, text="second message", user_id=1, timestamp=now),
+        ])
+        db.session.commit()
+
+        # Written out only when flushed.
+        self.saved_buffer = app.extensions['like_buffer']
+        self.buffer = app.extensions['like_buffer'] = likebuffer.LikeBuffer(
+            app, flush_seconds=60)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        # Flushed here, into the test's transaction, rather than by its
+        # timer after the test.
+        self.flush()
+        app.extensions['like_buffer'] = self.saved_buffer
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def toggle(self, message_id, user_id=2):
+        self.login(user_id)
+        resp = self.client.post(f"/users/add_like/{message_id}", headers=JSON)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()
+
+    def flush(self):
+        with app.app_context():
+            return self.buffer.flush()
+
+    def test_toggles_cancel_out(self):
+        """Does liking and unliking a message write nothing?"""
+
+        self.assertEqual(self.toggle(1), {"message_id": 1, "liked": True})
+        self.assertEqual(self.toggle(1), {"message_id": 1, "liked": False})
+
+        self.assertEqual(self.buffer.as_dict()['pending'], 0)
+        self.assertEqual(self.buffer.as_dict()['cancelled'], 1)
+        self.assertEqual(self.flush(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_batched_flush(self):
+        self.toggle(1)
+        self.toggle(2)
+        self.assertEqual(Likes.query.count(), 0)
+
+        self.assertEqual(self.flush(), 2)
+
+        self.assertEqual(sorted(like.message_id for like in Likes.query), [1, 2])
+        self.assertEqual({score.message_id: score.likes for score in MessageScore.query},
+                         {1: 1, 2: 1})
+        self.assertEqual(self.buffer.as_dict()['batches'], 1)
+
+    def test_unlike(self):
+        self.toggle(1)
+        self.flush()
+
+        self.assertEqual(self.toggle(1), {"message_id": 1, "liked": False})
+        self.assertEqual(self.flush(), 1)
+
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(MessageScore.query.get(1).likes, 0)
+
+    def test_overlay(self):
+        """Are unwritten changes shown to the user who made them?"""
+
+        db.session.add(Likes(user_id=2, message_id=1, liked_at=datetime.utcnow()))
+        db.session.commit()
+
+        self.toggle(1)
+        self.toggle(2)
+
+        with app.test_request_context():
+            self.assertEqual(likebuffer.liked_message_ids(2), {2})
+            self.assertEqual(likebuffer.liked_message_ids(2, [1]), set())
+            self.assertEqual([row.id for row in likebuffer.liked_timeline(2)], [2])
+            self.assertEqual(likebuffer.user_profile(2).likes_count, 1)
+            self.assertEqual(likebuffer.liked_message_ids(1), set())
+
+        html = self.client.get("/users/2/likes").get_data(as_text=True)
+        self.assertIn("second message", html)
+        self.assertNotIn("first message", html)
+
+    def test_deleted_message(self):
+        """Is a like of a message deleted before the flush dropped alone?"""
+
+        self.toggle(1)
+        self.toggle(2)
+
+        Message.query.filter_by(id=2).delete()
+        db.session.commit()
+
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual([like.message_id for like in Likes.query], [1])
+
+    def test_toggle_read_before_flush(self):
+        """Is a like read before a batch was written read again?"""
+
+        self.toggle(1)
+
+        with app.test_request_context():
+            generation = likebuffer.generation()
+            target = queries.like_target(1, 2)
+            self.flush()
+
+            self.assertIsNone(target.liked_at)
+            self.assertFalse(likebuffer.toggle(2, 1, target.timestamp, target.liked_at,
+                                               generation))
+
+        self.flush()
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_retried_after_failure(self):
+        """Is a batch that failed to write tried again by itself, with no
+        more toggles?"""
+
+        self.buffer.flush_seconds = 0.05
+        self.toggle(1)
+
+        with patch('likebuffer.write', side_effect=[RuntimeError("database went away"), 1]) \
+                as write, self.assertLogs('likebuffer', 'ERROR'):
+            self.assertEqual(self.flush(), 0)
+            self.assertEqual(self.buffer.as_dict()['failures'], 1)
+
+            for _ in range(100):
+                if self.buffer.as_dict()['written']:
+                    break
+                sleep(0.02)
+
+        stats = self.buffer.as_dict()
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual((stats['pending'], stats['written'], stats['failures']), (0, 1, 0))
+
+    def test_refused(self):
+        self.assertEqual(self.client.post("/users/add_like/1", headers=JSON).status_code, 401)
+
+        self.login(1)
+        self.assertEqual(self.client.post("/users/add_like/1", headers=JSON).status_code, 403)
+        self.assertEqual(self.client.post("/users/add_like/99", headers=JSON).status_code, 404)
+        self.assertEqual(self.buffer.as_dict()['toggles'], 0)
+
+    def test_form_post(self):
+        """Are plain form posts still redirected?"""
+
+        self.login(2)
+        resp = self.client.post("/users/add_like/1")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.buffer.changes(2), {1: (False, True)})
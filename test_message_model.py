@@ -1,18 +1,12 @@
 """Message model tests."""
 
-import os
 import datetime
 from unittest import TestCase
 from sqlalchemy import exc
 
 from models import db, User, Message, Follows
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
 from app import app
 
-db.drop_all()
-db.create_all()
 
 class MessageModelTestCase(TestCase):
     """Test views for messages."""
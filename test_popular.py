@@ -0,0 +1,146 @@
+"""Popular messages tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_popular.py
+
+
+from datetime import datetime, timedelta
+from time import sleep
+from unittest import TestCase
+
+from models import db, Message, User, Likes, MessageScore
+from app import app, CURR_USER_KEY
+import popular
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LikeWeightTestCase(TestCase):
+    """Test forward-decay weights."""
+
+    def test_weights(self):
+        posted = datetime(2020, 1, 1)
+
+        self.assertEqual(popular.like_weight(posted, posted), 1.0)
+        self.assertAlmostEqual(
+            popular.like_weight(posted, posted + popular.POPULAR_HALF_LIFE), 2.0)
+        self.assertIsNone(
+            popular.like_weight(posted, posted + popular.POPULAR_WINDOW + timedelta(seconds=1)))
+
+
+class PopularViewTestCase(TestCase):
+    """Test keeping scores as messages are liked and ranking them."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=i, username=f"user{i}", email=f"user{i}@test.com", password="HASHED")
+            for i in range(1, 5)])
+        db.session.commit()
+
+        now = datetime.utcnow()
+        db.session.add_all([
+            Message(id=1, text="older message", user_id=1, timestamp=now - timedelta(hours=12)),
+            Message(id=2, text="newer message", user_id=1, timestamp=now - timedelta(hours=1)),
+            Message(id=3, text="ancient message", user_id=1, timestamp=now - timedelta(days=5)),
+        ])
+        db.session.commit()
+
+        app.extensions.pop('popular_messages', None)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.extensions.pop('popular_messages', None)
+        app.config.pop('POPULAR_REFRESH_SECONDS', None)
+
+    def toggle(self, user_id, message_id):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            return c.post(f"/users/add_like/{message_id}")
+
+    def test_scores_follow_likes(self):
+        """Are scores added on like and removed exactly on unlike?"""
+
+        self.toggle(2, 2)
+        self.toggle(3, 2)
+
+        score = MessageScore.query.get(2)
+        self.assertEqual(score.likes, 2)
+        self.assertGreater(score.score, 0)
+
+        self.toggle(2, 2)
+        self.toggle(3, 2)
+
+        db.session.expire_all()
+        score = MessageScore.query.get(2)
+        self.assertEqual(score.likes, 0)
+        self.assertAlmostEqual(score.score, 0.0)
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_old_likes_not_scored(self):
+        """Are likes outside the window left out of the scores?"""
+
+        self.toggle(2, 3)
+
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertIsNone(MessageScore.query.get(3))
+
+    def test_own_messages(self):
+        resp = self.toggle(1, 2)
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_ranking(self):
+        """Do fresh likes outrank more likes made hours ago?"""
+
+        older, newer = Message.query.get(1), Message.query.get(2)
+        now = datetime.utcnow()
+
+        for _ in range(3):
+            popular.note_like(older, now - timedelta(hours=11))
+        for _ in range(2):
+            popular.note_like(newer, now)
+        popular.note_like(older, now)
+        db.session.commit()
+
+        with app.app_context():
+            top = popular.TopMessages.from_db().top(10)
+
+        # Decayed: older has 1 + 3 * 2**(-11/6) ~= 1.8, newer has 2.
+        self.assertEqual(top, [(2, 2), (1, 4)])
+
+    def test_popular_page(self):
+        self.toggle(2, 2)
+
+        resp = self.client.get("/popular")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("newer message", html)
+        self.assertNotIn("older message", html)
+
+    def test_background_refresh(self):
+        """Is a stale snapshot served while a new one loads in the background?"""
+
+        app.config['POPULAR_REFRESH_SECONDS'] = 0
+
+        with app.app_context():
+            self.assertEqual(popular.get_top_messages().top(10), [])
+
+            self.toggle(2, 2)
+
+            self.assertEqual(popular.get_top_messages().top(10), [])
+
+            for _ in range(100):
+                if not app.extensions.get('popular_refreshing'):
+                    break
+                sleep(0.05)
+
+            self.assertEqual(app.extensions['popular_messages'].top(10), [(2, 1)])
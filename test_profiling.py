@@ -0,0 +1,185 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_profiling.py
+
+
+import json
+import os
+import shutil
+import tempfile
+from threading import Event, Thread
+from time import sleep
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import app
+import profiling
+
+
+def wait_for(started, done):
+    started.set()
+    done.wait(1)
+
+
+class ProfileFormatTestCase(TestCase):
+    """Test categorizing and writing out samples."""
+
+    def setUp(self):
+        self.profile = profiling.RequestProfile("GET /users", 'header')
+        self.profile.elapsed = 0.25
+        self.profile.samples.update({
+            (('homepage', '/app/app.py', 10),
+             ('execute', '/lib/sqlalchemy/engine/base.py', 20)): 3,
+            (('homepage', '/app/app.py', 10),
+             ('render', '/lib/jinja2/environment.py', 30)): 2,
+            (('homepage', '/app/app.py', 10),
+             ('root', '/app/templates/users/index.html', 1),
+             ('execute', '/lib/sqlalchemy/engine/base.py', 20)): 4,
+            (('homepage', '/app/app.py', 10),): 1,
+        })
+
+    def test_categories(self):
+        """Is each sample filed under its innermost SQL or template frame?"""
+
+        self.assertEqual(self.profile.breakdown(),
+                         {'sql': 7, 'template': 2, 'python': 1})
+        self.assertEqual(self.profile.summary(),
+                         "10 samples: sql 70%, template 20%, python 10%")
+
+    def test_collapsed(self):
+        lines = profiling.collapsed(self.profile).splitlines()
+
+        self.assertEqual(len(lines), 4)
+        self.assertIn("[sql];homepage (app.py:10);execute (base.py:20) 3", lines)
+        self.assertIn("[python];homepage (app.py:10) 1", lines)
+
+    def test_speedscope(self):
+        data = profiling.speedscope(self.profile)
+        profile = data['profiles'][0]
+        frames = data['shared']['frames']
+
+        self.assertEqual(profile['type'], 'sampled')
+        self.assertEqual(sorted(profile['weights']), [1, 2, 3, 4])
+        self.assertEqual(profile['endValue'], 10)
+        self.assertIn("sql 70%", profile['name'])
+
+        stack = profile['samples'][profile['weights'].index(3)]
+        self.assertEqual([frames[i]['name'] for i in stack], ["[sql]", "homepage", "execute"])
+
+
+class SamplerTestCase(TestCase):
+    """Test sampling another thread's stack."""
+
+    def test_samples_thread(self):
+        sampler = profiling.Sampler(0.001)
+        started, done = Event(), Event()
+        profiles = []
+
+        def request():
+            profiles.append(profiling.RequestProfile("GET /", 'header'))
+            sampler.add(profiles[0])
+            wait_for(started, done)
+
+        thread = Thread(target=request)
+        thread.start()
+        started.wait(1)
+        sleep(0.05)
+        done.set()
+        thread.join()
+        sampler.remove(profiles[0])
+
+        stacks = list(profiles[0].samples)
+        self.assertTrue(stacks)
+        self.assertTrue(any(name == 'wait_for'
+                            for stack in stacks for name, _, _ in stack))
+
+        # The thread stops once there's nothing left to sample.
+        sleep(0.05)
+        self.assertIsNone(sampler._thread)
+
+
+class ProfileRequestTestCase(TestCase):
+    """Test which requests are profiled and written out."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = patch.dict(app.config, PROFILE_DIR=self.tmp, PROFILE_TOKEN="let-me-in",
+                                 PROFILE_SAMPLE_RATE=0.0, PROFILE_SLOW_MS=None)
+        self.config.start()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.config.stop()
+        shutil.rmtree(self.tmp)
+
+    def get(self, **headers):
+        resp = self.client.get("/signup", headers=headers, buffered=True)
+        self.assertEqual(resp.status_code, 200)
+        return sorted(os.listdir(self.tmp))
+
+    def test_not_profiled(self):
+        self.assertEqual(self.get(), [])
+
+    def test_header(self):
+        files = self.get(**{'X-Profile': "let-me-in"})
+
+        self.assertEqual(len(files), 1)
+        self.assertIn("GET-signup", files[0])
+        self.assertTrue(files[0].endswith("-header.collapsed.txt"))
+
+    def test_header_wrong_token(self):
+        self.assertEqual(self.get(**{'X-Profile': "guess"}), [])
+
+    def test_header_without_token(self):
+        app.config['PROFILE_TOKEN'] = None
+
+        self.assertEqual(self.get(**{'X-Profile': ""}), [])
+
+    def test_sample_rate(self):
+        app.config['PROFILE_SAMPLE_RATE'] = 0.01
+
+        with patch('profiling.random.random', return_value=0.5):
+            self.assertEqual(self.get(), [])
+
+        with patch('profiling.random.random', return_value=0.001):
+            files = self.get()
+
+        self.assertEqual(len(files), 1)
+        self.assertIn("-sampled.", files[0])
+
+    def test_slow_threshold(self):
+        app.config['PROFILE_SLOW_MS'] = 60000
+        self.assertEqual(self.get(), [])
+
+        app.config['PROFILE_SLOW_MS'] = 0
+        files = self.get()
+
+        self.assertEqual(len(files), 1)
+        self.assertIn("-slow.", files[0])
+
+    def test_view_raises(self):
+        """Is a request whose view raised still written out, and no longer sampled?"""
+
+        app.config['PROPAGATE_EXCEPTIONS'] = True
+
+        def fail():
+            raise RuntimeError("boom")
+
+        with patch.dict(app.view_functions, signup=fail):
+            with self.assertRaises(RuntimeError):
+                self.client.get("/signup", headers={'X-Profile': "let-me-in"})
+
+        files = os.listdir(self.tmp)
+        self.assertEqual(len(files), 1)
+        self.assertIn("GET-signup", files[0])
+        self.assertEqual(app.extensions['profiler']._profiles, {})
+
+    def test_speedscope_format(self):
+        app.config['PROFILE_FORMAT'] = 'speedscope'
+        files = self.get(**{'X-Profile': "let-me-in"})
+
+        self.assertTrue(files[0].endswith(".speedscope.json"))
+        with open(os.path.join(self.tmp, files[0])) as f:
+            self.assertEqual(json.load(f)['profiles'][0]['type'], 'sampled')
@@ -0,0 +1,111 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+from app import app, CURR_USER_KEY
+import replicas
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test routing reads to a replica, with a SQLite file as the replica."""
+
+    def setUp(self):
+        """Create a primary and a replica that disagree about their data."""
+
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=1, username="reader", email="reader@test.com", password="HASHED"),
+            User(id=2, username="on_primary", email="primary@test.com", password="HASHED"),
+        ])
+        db.session.commit()
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        replica_uri = f"sqlite:///{os.path.join(self.tmpdir.name, 'replica.db')}"
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = [replica_uri]
+        (replica,) = replicas.replica_engines(app)
+
+        db.metadata.create_all(bind=replica)
+        replica.execute(User.__table__.insert(), [
+            dict(id=1, username="reader", email="reader@test.com", password="HASHED"),
+            dict(id=3, username="on_replica", email="replica@test.com", password="HASHED"),
+        ])
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        """Switch replicas off again."""
+
+        db.session.rollback()
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        replicas.replica_engines(app)
+        app.config['REPLICA_STICKY_SECONDS'] = 5
+
+        # Don't leave a follow graph loaded from the replica behind.
+        app.extensions.pop('follow_graph', None)
+
+        self.tmpdir.cleanup()
+
+    def test_get_reads_replica(self):
+        """Are GET requests served from the replica?"""
+
+        with self.client as c:
+            html = c.get("/users").get_data(as_text=True)
+
+            self.assertIn("@on_replica", html)
+            self.assertNotIn("@on_primary", html)
+
+    def test_post_writes_primary(self):
+        """Do POSTs write to (and read from) the primary?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post("/messages/new", data={"text": "written to primary"})
+            self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(Message.query.filter_by(user_id=1).count(), 1)
+
+    def test_read_your_writes(self):
+        """After a POST, do GETs read from the primary until the window ends?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/messages/new", data={"text": "fresh message"})
+
+            html = c.get("/users/1").get_data(as_text=True)
+            self.assertIn("fresh message", html)
+
+            with c.session_transaction() as sess:
+                sess[replicas.READ_PRIMARY_UNTIL_KEY] = 0
+
+            html = c.get("/users/1").get_data(as_text=True)
+            self.assertNotIn("fresh message", html)
+
+    def test_no_replicas_configured(self):
+        """Without replicas, do GETs read from the primary?"""
+
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+
+        with self.client as c:
+            html = c.get("/users").get_data(as_text=True)
+
+            self.assertIn("@on_primary", html)
+            self.assertNotIn("@on_replica", html)
@@ -0,0 +1,152 @@
+"""Message search tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_search.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+
+from models import db, Message, User
+from app import app, CURR_USER_KEY
+import queries
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MessageSearchTestCase(TestCase):
+    """Test searching message text."""
+
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add(User(id=1, username="testuser", email="test@test.com",
+                            password="HASHED"))
+        db.session.commit()
+
+        db.session.add_all([
+            Message(id=1, text="Birds are singing this morning", user_id=1),
+            Message(id=2, text="A bird sang; birds sing, and the bird flew", user_id=1),
+            Message(id=3, text="Nothing to see here", user_id=1),
+        ])
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search(self, q, **kwargs):
+        with app.test_request_context():
+            return queries.search_messages(q, **kwargs)
+
+    def test_ranked_matches(self):
+        """Are stemmed matches found, best match first?"""
+
+        rows = self.search("bird")
+
+        self.assertEqual([row.id for row in rows], [2, 1])
+        self.assertGreater(rows[0].rank, rows[1].rank)
+        self.assertEqual(rows[0].username, "testuser")
+
+    def test_search_syntax(self):
+        """Are phrases and excluded words supported?"""
+
+        self.assertEqual([row.id for row in self.search('"birds sing"')], [2])
+        self.assertEqual([row.id for row in self.search("bird -morning")], [2])
+        self.assertEqual(self.search("   "), [])
+
+    def test_pagination(self):
+        """Does the cursor continue where the previous page ended?"""
+
+        db.session.add_all([Message(id=i, text=f"warble number {i}", user_id=1)
+                            for i in range(10, 15)])
+        db.session.commit()
+
+        first = self.search("warble", limit=3)
+        cursor = queries.search_next_cursor(first, 3)
+        rest = self.search("warble", after=queries.parse_search_cursor(cursor), limit=3)
+
+        self.assertEqual([row.id for row in first + rest], [14, 13, 12, 11, 10])
+        self.assertIsNone(queries.search_next_cursor(rest, 3))
+
+    def test_ranks_every_match(self):
+        """Is an old best match found among many newer weaker ones?"""
+
+        db.session.add(Message(id=10, text="warble warble warble", user_id=1))
+        db.session.add_all([Message(id=i, text=f"a warble and other words {i}", user_id=1)
+                            for i in range(11, 21)])
+        db.session.commit()
+
+        self.assertEqual(self.search("warble", limit=1)[0].id, 10)
+        self.assertEqual(self.search("warble", limit=1, max_candidates=5)[0].id, 20)
+
+        with app.test_request_context():
+            self.assertTrue(queries.search_truncated("warble", 5))
+            self.assertFalse(queries.search_truncated("warble", 11))
+            self.assertFalse(queries.search_truncated("warble", None))
+
+    def test_search_page_truncated(self):
+        """Does the search page say when matches were left out?"""
+
+        with patch.dict(app.config, SEARCH_MAX_CANDIDATES=1):
+            html = self.client.get("/messages/search?q=bird").get_data(as_text=True)
+
+        self.assertIn('id="search-truncated"', html)
+        self.assertNotIn('id="search-truncated"',
+                         self.client.get("/messages/search?q=bird").get_data(as_text=True))
+
+    def test_index_follows_writes(self):
+        """Do added and deleted messages show up in results straight away?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/messages/new", data={"text": "Penguins cannot fly"})
+            self.assertEqual(len(self.search("penguin")), 1)
+
+            (row,) = self.search("penguin")
+            c.post(f"/messages/{row.id}/delete")
+            self.assertEqual(self.search("penguin"), [])
+
+    def test_search_page(self):
+        """Does the search page list matching messages?"""
+
+        resp = self.client.get("/messages/search?q=birds")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Birds are singing", html)
+        self.assertNotIn("Nothing to see here", html)
+
+    def test_search_page_bad_cursor(self):
+        resp = self.client.get("/messages/search?q=birds&cursor=nope")
+
+        self.assertEqual(resp.status_code, 400)
+
+
+class SqliteSearchTestCase(TestCase):
+    """Test the word-matching fallback used on SQLite."""
+
+    def test_fallback(self):
+        engine = create_engine("sqlite://")
+        db.metadata.create_all(bind=engine)
+
+        engine.execute(User.__table__.insert(), id=1, username="u", email="e", password="p")
+        engine.execute(Message.__table__.insert(), [
+            dict(id=1, text="Birds are singing", user_id=1),
+            dict(id=2, text="100% birds", user_id=1),
+            dict(id=3, text="Nothing here", user_id=1),
+        ])
+
+        def ids(q):
+            return [row.id for row in engine.execute(queries.search_query(q, 'sqlite'))]
+
+        self.assertEqual(ids("BIRDS"), [2, 1])
+        self.assertEqual(ids("birds sing"), [1])
+        self.assertEqual(ids("100%"), [2])
@@ -0,0 +1,156 @@
+"""Server-side session tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_sessions.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User
+from app import app, CURR_USER_KEY
+import sessions
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StoreTestCase(TestCase):
+    """Test the memory and SQLite stores."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def check_store(self, store):
+        store.set("a", b"one", 1, 60)
+        store.set("b", b"two", 1, 60)
+        store.set("c", b"three", None, 60)
+
+        self.assertEqual(store.get("a"), b"one")
+        self.assertIsNone(store.get("nope"))
+
+        store.delete_user(1)
+        self.assertIsNone(store.get("a"))
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("c"), b"three")
+
+        store.delete("c")
+        self.assertIsNone(store.get("c"))
+
+        store.set("d", b"old", None, -1)
+        self.assertIsNone(store.get("d"))
+
+    def test_memory(self):
+        self.check_store(sessions.MemoryStore())
+
+    def test_sqlite(self):
+        self.check_store(sessions.SQLiteStore(os.path.join(self.tmp, "sessions.db")))
+
+    def test_memory_lru(self):
+        store = sessions.MemoryStore(max_entries=2)
+        store.set("a", b"1", None, 60)
+        store.set("b", b"2", None, 60)
+        store.get("a")
+        store.set("c", b"3", None, 60)
+
+        self.assertEqual(store.get("a"), b"1")
+        self.assertIsNone(store.get("b"))
+
+    def test_incomplete_store(self):
+        """Is a store missing methods refused when it's created?"""
+
+        class GetOnlyStore(sessions.SessionStore):
+            def get(self, sid):
+                return None
+
+        with self.assertRaises(TypeError):
+            GetOnlyStore()
+
+    def test_unknown_backend(self):
+        with patch.dict(app.config, SESSION_BACKEND='redis'):
+            with self.assertRaises(ValueError):
+                sessions.init_app(app, CURR_USER_KEY)
+
+
+class ServerSessionViewTestCase(TestCase):
+    """Test logging in and out with sessions kept server-side."""
+
+    def setUp(self):
+        User.query.delete()
+        self.user = User.signup("alice", "alice@test.com", "password", None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        self.cookie_interface = app.session_interface
+        self.interface = app.session_interface = sessions.ServerSessionInterface(
+            sessions.MemoryStore(), CURR_USER_KEY)
+
+    def tearDown(self):
+        app.session_interface = self.cookie_interface
+        db.session.rollback()
+
+    def cookie(self, client):
+        cookies = {cookie.name: cookie.value for cookie in client.cookie_jar}
+        return cookies.get(app.session_cookie_name)
+
+    def login(self):
+        client = app.test_client()
+        client.post("/login", data={"username": "alice", "password": "password"})
+        return client
+
+    def test_login(self):
+        """Does the cookie only hold an id, replaced on login?"""
+
+        client = app.test_client()
+        client.get("/login")
+        with client.session_transaction() as sess:
+            sess['visited'] = True
+        before = self.cookie(client)
+
+        client.post("/login", data={"username": "alice", "password": "password"})
+        after = self.cookie(client)
+
+        self.assertNotEqual(before, after)
+        self.assertEqual(len(after), 43)
+        self.assertIsNone(self.interface.store.get(before))
+
+        with client.session_transaction() as sess:
+            self.assertEqual(sess[CURR_USER_KEY], self.user_id)
+            self.assertTrue(sess['visited'])
+
+    def test_written_only_when_modified(self):
+        client = self.login()
+        client.get("/")
+
+        writes = self.interface.stats.as_dict()['writes']
+        resp = client.get("/users")
+
+        self.assertEqual(self.interface.stats.as_dict()['writes'], writes)
+        self.assertIn("session-read;dur=", resp.headers['Server-Timing'])
+        self.assertNotIn("session-write", resp.headers['Server-Timing'])
+
+    def test_logout_everywhere(self):
+        laptop, phone = self.login(), self.login()
+
+        self.assertIn("@alice", phone.get("/").get_data(as_text=True))
+
+        laptop.post("/logout/everywhere")
+
+        self.assertNotIn("@alice", phone.get("/").get_data(as_text=True))
+        self.assertNotIn("@alice", laptop.get("/").get_data(as_text=True))
+
+    def test_logout_everywhere_cookie_sessions(self):
+        app.session_interface = self.cookie_interface
+
+        client = self.login()
+        resp = client.post("/logout/everywhere", follow_redirects=True)
+
+        self.assertIn("cookie sessions", resp.get_data(as_text=True))
+        with client.session_transaction() as sess:
+            self.assertEqual(sess[CURR_USER_KEY], self.user_id)
@@ -0,0 +1,182 @@
+"""Slow query log tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_slowlog.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+
+from models import db
+from app import app
+import slowlog
+
+
+class FingerprintTestCase(TestCase):
+    """Test normalizing statements and parameters."""
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slowlog.fingerprint(
+                "SELECT m.id, m.text::text FROM messages AS m\n"
+                "WHERE m.user_id IN (%(user_id_1)s, %(user_id_2)s) "
+                "AND m.text != 'it''s' AND m.id > 5 LIMIT %(param_1)s"),
+            "SELECT m.id, m.text::text FROM messages AS m "
+            "WHERE m.user_id IN (...) AND m.text != ? AND m.id > ? LIMIT ?")
+
+    def test_in_lists_share_fingerprint(self):
+        self.assertEqual(slowlog.fingerprint("SELECT 1 FROM t WHERE a IN (?, ?)"),
+                         slowlog.fingerprint("SELECT 1 FROM t WHERE a IN (:a1, :a2, :a3)"))
+
+    def test_parameter_shape(self):
+        self.assertEqual(slowlog.parameter_shape({'a': 1, 'b': 2, 'c': "x"}), "2 int, 1 str")
+        self.assertEqual(slowlog.parameter_shape((1.5,)), "1 float")
+        self.assertEqual(slowlog.parameter_shape({}), "none")
+        self.assertEqual(slowlog.parameter_shape([{'a': 1}] * 3, executemany=True),
+                         "3 rows of 1 int")
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test aggregating slow statements."""
+
+    def test_aggregates(self):
+        log = slowlog.SlowQueryLog(10)
+        log.record("SELECT ?", "1 int", 20, "GET /", "app.py:1 (home)")
+        log.record("SELECT ?", "1 int", 40, "GET /users", "app.py:1 (home)")
+        log.record("SELECT ?", "2 int", 15, "GET /", "app.py:1 (home)")
+
+        first, second = log.top()
+
+        self.assertEqual(first['parameters'], "1 int")
+        self.assertEqual(first['count'], 2)
+        self.assertEqual(first['total_ms'], 60)
+        self.assertEqual(first['max_ms'], 40)
+        self.assertEqual(first['mean_ms'], 30)
+        self.assertEqual(first['routes'], {"GET /": 1, "GET /users": 1})
+        self.assertEqual(first['locations'], {"app.py:1 (home)": 2})
+        self.assertEqual(second['parameters'], "2 int")
+
+    def test_sort(self):
+        log = slowlog.SlowQueryLog(10)
+        log.record("SELECT a", "none", 50, None, None)
+        for _ in range(3):
+            log.record("SELECT b", "none", 15, None, None)
+
+        self.assertEqual([e['fingerprint'] for e in log.top(sort='max_ms')],
+                         ["SELECT a", "SELECT b"])
+        self.assertEqual([e['fingerprint'] for e in log.top(sort='count')],
+                         ["SELECT b", "SELECT a"])
+        self.assertEqual(len(log.top(limit=1)), 1)
+
+        with self.assertRaises(ValueError):
+            log.top(sort='fingerprint')
+
+    def test_bounded(self):
+        """Does a full log drop the fingerprint with the least total time?"""
+
+        log = slowlog.SlowQueryLog(10, max_entries=2)
+        log.record("SELECT a", "none", 50, None, None)
+        log.record("SELECT b", "none", 20, None, None)
+        log.record("SELECT c", "none", 30, None, None)
+
+        self.assertEqual([e['fingerprint'] for e in log.top()], ["SELECT a", "SELECT c"])
+        self.assertEqual(log.as_dict()['evicted'], 1)
+
+
+class InstallTestCase(TestCase):
+    """Test timing an engine's statements."""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.log = slowlog.SlowQueryLog(0)
+        slowlog.install(self.engine, self.log)
+
+    def test_records_statements(self):
+        self.engine.execute("SELECT ?, ?", (1, "x"))
+        self.engine.execute("SELECT ?, ?", (2, "y"))
+
+        entry, = [e for e in self.log.top() if e['fingerprint'] == "SELECT ?, ?"]
+
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(entry['parameters'], "1 int, 1 str")
+        self.assertEqual(entry['routes'], {None: 2})
+        self.assertEqual(len(entry['locations']), 2)
+        for location in entry['locations']:
+            self.assertTrue(location.startswith("test_slowlog.py:"))
+            self.assertTrue(location.endswith("(test_records_statements)"))
+
+    def test_threshold(self):
+        self.log.threshold_ms = 60000
+        self.engine.execute("SELECT 1")
+
+        self.assertEqual(self.log.top(), [])
+
+    def test_failed_statement(self):
+        with self.assertRaises(Exception):
+            self.engine.execute("SELECT * FROM nowhere")
+
+        self.engine.execute("SELECT 1")
+        self.assertEqual(self.log.top()[0]['fingerprint'], "SELECT ?")
+
+
+class AdminSlowQueriesTestCase(TestCase):
+    """Test the admin endpoint."""
+
+    def setUp(self):
+        self.config = patch.dict(app.config, ADMIN_TOKEN="admin-secret")
+        self.config.start()
+        self.log = db.engine.slow_queries
+        self.log.reset()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.config.stop()
+        self.log.threshold_ms = app.config['DB_SLOW_QUERY_MS']
+        self.log.reset()
+
+    def get(self, url="/admin/slow-queries", token="admin-secret"):
+        return self.client.get(url, headers={'Authorization': f"Bearer {token}"})
+
+    def test_disabled_without_token(self):
+        app.config['ADMIN_TOKEN'] = None
+
+        self.assertEqual(self.get(token="None").status_code, 404)
+
+    def test_wrong_token(self):
+        self.assertEqual(self.get(token="guess").status_code, 403)
+        self.assertEqual(self.client.get("/admin/slow-queries").status_code, 403)
+
+    def test_lists_slow_queries(self):
+        self.log.threshold_ms = 0
+        self.client.get("/users/9999")
+        self.log.threshold_ms = 60000
+
+        resp = self.get("/admin/slow-queries?sort=count&limit=50")
+        self.assertEqual(resp.status_code, 200)
+
+        queries = resp.json['primary']['queries']
+        routes = {route for entry in queries for route in entry['routes']}
+        self.assertIn("GET /users/<int:user_id>", routes)
+        self.assertTrue(any("FROM users" in entry['fingerprint'] for entry in queries))
+
+    def test_bad_sort(self):
+        self.assertEqual(self.get("/admin/slow-queries?sort=nope").status_code, 400)
+
+    def test_bad_limit(self):
+        for limit in ("lots", "-5"):
+            resp = self.get(f"/admin/slow-queries?limit={limit}")
+
+            self.assertEqual(resp.status_code, 400)
+            self.assertNotIn("invalid literal", resp.get_data(as_text=True))
+
+    def test_reset(self):
+        self.log.record("SELECT ?", "none", 500, None, None)
+
+        resp = self.client.delete("/admin/slow-queries",
+                                  headers={'Authorization': "Bearer admin-secret"})
+
+        self.assertEqual(resp.status_code, 204)
+        self.assertEqual(self.log.top(), [])
@@ -0,0 +1,166 @@
+"""Hashtag and mention tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_tags.py
+
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Message, User, MessageTag, Mention, TagCount
+from app import app, CURR_USER_KEY
+import queries
+import tags
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ParseTestCase(TestCase):
+    """Test pulling tags and mentions out of message text."""
+
+    def test_parse_tags(self):
+        self.assertEqual(tags.parse_tags("#Flask and #python, #flask again"),
+                         ["flask", "python"])
+        self.assertEqual(tags.parse_tags("no tags, issue#5 or ##double"), [])
+
+    def test_parse_mentions(self):
+        self.assertEqual(tags.parse_mentions("hi @alice and @bob_2, bye @alice"),
+                         ["alice", "bob_2"])
+        self.assertEqual(tags.parse_mentions("mail me at me@example.com"), [])
+
+
+class TagViewTestCase(TestCase):
+    """Test indexing tags and mentions as messages are posted and deleted."""
+
+    def setUp(self):
+        TagCount.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        db.session.add_all([
+            User(id=1, username="alice", email="alice@test.com", password="HASHED"),
+            User(id=2, username="bob", email="bob@test.com", password="HASHED"),
+        ])
+        db.session.commit()
+
+        app.extensions.pop('trending_tags', None)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.extensions.pop('trending_tags', None)
+
+    def post(self, text, user_id=1):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one().id
+
+    def test_index_on_post(self):
+        """Are tags and mentions stored when a message is posted?"""
+
+        message_id = self.post("Hello @bob and @nobody, #Flask #flask #web")
+
+        self.assertEqual(
+            sorted(tag for (tag,) in db.session.query(MessageTag.tag)
+                   .filter_by(message_id=message_id)),
+            ["flask", "web"])
+        self.assertEqual(
+            [user_id for (user_id,) in db.session.query(Mention.user_id)
+             .filter_by(message_id=message_id)],
+            [2])
+
+    def test_counters(self):
+        """Are hourly counters bumped on post and decremented on delete?"""
+
+        first = self.post("#flask one")
+        self.post("#flask #web two")
+
+        counts = dict(db.session.query(TagCount.tag, TagCount.count))
+        self.assertEqual(counts, {"flask": 2, "web": 1})
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post(f"/messages/{first}/delete")
+
+        counts = dict(db.session.query(TagCount.tag, TagCount.count))
+        self.assertEqual(counts, {"flask": 1, "web": 1})
+        self.assertEqual(MessageTag.query.filter_by(message_id=first).count(), 0)
+
+    def test_trending(self):
+        """Are trending tags summed over the last day's counters only?"""
+
+        now = tags.hour_of(datetime.utcnow())
+        TagCount.increment(now, ["flask", "web"])
+        TagCount.increment(now - timedelta(hours=3), ["web"], by=2)
+        TagCount.increment(now - timedelta(hours=30), ["old"], by=10)
+        db.session.commit()
+
+        with app.test_request_context():
+            trending = [(row.tag, row.count) for row in tags.trending_tags()]
+
+        self.assertEqual(trending, [("web", 3), ("flask", 1)])
+
+    def test_trending_cached_for_the_hour(self):
+        """Is the trending list computed once per hour?"""
+
+        with app.test_request_context():
+            self.assertEqual(tags.trending_tags(), [])
+
+            TagCount.increment(tags.hour_of(datetime.utcnow()), ["flask"])
+            db.session.commit()
+            self.assertEqual(tags.trending_tags(), [])
+
+            later = datetime.utcnow() + timedelta(hours=1)
+            with patch('tags.datetime') as mock_datetime:
+                mock_datetime.utcnow.return_value = later
+                self.assertEqual([row.tag for row in tags.trending_tags()], ["flask"])
+
+    def test_tag_page(self):
+        """Does the tag page list tagged messages and paginate?"""
+
+        ids = [self.post(f"#flask number {i}") for i in range(5)]
+        self.post("#web only")
+
+        with patch.object(queries, 'TIMELINE_LIMIT', 3):
+            resp = self.client.get("/tags/Flask")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("#flask number 4", html)
+            self.assertNotIn("#flask number 1", html)
+            self.assertNotIn("#web only", html)
+            self.assertIn("?cursor=", html)
+
+        rows = queries.tag_timeline("flask", limit=3)
+        rest = queries.tag_timeline(
+            "flask", before=queries.parse_timeline_cursor(
+                queries.timeline_next_cursor(rows, 3)), limit=3)
+
+        self.assertEqual([row.id for row in rows + rest], ids[::-1])
+
+    def test_tag_page_bad_cursor(self):
+        self.assertEqual(self.client.get("/tags/flask?cursor=nope").status_code, 400)
+
+    def test_mentions_page(self):
+        """Does the mentions page list messages mentioning the user?"""
+
+        self.post("hey @bob", user_id=1)
+        self.post("hey @alice", user_id=2)
+
+        resp = self.client.get("/users/2/mentions")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("hey @bob", html)
+        self.assertNotIn("hey @alice", html)
+
+        self.assertEqual(self.client.get("/users/999/mentions").status_code, 404)
@@ -0,0 +1,63 @@
+"""Template precompilation tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_templating.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import app
+import templating
+
+
+class TemplatingTestCase(TestCase):
+    """Test sharing compiled templates through the bytecode cache."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.default_cache = app.jinja_env.bytecode_cache
+        app.jinja_env.bytecode_cache = templating.SharedBytecodeCache(self.cache_dir)
+        app.jinja_env.cache.clear()
+
+    def tearDown(self):
+        app.jinja_env.bytecode_cache = self.default_cache
+        app.jinja_env.cache.clear()
+        shutil.rmtree(self.cache_dir)
+
+    def test_warm(self):
+        """Are all templates loaded and written to the cache?"""
+
+        count, _ = templating.warm(app)
+        names = app.jinja_loader.list_templates()
+
+        self.assertEqual(count, len(names))
+        self.assertIn('messages/popular.html', names)
+        self.assertEqual(len(os.listdir(self.cache_dir)), count)
+        self.assertEqual(len(app.jinja_env.cache), count)
+
+    def test_compiled_once(self):
+        """Does a fresh process load compiled templates instead of compiling?"""
+
+        templating.warm(app)
+        app.jinja_env.cache.clear()
+
+        with patch.object(app.jinja_env, 'compile', side_effect=AssertionError("compiled")):
+            count, _ = templating.warm(app)
+
+        self.assertEqual(len(app.jinja_env.cache), count)
+
+    def test_compile_all(self):
+        """Does the deploy step fill the cache without loading templates?"""
+
+        count = templating.compile_all(app)
+
+        self.assertEqual(len(os.listdir(self.cache_dir)), count)
+        self.assertEqual(len(app.jinja_env.cache), 0)
+
+    def test_no_reload_in_production(self):
+        self.assertFalse(app.jinja_env.auto_reload)
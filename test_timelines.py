@@ -0,0 +1,212 @@
+"""Shared home timeline cache tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_timelines.py
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, Message, User, Follows
+from app import app, CURR_USER_KEY
+import timelines
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class TimelineCacheTestCase(TestCase):
+    """Test the rings in the shared file."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "timelines.bin")
+        self.cache = timelines.TimelineCache(self.path, slots=4, capacity=3)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+
+    def fill(self, user_id, message_ids, cache=None):
+        cache = cache or self.cache
+        return cache.fill(user_id, message_ids, cache.version(user_id))
+
+    def test_fill(self):
+        self.assertIsNone(self.cache.get(1))
+
+        self.assertTrue(self.fill(1, [30, 20, 10, 5]))
+
+        self.assertEqual(self.cache.get(1), [30, 20, 10])
+
+    def test_push(self):
+        """Do new messages go in front, pushing out the oldest?"""
+
+        self.fill(1, [20, 10])
+        self.cache.push([1], 30)
+        self.assertEqual(self.cache.get(1), [30, 20, 10])
+
+        self.cache.push([1], 40)
+        self.cache.push([1], 40)
+        self.assertEqual(self.cache.get(1), [40, 30, 20])
+
+    def test_push_locks_stripes(self):
+        """Are a message's followers' slots locked a stripe at a time?"""
+
+        cache = timelines.TimelineCache(os.path.join(self.tmp, "striped.bin"), slots=8,
+                                        capacity=3, stripe_slots=4)
+        try:
+            for user_id in range(1, 9):
+                self.fill(user_id, [10], cache)
+
+            with patch('timelines.fcntl.lockf', wraps=timelines.fcntl.lockf) as lockf:
+                cache.push(range(1, 9), 20)
+
+            self.assertEqual(lockf.call_count, 4)
+            self.assertEqual([cache.get(user_id) for user_id in range(1, 9)], [[20, 10]] * 8)
+        finally:
+            cache.close()
+
+    def test_push_uncached(self):
+        self.cache.push([1], 30)
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_shared_slot(self):
+        """Do users whose ids share a slot replace each other?"""
+
+        self.fill(1, [10])
+        self.fill(5, [50])
+
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(5), [50])
+
+        self.cache.push([1], 60)
+        self.assertEqual(self.cache.get(5), [50])
+
+    def test_stale_fill(self):
+        """Is a fill discarded if a message was pushed while it loaded?"""
+
+        version = self.cache.version(1)
+        self.cache.push([1], 30)
+
+        self.assertFalse(self.cache.fill(1, [20, 10], version))
+        self.assertIsNone(self.cache.get(1))
+
+    def test_invalidate(self):
+        self.fill(1, [10])
+        self.cache.invalidate([1])
+
+        self.assertIsNone(self.cache.get(1))
+
+    def test_ttl(self):
+        self.fill(1, [10])
+
+        with patch('timelines.time', return_value=timelines.time() + 301):
+            self.assertIsNone(self.cache.get(1))
+
+    def test_shared_between_processes(self):
+        subprocess.run([sys.executable, '-c', (
+            "import timelines\n"
+            f"cache = timelines.TimelineCache({self.path!r}, slots=4, capacity=3)\n"
+            "cache.fill(2, [7, 6], cache.version(2))\n"
+        )], cwd=ROOT, check=True)
+
+        self.assertEqual(self.cache.get(2), [7, 6])
+
+    def test_layout_changed(self):
+        """Is a file laid out for other settings started over?"""
+
+        self.fill(1, [10])
+        other = timelines.TimelineCache(self.path, slots=4, capacity=5)
+
+        try:
+            self.assertIsNone(other.get(1))
+            self.fill(1, [10], cache=other)
+            self.assertEqual(other.get(1), [10])
+        finally:
+            other.close()
+
+
+class HomeTimelineTestCase(TestCase):
+    """Test the homepage through the cache."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        for user_id, username in [(1, "author"), (2, "reader")]:
+            user = User.signup(username=username, email=f"{username}@test.com",
+                               password="password", image_url=None)
+            user.id = user_id
+        db.session.commit()
+
+        db.session.add(Message(id=1, text="first message", user_id=1))
+        db.session.add(Follows(user_being_followed_id=1, user_following_id=2))
+        db.session.commit()
+
+        self.tmp = tempfile.mkdtemp()
+        self.cache = timelines.TimelineCache(os.path.join(self.tmp, "timelines.bin"))
+        app.extensions['timeline_cache'] = self.cache
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.extensions['timeline_cache'] = None
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def homepage(self):
+        self.login(2)
+        resp = self.client.get("/")
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_filled_on_first_visit(self):
+        self.assertIn("first message", self.homepage())
+        self.assertEqual(self.cache.get(2), [1])
+
+        with patch('queries.home_timeline') as home_timeline:
+            self.assertIn("first message", self.homepage())
+
+        home_timeline.assert_not_called()
+
+    def test_new_message(self):
+        """Is a new message pushed to its author's followers?"""
+
+        self.homepage()
+
+        self.login(1)
+        self.client.post("/messages/new", data={"text": "second message"})
+
+        message_id = Message.query.filter_by(text="second message").one().id
+        self.assertEqual(self.cache.get(2), [message_id, 1])
+        self.assertIn("second message", self.homepage())
+
+    def test_deleted_message(self):
+        self.homepage()
+
+        self.login(1)
+        self.client.post("/messages/1/delete")
+
+        self.assertIsNone(self.cache.get(2))
+        self.assertNotIn("first message", self.homepage())
+
+    def test_unfollow(self):
+        self.homepage()
+
+        self.client.post("/users/stop-following/1")
+
+        self.assertIsNone(self.cache.get(2))
+        self.assertNotIn("first message", self.homepage())
@@ -2,31 +2,15 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_user_views.py
+#    FLASK_ENV=production python -m pytest test_user_views.py
 
 
-import os
 from unittest import TestCase
+from unittest.mock import patch
 
-from models import db, connect_db, Message, User, Likes
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-
-# Now we can import app
-
+from models import db, connect_db, Message, User, Likes, Follows
 from app import app, CURR_USER_KEY
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
+import queries
 
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
@@ -404,6 +388,45 @@ class UserViewTestCase(TestCase):
             html = resp.get_data(as_text=True)
             self.assertNotIn("@testuser3", html)
 
+    def test_show_following_follow_state(self):
+        """Do following cards show the viewer's own follow state?"""
+
+        with self.client as c:
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser3.id
+
+            resp = c.get(f"/users/{self.testuser3.id}/following")
+
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'action="/users/stop-following/{self.testuser2.id}"', html)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/users/{self.testuser3.id}/following")
+
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'action="/users/follow/{self.testuser2.id}"', html)
+
+    def test_show_following_paginated(self):
+        """Does the following page link to the next page when it is full?"""
+
+        with self.client as c:
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with patch.object(queries, 'CONNECTIONS_LIMIT', 1):
+                resp = c.get(f"/users/{self.testuser3.id}/following")
+
+            html = resp.get_data(as_text=True)
+            self.assertIn("@testuser2", html)
+            self.assertIn("?cursor=", html)
+
+            resp = c.get(f"/users/{self.testuser3.id}/following", query_string={"cursor": "bad"})
+            self.assertEqual(resp.status_code, 400)
+
     def test_show_likes_logged_in(self):
         """Can a user view anotehr user's liked messages?"""
 
@@ -418,6 +441,7 @@ class UserViewTestCase(TestCase):
 
             html = resp.get_data(as_text=True)
             self.assertIn("test_message_views_text_1", html)
+            self.assertIn(f'<a href="/users/{self.testuser.id}">@testuser</a>', html)
 
     def test_show_likes_logged_in_none_case(self):
         """Can a user view another user's empty liked messages page?"""
@@ -436,6 +460,75 @@ class UserViewTestCase(TestCase):
             self.assertIn('<ul class="list-group" id="messages">\n\n      \n\n    </ul>', html)
 
 
+    def test_homepage_timeline(self):
+        """Does the homepage show followed users' messages, with which are liked?"""
+
+        db.session.add(Likes(user_id=3, message_id=2))
+        db.session.add(Follows(user_being_followed_id=1, user_following_id=3))
+        db.session.commit()
+
+        with self.client as c:
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 3
+
+            resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+
+            html = resp.get_data(as_text=True)
+            self.assertIn("test_message_views_text_1", html)
+            self.assertIn('<a href="/users/1">@testuser</a>', html)
+            self.assertEqual(html.count("btn-primary"), 1)
+            liked = html[html.index('action="/users/add_like/2"'):]
+            self.assertIn("btn-primary", liked[:liked.index("</form>")])
+
+    def test_list_pages_streamed(self):
+        """Are the long list pages streamed when STREAM_LIST_PAGES is set?"""
+
+        app.config['STREAM_LIST_PAGES'] = True
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser3.id
+
+                pages = {
+                    "/users": "@testuser2",
+                    f"/users/{self.testuser3.id}/following": "@testuser2",
+                    f"/users/{self.testuser2.id}/followers": "@testuser3",
+                    f"/users/{self.testuser2.id}/likes": "test_message_views_text_1",
+                }
+
+                for url, expected in pages.items():
+                    resp = c.get(url)
+
+                    self.assertEqual(resp.status_code, 200)
+                    self.assertTrue(resp.is_streamed)
+                    self.assertIn(expected, resp.get_data(as_text=True))
+
+        finally:
+            app.config['STREAM_LIST_PAGES'] = False
+
+    def test_list_pages_streamed_flash(self):
+        """Are flashed messages shown (and consumed) on a streamed page?"""
+
+        app.config['STREAM_LIST_PAGES'] = True
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess['_flashes'] = [("info", "Streamed flash")]
+
+                resp = c.get("/users")
+                self.assertIn("Streamed flash", resp.get_data(as_text=True))
+
+                resp = c.get("/users")
+                self.assertNotIn("Streamed flash", resp.get_data(as_text=True))
+
+        finally:
+            app.config['STREAM_LIST_PAGES'] = False
+
     def test_follow_logged_in(self):
         """Can a user follow another user?"""
 
@@ -0,0 +1,130 @@
+"""Warm-up command tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m pytest test_warmup.py
+
+
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from time import monotonic
+from unittest import TestCase
+
+import pytest
+
+from models import db, Message, User, Likes, Follows
+from app import app
+import timelines
+import warmup
+
+
+class WarmUpTestCase(TestCase):
+    """Test picking and warming the most active users."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        for user_id in (1, 2, 3):
+            user = User.signup(username=f"user{user_id}", email=f"user{user_id}@test.com",
+                               password="password", image_url=None)
+            user.id = user_id
+        db.session.commit()
+
+        now = datetime.utcnow()
+        old = now - timedelta(days=30)
+
+        db.session.add_all([
+            Message(id=1, text="recent", user_id=1, timestamp=now),
+            Message(id=2, text="recent", user_id=2, timestamp=now),
+            Message(id=3, text="old", user_id=3, timestamp=old),
+            Message(id=4, text="old", user_id=3, timestamp=old),
+        ])
+        db.session.commit()
+        db.session.add(Likes(user_id=2, message_id=1, liked_at=now))
+        db.session.commit()
+
+        self.tmp = tempfile.mkdtemp()
+        self.cache = timelines.TimelineCache(os.path.join(self.tmp, "timelines.bin"))
+        app.extensions['timeline_cache'] = self.cache
+
+    def tearDown(self):
+        app.extensions['timeline_cache'] = None
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+        db.session.rollback()
+
+    def test_active_user_ids(self):
+        since = datetime.utcnow() - timedelta(days=7)
+
+        self.assertEqual(warmup.active_user_ids(since, 10), [2, 1])
+        self.assertEqual(warmup.active_user_ids(since, 1), [2])
+
+    def test_warm_users(self):
+        """Are the users' timelines cached?"""
+
+        warmed = warmup.warm_users(app, [1, 2], 1, monotonic() + 60)
+
+        self.assertEqual(warmed, 2)
+        self.assertEqual(self.cache.get(2), [2])
+
+    def test_budget(self):
+        self.assertEqual(warmup.warm_users(app, [1, 2], 1, monotonic()), 0)
+        self.assertIsNone(self.cache.get(1))
+
+    def test_command(self):
+        result = app.test_cli_runner().invoke(args=['warm-up', '--processes', '1'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Warmed 2 of 2 active users in 1 processes", result.output)
+
+
+@pytest.mark.commits
+@pytest.mark.postgres
+class WarmUpProcessesTestCase(TestCase):
+    """Test warming users in worker processes, which need committed data."""
+
+    def setUp(self):
+        self.delete_data()
+
+        db.session.add_all([
+            User(id=1, username="author", email="author@test.com", password="HASHED"),
+            User(id=2, username="reader", email="reader@test.com", password="HASHED"),
+        ])
+        db.session.commit()
+
+        db.session.add_all([
+            Message(id=1, text="from the author", user_id=1),
+            Message(id=2, text="from the reader", user_id=2),
+            Follows(user_following_id=2, user_being_followed_id=1),
+        ])
+        db.session.commit()
+        db.session.remove()
+
+        self.tmp = tempfile.mkdtemp()
+        self.cache = timelines.TimelineCache(os.path.join(self.tmp, "timelines.bin"))
+        app.extensions['timeline_cache'] = self.cache
+
+    def tearDown(self):
+        app.extensions['timeline_cache'] = None
+        self.cache.close()
+        shutil.rmtree(self.tmp)
+        self.delete_data()
+
+    def delete_data(self):
+        Likes.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_warm_users(self):
+        """Do the worker processes fill the shared timeline cache?"""
+
+        warmed = warmup.warm_users(app, [1, 2], 2, monotonic() + 60)
+
+        self.assertEqual(warmed, 2)
+        self.assertEqual(self.cache.get(1), [1])
+        self.assertEqual(self.cache.get(2), [2, 1])
@@ -0,0 +1,302 @@
+"""Home timelines cached in a file shared by the workers on one host.
+
+The home timeline query (messages from a user and everyone they follow,
+newest first) is the most expensive query on the most visited page. With
+TIMELINE_CACHE_PATH set, each user's most recent home timeline message
+ids are kept in a memory-mapped file, so every worker process on the host
+reads and updates the same copy instead of warming its own.
+
+The file is a header followed by TIMELINE_CACHE_SLOTS fixed-size slots of
+64-bit integers. User `user_id` can only be cached in slot
+`user_id % slots`, which holds
+
+    owner      the user it currently holds (0: nobody)
+    version    odd while being written, bumped by every write
+    head       how many ids have ever been pushed into the ring
+    count      how many of the ring's ids are valid
+    filled_at  when it was filled from the database (Unix time)
+    ring       `capacity` (TIMELINE_LIMIT) message ids
+
+Readers copy a slot straight out of the mapping and retry nothing: if the
+version was odd, or changed while they were copying, it's a miss. Writers
+lock the slot's bytes in the file (for other processes) and a thread lock
+(for this one). A new message goes into the slots of every follower of
+its author, so those are locked a stripe (`stripe_slots` neighbouring
+slots) at a time rather than one by one.
+
+The cache is kept up to date by the routes that change timelines: a new
+message is pushed into the rings of its author and their followers, and
+deleting a message or following or unfollowing someone drops the
+affected slots, to be filled again from the database. Slots are also
+refilled once they are TIMELINE_CACHE_TTL seconds old, so changes made
+some other way (seeding, other hosts) show up eventually.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+from itertools import groupby
+from threading import Lock
+from time import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Follows
+import queries
+
+TIMELINE_CACHE_SLOTS = 4096
+TIMELINE_CACHE_TTL = 300
+TIMELINE_CACHE_STRIPE_SLOTS = 64
+
+WORD = 8
+
+# File header: magic number, layout version, slots, ring capacity.
+HEADER = struct.Struct('4q')
+MAGIC = int.from_bytes(b'warbltl', 'little')
+LAYOUT_VERSION = 1
+
+OWNER, VERSION, HEAD, COUNT, FILLED_AT = range(5)
+SLOT_HEADER_WORDS = 5
+
+
+def init_app(app):
+    """Set default cache settings, and open the cache if a path is set."""
+
+    app.config.setdefault('TIMELINE_CACHE_PATH', None)
+    app.config.setdefault('TIMELINE_CACHE_SLOTS', TIMELINE_CACHE_SLOTS)
+    app.config.setdefault('TIMELINE_CACHE_TTL', TIMELINE_CACHE_TTL)
+
+    path = app.config['TIMELINE_CACHE_PATH']
+    app.extensions['timeline_cache'] = TimelineCache(
+        path, slots=app.config['TIMELINE_CACHE_SLOTS'],
+        ttl=app.config['TIMELINE_CACHE_TTL']) if path else None
+
+
+class TimelineCache:
+    """Rings of recent home timeline message ids, one slot per user, in `path`."""
+
+    def __init__(self, path, slots=TIMELINE_CACHE_SLOTS, capacity=queries.TIMELINE_LIMIT,
+                 ttl=TIMELINE_CACHE_TTL, stripe_slots=TIMELINE_CACHE_STRIPE_SLOTS):
+        self.path = path
+        self.slots = slots
+        self.capacity = capacity
+        self.ttl = ttl
+        self.stripe_slots = max(1, min(stripe_slots, slots))
+        self.slot_words = SLOT_HEADER_WORDS + capacity
+        self._lock = Lock()
+
+        size = HEADER.size + slots * self.slot_words * WORD
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            header = (MAGIC, LAYOUT_VERSION, slots, capacity)
+            if (os.fstat(self._fd).st_size != size or
+                    HEADER.unpack(os.pread(self._fd, HEADER.size, 0)) != header):
+                # New, or laid out for other settings: start empty.
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(*header), 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+        self._mmap = mmap.mmap(self._fd, size)
+        self._words = memoryview(self._mmap).cast('q')
+
+    def close(self):
+        self._words.release()
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _slot(self, user_id):
+        """Index of the first word of `user_id`'s slot."""
+
+        return HEADER.size // WORD + (user_id % self.slots) * self.slot_words
+
+    @contextmanager
+    def _locked(self, first, count=1):
+        """Lock `count` slots from slot number `first` against other writers."""
+
+        start = (HEADER.size // WORD + first * self.slot_words) * WORD
+        length = count * self.slot_words * WORD
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    @contextmanager
+    def _writing(self, user_id):
+        """Lock `user_id`'s slot and mark it as being written."""
+
+        base = self._slot(user_id)
+        words = self._words
+
+        with self._locked(user_id % self.slots):
+            words[base + VERSION] += 1
+            try:
+                yield base
+            finally:
+                words[base + VERSION] += 1
+
+    def get(self, user_id):
+        """`user_id`'s cached message ids, newest first, or None on a miss."""
+
+        base = self._slot(user_id)
+        words = self._words
+
+        version = words[base + VERSION]
+        if version % 2:
+            return None
+
+        owner, _, head, count, filled_at = words[base:base + SLOT_HEADER_WORDS].tolist()
+        ring = words[base + SLOT_HEADER_WORDS:base + self.slot_words].tolist()
+
+        if words[base + VERSION] != version:
+            return None
+        if owner != user_id or time() - filled_at > self.ttl:
+            return None
+
+        return [ring[(head - i) % self.capacity] for i in range(1, count + 1)]
+
+    def version(self, user_id):
+        """The version of `user_id`'s slot, to pass to `fill`."""
+
+        return self._words[self._slot(user_id) + VERSION]
+
+    def fill(self, user_id, message_ids, version):
+        """Cache `message_ids` (newest first) as `user_id`'s timeline.
+
+        `version` is what `version(user_id)` was before they were loaded;
+        if the slot has been written since, they may already be out of
+        date, and nothing is cached. Returns whether they were.
+        """
+
+        message_ids = list(message_ids)[:self.capacity]
+        words = self._words
+
+        with self._writing(user_id) as base:
+            if words[base + VERSION] != version + 1:
+                return False
+
+            ring = base + SLOT_HEADER_WORDS
+            # Oldest first, so the newest is just before `head`.
+            words[ring:ring + len(message_ids)] = array('q', reversed(message_ids))
+            words[base + OWNER] = user_id
+            words[base + HEAD] = len(message_ids)
+            words[base + COUNT] = len(message_ids)
+            words[base + FILLED_AT] = int(time())
+            return True
+
+    def push(self, user_ids, message_id):
+        """Add a new message to the cached timelines of `user_ids`."""
+
+        # {slot: the user_ids that can be cached in it}
+        slots = {}
+        for user_id in user_ids:
+            slots.setdefault(user_id % self.slots, set()).add(user_id)
+
+        words = self._words
+        stripes = groupby(sorted(slots), key=lambda slot: slot // self.stripe_slots)
+
+        for stripe, stripe_slots in stripes:
+            first = stripe * self.stripe_slots
+            with self._locked(first, min(self.stripe_slots, self.slots - first)):
+                for slot in stripe_slots:
+                    # Written even if none of them is cached, so a fill
+                    # that started before the message was committed is
+                    # discarded.
+                    base = HEADER.size // WORD + slot * self.slot_words
+                    words[base + VERSION] += 1
+                    try:
+                        if words[base + OWNER] in slots[slot]:
+                            self._push(base, message_id)
+                    finally:
+                        words[base + VERSION] += 1
+
+    def _push(self, base, message_id):
+        """Add `message_id` to the ring at `base`, if it isn't in it yet."""
+
+        words = self._words
+
+        # Until the ring is full, its ids are the first `count`.
+        ring = base + SLOT_HEADER_WORDS
+        count = words[base + COUNT]
+        if message_id in words[ring:ring + count].tolist():
+            return
+
+        head = words[base + HEAD]
+        words[ring + head % self.capacity] = message_id
+        words[base + HEAD] = head + 1
+        words[base + COUNT] = min(count + 1, self.capacity)
+
+    def invalidate(self, user_ids):
+        """Drop the cached timelines of `user_ids`."""
+
+        for user_id in user_ids:
+            with self._writing(user_id) as base:
+                self._words[base + OWNER] = 0
+
+
+def get_cache():
+    """The current app's timeline cache, or None if it's disabled."""
+
+    return current_app.extensions.get('timeline_cache')
+
+
+def audience(user_id):
+    """`user_id` and the ids of their followers: whose timelines show their messages."""
+
+    query = select([Follows.user_following_id]).where(Follows.user_being_followed_id == user_id)
+    return [user_id] + [follower_id for (follower_id,) in db.session.execute(query)]
+
+
+def home_timeline(user_id):
+    """`queries.home_timeline(user_id)`, through the cache if there is one."""
+
+    cache = get_cache()
+    if cache is None:
+        return queries.home_timeline(user_id)
+
+    message_ids = cache.get(user_id)
+
+    if message_ids is not None:
+        # Messages pushed by concurrent requests may be slightly out of order.
+        return sorted(queries.messages_by_ids(message_ids),
+                      key=lambda row: (row.timestamp, row.id), reverse=True)
+
+    version = cache.version(user_id)
+    rows = queries.home_timeline(user_id)
+    cache.fill(user_id, [row.id for row in rows], version)
+    return rows
+
+
+def note_message(author_id, message_id):
+    """Add a new (committed) message to the timelines that show it."""
+
+    cache = get_cache()
+    if cache is not None:
+        cache.push(audience(author_id), message_id)
+
+
+def note_message_deleted(author_id):
+    """Drop the timelines that showed a (committed) deleted message by `author_id`."""
+
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(audience(author_id))
+
+
+def note_follow_change(follower_id):
+    """Drop the timeline of a user who followed or unfollowed someone."""
+
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate([follower_id])
@@ -0,0 +1,199 @@
+"""Warming up caches after a deploy or restart.
+
+After a restart every cache is cold, and the first homepage visits of the
+most active users all go to the database at once. `flask warm-up`, run
+once the new code is in place (like `python seed.py`, from the project
+directory), fills what the workers share:
+
+- templates: every template is compiled into TEMPLATE_CACHE_DIR (see
+  templating.py);
+- database buffers: with the pg_prewarm extension installed, the main
+  tables and their indexes are loaded into PostgreSQL's shared buffers;
+- users: for the WARMUP_USERS users with the most messages and likes in
+  the last WARMUP_ACTIVITY_DAYS, the queries behind their homepage and
+  profile are run (filling the shared timeline cache, if there is one;
+  see timelines.py), spread over WARMUP_PROCESSES processes.
+
+Whatever isn't done within WARMUP_BUDGET_SECONDS is skipped, so a deploy
+script can run it without risking a stall.
+
+Snapshots each worker keeps in its own memory (the follow graph, the
+popular messages) can't be filled from here; they load on first use.
+"""
+
+import multiprocessing
+import os
+from datetime import datetime, timedelta
+from time import monotonic
+
+import click
+from sqlalchemy import func, select, text, union_all
+
+from models import db, Message, Likes, Follows, User, MessageTag, Mention
+import queries
+import templating
+import timelines
+
+WARMUP_USERS = 100
+WARMUP_ACTIVITY_DAYS = 7
+WARMUP_BUDGET_SECONDS = 60
+
+# Tables (and their indexes) loaded with pg_prewarm.
+PREWARM_TABLES = [model.__table__ for model in
+                  (User, Message, Follows, Likes, MessageTag, Mention)]
+
+
+def init_app(app):
+    """Set default warm-up settings and add the CLI command."""
+
+    app.config.setdefault('WARMUP_USERS', WARMUP_USERS)
+    app.config.setdefault('WARMUP_ACTIVITY_DAYS', WARMUP_ACTIVITY_DAYS)
+    app.config.setdefault('WARMUP_PROCESSES', os.cpu_count() or 1)
+    app.config.setdefault('WARMUP_BUDGET_SECONDS', WARMUP_BUDGET_SECONDS)
+
+    @app.cli.command('warm-up')
+    @click.option('--users', type=int, default=app.config['WARMUP_USERS'],
+                  help="How many of the most active users to warm.")
+    @click.option('--days', type=float, default=app.config['WARMUP_ACTIVITY_DAYS'],
+                  help="How many days of activity to rank users by.")
+    @click.option('--processes', type=int, default=app.config['WARMUP_PROCESSES'],
+                  help="How many processes to warm users in.")
+    @click.option('--budget', type=float, default=app.config['WARMUP_BUDGET_SECONDS'],
+                  help="Seconds to stop after, whatever is left.")
+    def warm_up(users, days, processes, budget):
+        """Compile templates, prewarm tables and warm the most active users."""
+
+        start = monotonic()
+        deadline = start + budget
+
+        count = templating.compile_all(app) if app.config['TEMPLATE_CACHE_DIR'] else 0
+        click.echo(f"Compiled {count} templates")
+
+        prewarmed = prewarm_tables()
+        if prewarmed is None:
+            click.echo("Skipped prewarming tables: pg_prewarm isn't installed")
+        else:
+            click.echo(f"Prewarmed {prewarmed} pages of tables and indexes")
+
+        user_ids = active_user_ids(datetime.utcnow() - timedelta(days=days), users)
+        db.session.remove()
+
+        warmed = warm_users(app, user_ids, processes, deadline)
+        click.echo(f"Warmed {warmed} of {len(user_ids)} active users "
+                   f"in {min(processes, len(user_ids)) or 1} processes")
+
+        elapsed = monotonic() - start
+        click.echo(f"Done in {elapsed * 1000:.0f} ms"
+                   + (f" (stopped at the {budget:g} s budget)" if warmed < len(user_ids) else ""))
+
+
+def active_user_ids(since, limit):
+    """Ids of the `limit` users with the most messages and likes since `since`."""
+
+    activity = union_all(
+        select([Message.user_id.label('user_id')]).where(Message.timestamp >= since),
+        select([Likes.user_id.label('user_id')]).where(Likes.liked_at >= since),
+    ).alias('activity')
+
+    query = (select([activity.c.user_id])
+             .group_by(activity.c.user_id)
+             .order_by(func.count().desc(), activity.c.user_id)
+             .limit(limit))
+
+    return [user_id for (user_id,) in db.session.execute(query)]
+
+
+def prewarm_tables():
+    """Load the main tables and indexes into shared buffers with pg_prewarm.
+
+    Returns how many pages were loaded, or None if pg_prewarm isn't
+    available.
+    """
+
+    if db.engine.dialect.name != 'postgresql':
+        return None
+
+    installed = db.session.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")).scalar()
+    if not installed:
+        return None
+
+    names = []
+    for table in PREWARM_TABLES:
+        names.append(table.name)
+        names.extend(name for (name,) in db.session.execute(
+            text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+            {'table': table.name}))
+
+    pages = 0
+    for name in names:
+        pages += db.session.execute(
+            text("SELECT pg_prewarm(CAST(:name AS regclass))"), {'name': name}).scalar()
+    db.session.commit()
+
+    return pages
+
+
+def warm_user(user_id):
+    """Run the queries behind `user_id`'s homepage and profile."""
+
+    rows = timelines.home_timeline(user_id)
+    queries.liked_message_ids(user_id, [row.id for row in rows])
+    queries.user_profile(user_id)
+    queries.user_timeline(user_id)
+
+
+def warm_users(app, user_ids, processes, deadline):
+    """Warm `user_ids` in `processes` processes until `deadline`.
+
+    Returns how many were warmed.
+    """
+
+    if processes <= 1 or len(user_ids) <= 1:
+        with app.app_context():
+            return sum(_warm_until(user_id, deadline) for user_id in user_ids)
+
+    # Forked, so the workers share the app's settings and timeline cache.
+    # Pooled connections are closed first, so none are shared with them.
+    db.engine.dispose()
+    context = multiprocessing.get_context('fork')
+    pool = context.Pool(min(processes, len(user_ids)), _start_worker, (app,))
+    warmed = 0
+
+    try:
+        results = pool.imap_unordered(_warm_in_worker, [(user_id, deadline)
+                                                        for user_id in user_ids])
+        for _ in user_ids:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            warmed += results.next(timeout=remaining)
+    except multiprocessing.TimeoutError:
+        pass
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return warmed
+
+
+def _warm_until(user_id, deadline):
+    if monotonic() >= deadline:
+        return 0
+
+    warm_user(user_id)
+    db.session.remove()
+    return 1
+
+
+_worker_app = None
+
+
+def _start_worker(app):
+    global _worker_app
+    _worker_app = app
+
+
+def _warm_in_worker(args):
+    with _worker_app.app_context():
+        return _warm_until(*args)